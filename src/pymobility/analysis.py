@@ -0,0 +1,253 @@
+# coding: utf-8
+#
+#  Copyright (C) 2012 Istituto per l'Interscambio Scientifico I.S.I.
+#  You can contact us by email (isi@isi.it) or write to:
+#  ISI Foundation, Via Alassio 11/c, 10126 Torino, Italy.
+#
+#  This program was written by André Panisson <panisson@gmail.com>
+#
+'''
+Statistics of temporal networks: contact intervals, contact durations,
+inter-contact times and number of contacts per link, computed from the
+contacts yielded by the contact models or from contact records (t, i, j)
+such as the SocioPatterns contact lists.
+
+The contacts are undirected: the pair (i, j) is stored with i < j.
+The intervals are integer arrays with a row (i, j, start, end) per contact,
+sorted by pair and then by start, where the contact is present from step
+*start* up to step *end* (excluded), as in continuous_contacts.
+The computations are sorts and group-bys over int64 pair keys.
+'''
+import numpy as np
+from pymobility.models.contact import contact_pairs
+
+def __bits(n):
+    return max(int(n), 1).bit_length()
+
+def __run_starts(gaps, n, dt, block=2**22):
+    # the positions where a contact starts in the records sorted by pair and time, given
+    # the gaps between consecutive records (a gap that is not *dt* starts a new contact,
+    # except 0 for repeated records), computed in blocks to keep the temporary arrays small
+    starts = np.empty(n, dtype=bool)
+    starts[:1] = True
+    for a in range(1, n, block):
+        gap = gaps(a, min(a + block, n))
+        starts[a:a+len(gap)] = (gap != dt) & (gap != 0)
+    return np.flatnonzero(starts)
+
+def __group_starts(keys):
+    # the positions where a new pair starts, in an array sorted by pair key
+    starts = np.empty(len(keys), dtype=bool)
+    starts[:1] = True
+    np.not_equal(keys[1:], keys[:-1], out=starts[1:])
+    return starts
+
+def __pair_order(intervals):
+    # the intervals sorted by pair and then by start
+    intervals = np.asarray(intervals)
+    if len(intervals) == 0:
+        return intervals.reshape(0, 4)
+    i, j, start = intervals[:,0], intervals[:,1], intervals[:,2]
+    same = (i[1:] == i[:-1]) & (j[1:] == j[:-1])
+    ordered = ((i[1:] > i[:-1]) | ((i[1:] == i[:-1]) & (j[1:] > j[:-1])) | (same & (start[1:] >= start[:-1]))).all()
+    if ordered:
+        return intervals
+    return intervals[np.lexsort((start, j, i))]
+
+def contact_records(contacts):
+    '''
+    Collects a stream of contact lists into the arrays (t, i, j), with a record
+    for each pair of nodes i < j in contact at step t, counting the steps from 0.
+
+    Required arguments:
+
+      *contacts*:
+        An iterator over the contacts in each step, e.g. one of the contact models,
+        in any of their output formats (see pymobility.models.contact.contact_pairs).
+    '''
+    t, pairs = [], []
+    for step, frame in enumerate(contacts):
+        frame = contact_pairs(frame)
+        pairs.append(frame)
+        t.append(np.full(len(frame), step, dtype=np.int64))
+    if not pairs:
+        return (np.empty(0, dtype=np.int64),)*3
+    pairs = np.concatenate(pairs)
+    return np.concatenate(t), np.minimum(pairs[:,0], pairs[:,1]), np.maximum(pairs[:,0], pairs[:,1])
+
+def contact_intervals(t, i, j, dt=1):
+    '''
+    Joins contact records into contact intervals: the records of a pair of nodes
+    at times t and t + *dt* belong to the same contact. Returns an int64 array with
+    a row (i, j, start, end) per contact, sorted by pair and then by start, where
+    *end* is the time of the last record plus *dt*. Repeated records are ignored,
+    and the records need not be sorted.
+
+    Required arguments:
+
+      *t*, *i*, *j*:
+        Integer arrays, the time of each record and the two nodes in contact.
+
+    keyword arguments:
+
+      *dt*:
+        Integer, the time between two consecutive steps, e.g. 20 for the SocioPatterns
+        contact lists, whose times are in seconds.
+    '''
+    t, i, j = np.asarray(t), np.asarray(i), np.asarray(j)
+    if len(t) == 0:
+        return np.empty((0, 4), dtype=np.int64)
+    t0 = int(t.min())
+    node_bits = __bits(max(i.max(), j.max()))
+    # with room for t + dt, so that records of different pairs are never dt apart
+    time_bits = __bits(t.max() - t0 + dt)
+
+    if 2 * node_bits + time_bits <= 63:
+        # each record fits in an int64 (i, j, t - t0): a single sort in place, without indirection
+        records = np.minimum(i, j).astype(np.int64)
+        records <<= node_bits
+        records |= np.maximum(i, j)
+        records <<= time_bits
+        records |= t - t0
+        records.sort()
+        first = __run_starts(lambda a, b: records[a:b] - records[a-1:b-1], len(records), dt)
+        last = np.append(first[1:] - 1, len(records) - 1)
+        keys = records[first] >> time_bits
+        i, j = keys >> node_bits, keys & ((1 << node_bits) - 1)
+        start = (records[first] & ((1 << time_bits) - 1)) + t0
+        end = (records[last] & ((1 << time_bits) - 1)) + t0 + dt
+    else:
+        i, j = np.minimum(i, j).astype(np.int64), np.maximum(i, j).astype(np.int64)
+        order = np.lexsort((t, j, i))
+        i, j, t = i[order], j[order], t[order].astype(np.int64)
+        keys = i << 32 | j
+        first = __run_starts(lambda a, b: np.where(keys[a:b] == keys[a-1:b-1], t[a:b] - t[a-1:b-1], -1), len(t), dt)
+        last = np.append(first[1:] - 1, len(t) - 1)
+        i, j, start, end = i[first], j[first], t[first], t[last] + dt
+
+    intervals = np.empty((len(first), 4), dtype=np.int64)
+    intervals[:,0] = i
+    intervals[:,1] = j
+    intervals[:,2] = start
+    intervals[:,3] = end
+    return intervals
+
+def frame_intervals(contacts):
+    '''
+    Returns the contact intervals (see contact_intervals) of a stream of contact lists,
+    e.g. one of the contact models, with the steps counted from 0.
+    '''
+    return contact_intervals(*contact_records(contacts))
+
+def event_intervals(events, end=None):
+    '''
+    Returns the contact intervals of a stream of contact events, as yielded by the contact
+    models with events=True (see pymobility.models.contact.contact_events).
+
+    Required arguments:
+
+      *events*:
+        An iterator over arrays of rows (t, i, j, up), or a single array of such rows
+        in time order.
+
+    keyword arguments:
+
+      *end*:
+        Integer, the end of the contacts that did not end in the stream.
+        If None, the time of the last event plus one.
+    '''
+    if not isinstance(events, np.ndarray):
+        events = [np.asarray(e, dtype=np.int64).reshape(-1, 4) for e in events]
+        events = np.concatenate(events) if events else np.empty((0, 4), dtype=np.int64)
+    if len(events) == 0:
+        return np.empty((0, 4), dtype=np.int64)
+    if end is None:
+        end = events[-1, 0] + 1
+
+    # the stable sort keeps the events of each pair in time order: up, down, up, ...
+    keys = events[:,1] << 32 | events[:,2]
+    order = np.argsort(keys, kind='stable')
+    keys, events = keys[order], events[order]
+    up = np.flatnonzero(events[:,3])
+    following = np.minimum(up + 1, len(events) - 1)
+    closed = (up + 1 < len(events)) & (keys[following] == keys[up])
+
+    intervals = np.empty((len(up), 4), dtype=np.int64)
+    intervals[:,:2] = events[up, 1:3]
+    intervals[:,2] = events[up, 0]
+    intervals[:,3] = np.where(closed, events[following, 0], end)
+    return intervals
+
+def contact_durations(intervals):
+    '''
+    Returns the duration of each contact interval (i, j, start, end).
+    '''
+    intervals = np.asarray(intervals)
+    if len(intervals) == 0:
+        return np.empty(0, dtype=intervals.dtype)
+    return intervals[:,3] - intervals[:,2]
+
+def inter_contact_times(intervals):
+    '''
+    Returns the inter-contact times: for each pair of consecutive contacts of the same pair of nodes,
+    the time from the end of a contact to the start of the next one.
+
+    Required arguments:
+
+      *intervals*:
+        Array of rows (i, j, start, end), e.g. as returned by contact_intervals
+        or yielded by continuous_contacts. It is sorted by pair if needed.
+    '''
+    intervals = __pair_order(intervals)
+    if len(intervals) == 0:
+        return np.empty(0, dtype=intervals.dtype)
+    same = (intervals[1:,0] == intervals[:-1,0]) & (intervals[1:,1] == intervals[:-1,1])
+    return (intervals[1:,2] - intervals[:-1,3])[same]
+
+def contacts_per_link(intervals):
+    '''
+    Returns the links, i.e. the pairs of nodes that were in contact at least once,
+    and the number of contacts of each link, as arrays (i, j, count).
+
+    Required arguments:
+
+      *intervals*:
+        Array of rows (i, j, start, end), e.g. as returned by contact_intervals.
+    '''
+    intervals = __pair_order(intervals)
+    if len(intervals) == 0:
+        return (np.empty(0, dtype=np.int64),)*3
+    pairs = intervals[:,:2].astype(np.int64)
+    first = np.flatnonzero(__group_starts(pairs[:,0] << 32 | pairs[:,1]))
+    return pairs[first,0], pairs[first,1], np.diff(np.append(first, len(pairs)))
+
+def log_bins(values, bins=50, integer=False):
+    '''
+    Returns the edges of *bins* logarithmically spaced bins from the lowest to the highest
+    positive value in *values*. If *integer* is True, the edges are rounded to distinct integers
+    (so there may be fewer bins), from 1 to one more than the highest value.
+    '''
+    values = np.asarray(values)
+    positive = values[values > 0]
+    if len(positive) == 0:
+        return np.array([0., 1.])
+    low, high = positive.min(), positive.max()
+    if integer:
+        edges = np.unique(np.floor(np.logspace(0, np.log10(high + 1), bins + 1)).astype(np.int64))
+        return np.union1d(edges, [1, int(high) + 1])
+    if low == high:
+        return np.array([low, low * 2.])
+    return np.logspace(np.log10(low), np.log10(high), bins + 1)
+
+def log_histogram(values, bins=50, integer=False, density=True):
+    '''
+    Histogram of *values* in logarithmically spaced bins (see log_bins), for heavy-tailed
+    distributions such as contact durations and inter-contact times.
+    The values that are not positive are ignored.
+    Returns (histogram, edges) as numpy.histogram, where the histogram is a probability
+    density if *density* is True, i.e. the counts are divided by the bin widths.
+    '''
+    values = np.asarray(values)
+    edges = log_bins(values, bins, integer)
+    histogram, edges = np.histogram(values[values > 0], bins=edges, density=density)
+    return histogram, edges
@@ -0,0 +1,87 @@
+# coding: utf-8
+#
+#  Copyright (C) 2012 Istituto per l'Interscambio Scientifico I.S.I.
+#  You can contact us by email (isi@isi.it) or write to:
+#  ISI Foundation, Via Alassio 11/c, 10126 Torino, Italy.
+#
+#  This program was written by André Panisson <panisson@gmail.com>
+#
+'''
+Ensemble runner: runs independent replicas of a mobility or contact model
+across a pool of processes, with reproducible per-replica random streams.
+'''
+import random
+import numpy as np
+
+def collect(frames):
+    '''
+    Default reduction: returns the list of frames, copying the arrays
+    that the models update in place.
+    '''
+    return [frame.copy() if isinstance(frame, np.ndarray) else frame for frame in frames]
+
+def __run_replica(task):
+    model, args, kwargs, steps, reduce, seed_sequence = task
+
+    # the models draw from the global random states
+    np.random.seed(seed_sequence.generate_state(4))
+    random.seed(int(seed_sequence.generate_state(2, np.uint64)[0]))
+
+    frames = iter(model(*args, **kwargs))
+    return reduce(frame for _, frame in zip(range(steps), frames))
+
+def run_ensemble(model, replicas, steps, args=(), kwargs=None, reduce=collect, seed=None, max_workers=None):
+    '''
+    Runs independent replicas of a model in a process pool and yields the reduced
+    result of each replica, in replica order, as soon as it is available.
+
+    Each replica gets its own random stream, spawned from a numpy SeedSequence,
+    which seeds the global numpy.random and random states in the worker before
+    the model is created. The results depend only on *seed* and on the replica
+    index, and are identical for any number of workers.
+    Models that reseed the random states themselves (such as modelB with its
+    *seed_value* argument) should be given a fixed seed in *kwargs*.
+
+    Required arguments:
+
+      *model*:
+        A picklable callable that returns the model iterator, e.g. random_waypoint or edge_markovian.
+
+      *replicas*:
+        Integer, the number of replicas.
+
+      *steps*:
+        Integer, the number of steps (frames) simulated in each replica.
+
+    keyword arguments:
+
+      *args*, *kwargs*:
+        The arguments used to call *model*.
+
+      *reduce*:
+        A picklable callable that receives an iterator over the frames of a replica
+        and returns the result sent back to the parent process.
+        Default is collect, which returns the list of frames.
+
+      *seed*:
+        Integer or SeedSequence, the root seed of the ensemble.
+        If None, fresh entropy is taken from the operating system.
+
+      *max_workers*:
+        Integer, the number of worker processes. If 0, the replicas run sequentially
+        in the calling process. If None, the number of processors is used.
+    '''
+    if kwargs is None: kwargs = {}
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    tasks = ((model, args, kwargs, steps, reduce, s) for s in seed.spawn(replicas))
+
+    if max_workers == 0:
+        for task in tasks:
+            yield __run_replica(task)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for result in executor.map(__run_replica, tasks):
+                yield result
@@ -0,0 +1,202 @@
+# coding: utf-8
+#
+#  Copyright (C) 2012 Istituto per l'Interscambio Scientifico I.S.I.
+#  You can contact us by email (isi@isi.it) or write to:
+#  ISI Foundation, Via Alassio 11/c, 10126 Torino, Italy.
+#
+#  This program was written by André Panisson <panisson@gmail.com>
+#
+'''
+Exporters of mobility and contact models to the trace formats of network simulators:
+ns-2 movement scripts (as written by setdest), and the external movement and
+connectivity event files of the ONE simulator.
+
+The exporters consume the models as generators, one step at a time, so that memory
+use does not grow with the length of the trace. The lines are formatted in blocks
+of many records at once, with a single string formatting operation per block.
+If the path ends with '.gz' (or *compress* is True), the output is gzip compressed.
+'''
+import gzip
+import numpy as np
+from pymobility.models.contact import contact_events
+
+def __open(path, compress):
+    if compress or (compress is None and path.endswith('.gz')):
+        return gzip.open(path, 'wt', compresslevel=6)
+    return open(path, 'w', buffering=2**20)
+
+class __BlockWriter(object):
+    '''
+    Collects arrays of records (rows of numbers), each array with its line format,
+    and writes them in order, in blocks of at least *block* records.
+    '''
+    def __init__(self, output, block):
+        self.output = output
+        self.block = block
+        self.segments = []
+        self.size = 0
+
+    def append(self, fmt, records):
+        if len(records) == 0: return
+        self.segments.append((fmt, records))
+        self.size += len(records)
+        if self.size >= self.block:
+            self.flush()
+
+    def flush(self):
+        if self.size == 0: return
+        self.output.write(''.join([(fmt * len(records)) % tuple(records.ravel().tolist())
+                                   for fmt, records in self.segments]))
+        self.segments = []
+        self.size = 0
+
+def __check_frame(xy):
+    if xy.ndim != 2 or xy.shape[1] != 2:
+        raise Exception("The frames should have shape (nr_nodes, 2)")
+
+def __steps(frames, steps):
+    if steps is None:
+        return iter(frames)
+    return (xy for _, xy in zip(range(steps), frames))
+
+def write_ns2_movement(frames, path, steps=None, dt=1., precision=6, compress=None, block=2**16):
+    '''
+    Writes the movement of the nodes as an ns-2 movement script, the format written by setdest:
+    the initial positions are set from the first frame, and at the time of each step the
+    nodes that move get a "setdest" command to their position in the next step, with the
+    speed that takes them there in *dt* seconds.
+
+    Required arguments:
+
+      *frames*:
+        An iterator over the node positions in each step, with shape (nr_nodes, 2),
+        e.g. a mobility model.
+
+      *path*:
+        String, the path of the output file.
+
+    keyword arguments:
+
+      *steps*:
+        Integer, the number of frames that are exported. If None, all the frames.
+
+      *dt*:
+        Double, the time between two frames, in seconds.
+
+      *precision*:
+        Integer, the number of decimal digits of the times, coordinates and speeds.
+
+      *compress*:
+        Boolean, whether the output is gzip compressed. If None, the output is
+        compressed if the path ends with '.gz'.
+
+      *block*:
+        Integer, the minimum number of lines formatted at once.
+    '''
+    f = '%%.%df' % precision
+    start = '$node_(%%d) set X_ %s\n$node_(%%d) set Y_ %s\n$node_(%%d) set Z_ %s\n' % (f, f, f % 0.)
+    move = '$ns_ at %s "$node_(%%d) setdest %s %s %s"\n' % (f, f, f, f)
+    with __open(path, compress) as output:
+        lines = __BlockWriter(output, block)
+        previous = None
+        for t, xy in enumerate(__steps(frames, steps)):
+            __check_frame(xy)
+            if previous is None:
+                nodes = np.arange(len(xy), dtype=float)
+                lines.append(start, np.column_stack((nodes, xy[:,0], nodes, xy[:,1], nodes)))
+                # the frames may be overwritten by the model at the next step
+                previous = np.array(xy, dtype=float)
+                continue
+            speed = np.sqrt(np.sum(np.square(xy - previous), axis=1)) / dt
+            moving = np.flatnonzero(speed > 0.)
+            records = np.empty((len(moving), 5))
+            records[:,0] = (t - 1) * dt
+            records[:,1] = moving
+            records[:,2:4] = xy[moving]
+            records[:,4] = speed[moving]
+            lines.append(move, records)
+            np.copyto(previous, xy)
+        lines.flush()
+
+def write_one_movement(frames, path, steps, dimensions, dt=1., precision=6, compress=None, block=2**16):
+    '''
+    Writes the movement of the nodes as an external movement file of the ONE simulator
+    (read by ExternalMovementReader): a header line "minTime maxTime minX maxX minY maxY",
+    and then a line "time id x y" for each node in each step.
+
+    Required arguments:
+
+      *frames*:
+        An iterator over the node positions in each step, with shape (nr_nodes, 2),
+        e.g. a mobility model.
+
+      *path*:
+        String, the path of the output file.
+
+      *steps*:
+        Integer, the number of frames that are exported (needed for the header).
+
+      *dimensions*:
+        Tuple of Doubles, the x and y dimensions of the simulation area.
+
+    keyword arguments:
+
+      *dt*, *precision*, *compress*, *block*:
+        As in write_ns2_movement.
+    '''
+    f = '%%.%df' % precision
+    MAX_X, MAX_Y = dimensions
+    with __open(path, compress) as output:
+        output.write(' '.join([f] * 6) % (0., (steps - 1) * dt, 0., MAX_X, 0., MAX_Y) + '\n')
+        line = '%s %%d %s %s\n' % (f, f, f)
+        lines = __BlockWriter(output, block)
+        for t, xy in enumerate(__steps(frames, steps)):
+            __check_frame(xy)
+            records = np.empty((len(xy), 4))
+            records[:,0] = t * dt
+            records[:,1] = np.arange(len(xy))
+            records[:,2:] = xy
+            lines.append(line, records)
+        lines.flush()
+
+def write_one_connectivity(contacts, path, steps=None, dt=1., precision=3, compress=None, block=2**16):
+    '''
+    Writes the contacts between nodes as a connectivity event file of the ONE simulator
+    (read by StandardEventsReader): a line "time CONN host1 host2 up" when a pair of nodes
+    comes into contact, and "time CONN host1 host2 down" when the contact ends.
+
+    Required arguments:
+
+      *contacts*:
+        An iterator over the contacts in each step, e.g. mobility_contact or another
+        contact model, in any of their output formats (see pymobility.models.contact.contact_pairs).
+        The events are those of pymobility.models.contact.contact_events, so that
+        the pairs of a node with itself are ignored.
+
+      *path*:
+        String, the path of the output file.
+
+    keyword arguments:
+
+      *steps*:
+        Integer, the number of steps that are exported. If None, all the steps.
+
+      *dt*, *compress*, *block*:
+        As in write_ns2_movement.
+
+      *precision*:
+        Integer, the number of decimal digits of the times.
+    '''
+    f = '%%.%df' % precision
+    up = '%s CONN %%d %%d up\n' % f
+    down = '%s CONN %%d %%d down\n' % f
+    with __open(path, compress) as output:
+        lines = __BlockWriter(output, block)
+        for events in contact_events(__steps(contacts, steps)):
+            # the contacts that ended in this step, then the ones that started
+            records = events[:,:3].astype(float)
+            records[:,0] *= dt
+            started = events[:,3].astype(bool)
+            lines.append(down, records[~started])
+            lines.append(up, records[started])
+        lines.flush()
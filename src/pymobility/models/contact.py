@@ -27,7 +27,130 @@ Created on Jan 31, 2012
 '''
 import numpy as np
 
-def dynamic_gnp(n, p):
+def __events(t, i, j, up):
+    events = np.empty((len(i), 4), dtype=np.int64)
+    events[:,0] = t
+    events[:,1] = i
+    events[:,2] = j
+    events[:,3] = up
+    return events
+
+def __pair_keys(i, j):
+    # the pair (i, j), with i < j, is identified by the key (i << 32) | j
+    return np.asarray(i, dtype=np.int64) << 32 | np.asarray(j, dtype=np.int64)
+
+def __key_events(t, previous, current):
+    # the contacts that ended, then the ones that started; both key arrays are sorted and unique
+    down = np.setdiff1d(previous, current, assume_unique=True)
+    up = np.setdiff1d(current, previous, assume_unique=True)
+    keys = np.concatenate((down, up))
+    return __events(t, keys >> 32, keys & 0xffffffff, np.arange(len(keys)) >= len(down))
+
+def __upper(i, j):
+    upper = i < j
+    return i[upper], j[upper]
+
+def __frame(i, j, n, output):
+    # the contacts (i, j), with i < j, in the requested output format
+    if output == 'list':
+        return list(zip(i.tolist(), j.tolist()))
+    if output == 'edges':
+        edges = np.empty((len(i), 2), dtype=np.int32)
+        edges[:,0] = i
+        edges[:,1] = j
+        return edges
+    if output in ('coo', 'csr'):
+        from scipy.sparse import coo_matrix
+        return coo_matrix((np.ones(len(i), dtype=np.int8), (i, j)), shape=(n, n)).asformat(output)
+    raise Exception("Unknown output format '%s'" % output)
+
+def __index_pairs(k, n):
+    # the pairs (i, j), with i < j, with indices *k* in the row by row order of the
+    # n(n-1)/2 pairs, where row i has the n-1-i pairs (i, i+1) ... (i, n-1) and starts
+    # at index i(2n-1-i)/2
+    k = np.asarray(k, dtype=np.int64)
+    b = 2 * n - 1
+    i = np.floor((b - np.sqrt(b * b - 8. * k)) / 2.).astype(np.int64)
+    # the square root may round to the neighbour row
+    i -= i * (b - i) // 2 > k
+    i += (i + 1) * (b - i - 1) // 2 <= k
+    return i, k - i * (b - i) // 2 + i + 1
+
+def __bernoulli_indices(size, p):
+    # the sorted indices in [0, size) of independent trials that succeed with probability p,
+    # drawn by geometric skipping: the gaps between successes are geometric, so the cost is
+    # proportional to the number of successes
+    if p <= 0. or size == 0:
+        return np.empty(0, dtype=np.int64)
+    if p >= 1.:
+        return np.arange(size, dtype=np.int64)
+    chunks = []
+    last = -1
+    while True:
+        expected = (size - 1 - last) * p
+        gaps = np.random.geometric(p, int(expected + 5. * np.sqrt(expected) + 16))
+        indices = np.cumsum(gaps)
+        indices += last
+        if indices[-1] >= size:
+            chunks.append(indices[:np.searchsorted(indices, size)])
+            return np.concatenate(chunks)
+        chunks.append(indices)
+        last = indices[-1]
+
+def __distinct_indices(size, m):
+    # m distinct indices drawn uniformly from [0, size), sorted
+    if m > size:
+        raise Exception("Cannot draw %d distinct pairs out of %d" % (m, size))
+    if 2 * m > size:
+        # dense: draw the indices that are left out
+        keep = np.ones(size, dtype=bool)
+        keep[__distinct_indices(size, size - m)] = False
+        return np.flatnonzero(keep)
+    indices = np.empty(0, dtype=np.int64)
+    while len(indices) < m:
+        # draw the missing indices, and drop the repeated ones
+        indices = np.concatenate((indices, np.random.randint(0, size, m - len(indices), dtype=np.int64)))
+        indices.sort()
+        indices = indices[np.concatenate(([True], indices[1:] != indices[:-1]))]
+    return indices
+
+def contact_pairs(contacts):
+    '''
+    Returns the contacts of a step as an int64 array with shape (k, 2), with a row (i, j)
+    for each pair of nodes in contact, from any of the output formats of the contact models:
+    a list of node pairs, an array of edges or a scipy.sparse matrix.
+    '''
+    if hasattr(contacts, 'tocoo'):
+        contacts = contacts.tocoo()
+        return np.column_stack((contacts.row, contacts.col)).astype(np.int64)
+    return np.asarray(contacts, dtype=np.int64).reshape(-1, 2)
+
+def contact_events(contacts):
+    '''
+    Turns a stream of contact lists into a stream of contact events.
+    For each step t, yields an integer array with shape (k, 4), with a row (t, i, j, up)
+    for each pair of nodes i < j whose contact started (up is 1) or ended (up is 0) in that step,
+    the ended contacts first, each group sorted by i and then by j. The steps are counted from 0,
+    and the contacts present in the first step are reported as started in it.
+
+    The contact models also yield this stream directly, computed within the model,
+    when called with events=True.
+
+    Required arguments:
+
+      *contacts*:
+        An iterator over the contacts in each step, in any of the output formats
+        of the contact models (see contact_pairs).
+    '''
+    previous = np.empty(0, dtype=np.int64)
+    for t, pairs in enumerate(contacts):
+        pairs = contact_pairs(pairs)
+        current = np.unique(__pair_keys(np.minimum(pairs[:,0], pairs[:,1]), np.maximum(pairs[:,0], pairs[:,1])))
+        current = current[(current >> 32) != (current & 0xffffffff)]
+        yield __key_events(t, previous, current)
+        previous = current
+
+def dynamic_gnp(n, p, events=False, output='list'):
     '''
     Implementation of the Dynamic G(n,p) graph as discussed in the following paper:
         Andrea E. F. Clementi, Francesco Pasquale, Angelo Monti, and Riccardo Silvestri. 2007. 
@@ -37,6 +160,10 @@ def dynamic_gnp(n, p):
     according to the well-known random graph model G(n,p) where n is the number of nodes and p is the
     edge probability.
     
+    Each graph is drawn by skipping over the n(n-1)/2 node pairs with geometric gaps,
+    so each step takes time and memory proportional to the number of edges, about p*n*n/2,
+    rather than to n*n: sparse graphs with millions of nodes can be drawn.
+    
     Required arguments:
     
       *n*:
@@ -45,13 +172,33 @@ def dynamic_gnp(n, p):
       *p*   
         The probability for drawing an edge between two arbitrary vertices (G(n,p) graph)
     
+    keyword arguments:
+    
+      *events*:
+        Boolean. If True, yields only the edges that appear or disappear in each step,
+        as integer arrays of rows (t, i, j, up) (see contact_events).
+      
+      *output*:
+        String, the format of the contacts yielded in each step, with each pair (i, j)
+        given once, with i < j. If 'list', a list of tuples (i, j). If 'edges',
+        a contiguous int32 array with shape (k, 2). If 'coo' or 'csr', an upper triangular
+        scipy.sparse matrix with shape (n, n) in that format, with value 1 for each contact.
     '''
+    previous = np.empty(0, dtype=np.int64)
+    pairs = n * (n - 1) // 2
+    t = 0
     while True:
-        m = np.random.rand(n, n)
-        c = np.where(m < p)
-        yield [(i,j) for i,j in zip(c[0], c[1]) if i < j]
+        # the edges are sorted by i and then by j
+        i, j = __index_pairs(__bernoulli_indices(pairs, p), n)
+        if events:
+            current = __pair_keys(i, j)
+            yield __key_events(t, previous, current)
+            previous = current
+        else:
+            yield __frame(i, j, n, output)
+        t += 1
 
-def dynamic_gnm(n, m):
+def dynamic_gnm(n, m, events=False, output='list'):
     '''
     Implementation of the Dynamic G(n,m) graph as discussed in the following paper:
     
@@ -63,6 +210,10 @@ def dynamic_gnm(n, m):
     according to the well-known random graph model G(n,m) where n is the number of nodes and m is the
     number of edges.
     
+    The m pairs are drawn without replacement from the n(n-1)/2 node pairs, by their
+    index, in a few vectorized rounds (or by drawing the pairs left out, if m is more than
+    half of them), so that each step takes time proportional to m.
+    
     Required arguments:
     
       *n*:
@@ -71,17 +222,241 @@ def dynamic_gnm(n, m):
       *m*:    
         The number of edges in the graph (for G(n,m) graphs).
     
+    keyword arguments:
+    
+      *events*:
+        Boolean. If True, yields only the edges that appear or disappear in each step,
+        as integer arrays of rows (t, i, j, up) (see contact_events).
+      
+      *output*:
+        String, 'list', 'edges', 'coo' or 'csr', as in dynamic_gnp.
     '''
+    previous = np.empty(0, dtype=np.int64)
+    pairs = n * (n - 1) // 2
+    t = 0
     while True:
-        contacts = []
-        while len(contacts) < m:
-            i = np.random.randint(n)
-            j = np.random.randint(n)
-            if i == j or (i, j) in contacts: continue
-            contacts.append((i, j))
-        yield contacts
-        
-def edge_markovian(n, p, q, g=0):
+        # the edges are sorted by i and then by j
+        i, j = __index_pairs(__distinct_indices(pairs, m), n)
+        if events:
+            current = __pair_keys(i, j)
+            yield __key_events(t, previous, current)
+            previous = current
+        else:
+            yield __frame(i, j, n, output)
+        t += 1
+
+class CalendarQueue(object):
+
+    NEVER = np.iinfo(np.int32).max
+
+    def __init__(self, horizon=1024, size=None):
+        '''
+        Calendar queue of integer keys (e.g. node pair indices) scheduled at integer steps.
+        The steps are divided into windows of *horizon* steps, and the windows into eras of
+        *horizon* windows. The keys due in the current window are kept in a bucket per step,
+        the ones due later in the current era in a bucket per window, and the others in
+        a bucket per era. The bucket of a window (or an era) is distributed to the buckets
+        of its steps (or windows) when it starts, so that scheduling and popping keys take
+        time proportional to their number, whatever the number of scheduled keys.
+
+        The steps are popped in increasing order (see pop), and the keys are scheduled
+        after the last popped step. Steps from NEVER on are never reached.
+
+        If *size* is given, the keys are the integers from 0 to size-1, and the later keys
+        are stored as int32 if they fit, with their int32 steps, in 8 bytes per key.
+        '''
+        self.horizon = horizon
+        self.buckets = {}
+        self.windows = {}
+        self.eras = {}
+        # the step buckets cover the steps before end, and the window buckets the steps before era_end
+        self.end = 0
+        self.era_end = 0
+        self.key_dtype = np.int32 if size is not None and size <= self.NEVER else np.int64
+
+    def __group(self, keys, steps, index):
+        # the keys and steps grouped by *index*, as (index, keys, steps) in increasing index;
+        # the order of the keys in a group does not matter, since the buckets are sorted when popped
+        low = index.min()
+        if index.max() - low < 2**15:
+            # the steps of a window, the windows of an era or the eras span few values: a radix sort
+            order = np.argsort((index - low).astype(np.int16), kind='stable')
+        else:
+            order = np.argsort(index)
+        index, keys, steps = index[order], keys[order], steps[order]
+        bounds = np.flatnonzero(index[1:] != index[:-1]) + 1
+        if len(bounds) == 0:
+            return [(index[0].item(), keys, steps)]
+        starts = [0] + bounds.tolist()
+        ends = starts[1:] + [len(index)]
+        # the groups are copied, so that each one is released when it is popped
+        return [(i, keys[a:b].copy(), steps[a:b].copy()) for i, a, b in zip(index[starts].tolist(), starts, ends)]
+
+    def push(self, keys, steps):
+        '''
+        Schedules each key of the array *keys* at the corresponding step of the array *steps*.
+        '''
+        keys, steps = np.asarray(keys, dtype=np.int64), np.asarray(steps, dtype=np.int64)
+        later = steps >= self.end
+        if later.any():
+            later_steps = np.minimum(steps[later], self.NEVER).astype(np.int32)
+            later_keys = keys[later].astype(self.key_dtype)
+            era = later_steps >= self.era_end
+            for buckets, width, part in ((self.windows, self.horizon, ~era),
+                                         (self.eras, self.horizon * self.horizon, era)):
+                if not part.any(): continue
+                part_keys, part_steps = later_keys[part], later_steps[part]
+                for index, group, group_steps in self.__group(part_keys, part_steps, part_steps // width):
+                    buckets.setdefault(index, []).append((group, group_steps))
+            keys, steps = keys[~later], steps[~later]
+        if len(keys) == 0: return
+        for step, group, _ in self.__group(keys, steps, steps):
+            self.buckets.setdefault(step, []).append(group)
+
+    def pop(self, step):
+        '''
+        Removes the keys scheduled at *step*, and returns them sorted.
+        '''
+        if step >= self.era_end:
+            era = step // (self.horizon * self.horizon)
+            self.era_end = (era + 1) * self.horizon * self.horizon
+            groups = self.eras.pop(era, [])
+            while groups:
+                self.push(*groups.pop())
+        if step >= self.end:
+            window = step // self.horizon
+            self.end = (window + 1) * self.horizon
+            groups = self.windows.pop(window, [])
+            while groups:
+                self.push(*groups.pop())
+        bucket = self.buckets.pop(step, None)
+        if bucket is None:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(bucket))
+
+def __schedule(calendar, keys, t, q):
+    # the edges *keys* are first checked at step t, and die at each step with probability q:
+    # their lifetimes are geometric, and each one is scheduled at the step in which it dies
+    if q <= 0. or len(keys) == 0: return
+    deaths = np.random.geometric(q, len(keys))
+    deaths += t - 1
+    calendar.push(keys, deaths)
+
+def __sorted_contains(edges, keys):
+    # whether each key is in the sorted array *edges*
+    if len(edges) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    return edges[np.minimum(np.searchsorted(edges, keys), len(edges) - 1)] == keys
+
+def __bits_contains(bits, keys):
+    # whether the bit of each key is set, in an array with a bit per pair index
+    return (bits[keys >> 3] >> (keys & 7).astype(np.uint8)) & 1 == 1
+
+def __bits_flip(bits, keys):
+    # flips the bits of the distinct *keys*, several of which may be in the same byte
+    np.bitwise_xor.at(bits, keys >> 3, np.left_shift(1, keys & 7).astype(np.uint8))
+
+def __new_pairs(contains, pairs, count):
+    # *count* distinct pair indices in [0, pairs) that are not edges, sorted, where contains(keys)
+    # tells which keys are edges; only the draws that collide with an edge or with another draw
+    # are drawn again
+    born = np.empty(0, dtype=np.int64)
+    while len(born) < count:
+        drawn = np.random.randint(0, pairs, count - len(born), dtype=np.int64)
+        drawn = drawn[~contains(drawn)]
+        born = np.concatenate((born, drawn))
+        born.sort()
+        born = born[np.concatenate(([True], born[1:] != born[:-1]))]
+    return born
+
+def __packed_indices(bits, start, size):
+    # the indices of the pairs whose bit is set, in a packed array of bits that starts at pair *start*
+    return start + np.flatnonzero(np.unpackbits(bits, count=size))
+
+def __packed_edge_markovian(n, p, q, g, events, output, chunk=2**22):
+    # the state of the pairs is kept in a bit per pair, packed in the order of the pair
+    # indices (see __index_pairs), and updated in chunks of *chunk* pairs (a multiple of 8)
+    pairs = n * (n - 1) // 2
+    state = np.empty((pairs + 7) // 8, dtype=np.uint8)
+    chunks = [(a, min(a + chunk, pairs)) for a in range(0, pairs, chunk)]
+    for a, b in chunks:
+        state[a//8:(b+7)//8] = np.packbits(np.random.rand(b - a) < g)
+
+    t = 0
+    while True:
+        born, died = [], []
+        for a, b in chunks:
+            words = state[a//8:(b+7)//8]
+            m = np.random.rand(b - a)
+            # the pairs that are not edges are born with probability p,
+            # and the edges die with probability q
+            up = np.packbits(m < p)
+            up &= ~words
+            down = np.packbits(m < q)
+            down &= words
+            words ^= up
+            words ^= down
+            if events:
+                born.append(__packed_indices(up, a, b - a))
+                died.append(__packed_indices(down, a, b - a))
+
+        if events:
+            if t == 0:
+                # all the edges of the first step are new
+                born = [__packed_indices(state[a//8:(b+7)//8], a, b - a) for a, b in chunks]
+                died = []
+            keys = [np.empty(0, dtype=np.int64)] + died + born
+            i, j = __index_pairs(np.concatenate(keys), n)
+            yield __events(t, i, j, np.arange(len(i)) >= sum(map(len, died)))
+        else:
+            keys = [np.empty(0, dtype=np.int64)]
+            keys += [__packed_indices(state[a//8:(b+7)//8], a, b - a) for a, b in chunks]
+            yield __frame(*__index_pairs(np.concatenate(keys), n), n=n, output=output)
+        t += 1
+
+def __sparse_edge_markovian(n, p, q, g, events, output):
+    # the edges are identified by their pair index (see __index_pairs), which sorts them
+    # by i and then by j, and the deaths are kept in a calendar queue. For the frames, the
+    # edges are kept in a sorted array; for the events, in a bit per pair, so that a step
+    # only touches the pairs that change
+    pairs = n * (n - 1) // 2
+    edges = __bernoulli_indices(pairs, g)
+    count = len(edges)
+    calendar = CalendarQueue()
+    __schedule(calendar, edges, 0, q)
+    if events:
+        bits = np.zeros((pairs + 7) // 8, dtype=np.uint8)
+        __bits_flip(bits, edges)
+        contains = lambda keys: __bits_contains(bits, keys)
+    else:
+        contains = lambda keys: __sorted_contains(edges, keys)
+
+    t = 0
+    while True:
+        died = calendar.pop(t)
+        # each pair that is not an edge at the start of the step is born with probability p
+        born = __new_pairs(contains, pairs, np.random.binomial(pairs - count, p))
+        count += len(born) - len(died)
+        __schedule(calendar, born, t + 1, q)
+
+        if events:
+            # the dead edges are set, and the new ones are not
+            __bits_flip(bits, died)
+            __bits_flip(bits, born)
+            if t == 0:
+                # all the edges of the first step are new
+                died, born = died[:0], np.union1d(np.setdiff1d(edges, died, assume_unique=True), born)
+                edges = None
+            i, j = __index_pairs(np.concatenate((died, born)), n)
+            yield __events(t, i, j, np.arange(len(i)) >= len(died))
+        else:
+            # the dead edges are in the array, and the new ones are not
+            edges = np.delete(edges, np.searchsorted(edges, died))
+            edges = np.insert(edges, np.searchsorted(edges, born), born)
+            yield __frame(*__index_pairs(edges, n), n=n, output=output)
+        t += 1
+
+def edge_markovian(n, p, q, g=0, events=False, output='list', engine='dense'):
     '''
     Implementation of the edge-Markovian dynamic graph as discussed in the following paper:
     
@@ -98,6 +473,17 @@ def edge_markovian(n, p, q, g=0):
     ability q. If instead the edge does not exist at time t, then 
     it will come into existence at time t + 1 with probability p. 
     
+    The 'dense' engine keeps the state of the n(n-1)/2 node pairs in a bit per pair, and draws
+    a random number for each pair at each step, so that its memory is n*n/16 bytes.
+    The 'sparse' engine only draws the changes: each new edge gets a
+    geometric lifetime with parameter q, and is kept in a calendar of the steps in which
+    the edges die, while the number of births in each step is binomial over the pairs that
+    are not edges, which are drawn by their index. The cost of a step is then proportional
+    to the number of changes (and to the number of edges, unless events is True), so that
+    graphs with 1e5 nodes or more can be simulated. With events, the edges are kept in a bit
+    per node pair, n*n/16 bytes. Both engines give the same process,
+    but not the same graphs from the same random seed.
+    
     Required arguments:
     
       *n*:
@@ -107,31 +493,86 @@ def edge_markovian(n, p, q, g=0):
         If the edge does not exist at time t then it will come into existence at time
         t + 1 with probability p.
         
-      *p*
+      *q*
         If an edge exists at time t then, at time t + 1, it dies with probability q.
     
       *g*:
         an arbitrary initial probability distribution over the set [n] yielding E0.
 
+    keyword arguments:
     
+      *events*:
+        Boolean. If True, yields only the edges that are born or die in each step,
+        as integer arrays of rows (t, i, j, up) (see contact_events).
+      
+      *output*:
+        String, 'list', 'edges', 'coo' or 'csr', as in dynamic_gnp.
+      
+      *engine*:
+        String, either 'dense' or 'sparse'.
     '''
-    # adjacency matrix
-    a = np.zeros((n,n))
-    
-    # initial set of edges
-    a[np.where(np.random.rand(n, n) < g)] = 1
+    if engine == 'sparse':
+        for contacts in __sparse_edge_markovian(n, p, q, g, events, output):
+            yield contacts
+        return
+    elif engine != 'dense':
+        raise Exception("Unknown engine '%s'" % engine)
     
+    for contacts in __packed_edge_markovian(n, p, q, g, events, output):
+        yield contacts
+
+def __calendar_contacts(n, delays, events, output, chunk=2**22):
+    # the pairs are identified by their pair index (see __index_pairs); each pair is
+    # scheduled at the step of its next contact, *delays* steps after the last one
+    pairs = n * (n - 1) // 2
+    ticks = lambda count: np.ceil(np.clip(delays(count), 1., 2.**62)).astype(np.int64)
+    calendar = CalendarQueue(size=pairs)
+    for start in range(0, pairs, chunk):
+        keys = np.arange(start, min(start + chunk, pairs), dtype=np.int64)
+        # the first contact is at the step in which the timer drawn at step -1 expires
+        calendar.push(keys, ticks(len(keys)) - 1)
+
+    for contacts in __timer_contacts(n, ticks, calendar.pop, calendar.push, events, output):
+        yield contacts
+
+def __dense_contacts(n, delays, events, output, chunk=2**22):
+    # the step of the next contact of each pair, in an int32 array in the order of the
+    # pair indices, which is scanned at each step in chunks of *chunk* pairs
+    pairs = n * (n - 1) // 2
+    ticks = lambda count: np.ceil(np.clip(delays(count), 1., 2.**62)).astype(np.int64)
+    due = np.empty(pairs, dtype=np.int32)
+    for start in range(0, pairs, chunk):
+        stop = min(start + chunk, pairs)
+        # the first contact is at the step in which the timer drawn at step -1 expires
+        due[start:stop] = np.minimum(ticks(stop - start) - 1, CalendarQueue.NEVER)
+
+    def pop(t):
+        return np.concatenate([np.empty(0, dtype=np.int64)] +
+                              [start + np.flatnonzero(due[start:start+chunk] <= t) for start in range(0, pairs, chunk)])
+    def push(keys, steps):
+        due[keys] = np.minimum(steps, CalendarQueue.NEVER)
+
+    for contacts in __timer_contacts(n, ticks, pop, push, events, output):
+        yield contacts
+
+def __timer_contacts(n, ticks, pop, push, events, output):
+    # the contacts of the pairs whose timers expire at each step, given by pop(step);
+    # then the pairs are scheduled for their next contact with push(keys, steps)
+    previous = np.empty(0, dtype=np.int64)
+    t = 0
     while True:
-        m = np.random.rand(n, n)
-        up = np.where(np.logical_and(a == 0, m < p))
-        down = np.where(np.logical_and(a > 0, m < q))
-        a[up] = 1.
-        a[down] = 0.
-        
-        c = np.nonzero(a)
-        yield [(i,j) for i,j in zip(c[0], c[1]) if i < j]
-        
-def continuous_time_edge_markovian(n, lmbd):
+        keys = pop(t)
+        i, j = __index_pairs(keys, n)
+        if events:
+            current = __pair_keys(i, j)
+            yield __key_events(t, previous, current)
+            previous = current
+        else:
+            yield __frame(i, j, n, output)
+        push(keys, t + ticks(len(keys)))
+        t += 1
+
+def continuous_time_edge_markovian(n, lmbd, events=False, output='list', engine='dense'):
     '''
     Implementation of the continuous-time edge-Markovian dynamic graph as discussed in the following paper:
     
@@ -141,18 +582,30 @@ def continuous_time_edge_markovian(n, lmbd):
     
     We assume that, for any pairs of nodes (u, v), the times of
     contact are separated by exponential random variables.
+    
+    If *events* is True, yields only the contacts that start or end in each step,
+    as integer arrays of rows (t, i, j, up) (see contact_events).
+    The *output* format of the contacts is 'list', 'edges', 'coo' or 'csr', as in dynamic_gnp.
+    
+    With the 'dense' *engine*, the step of the next contact of each of the n(n-1)/2 node pairs
+    is kept in an int32 array, which is scanned at each step. With the 'sparse' engine, the
+    pairs are kept in a calendar queue (see CalendarQueue) at the step of their next contact,
+    so that each step only takes the pairs in contact: the cost of a step is proportional
+    to the number of contacts, and the memory to the number of pairs.
+    Both engines give the same contacts from the same random seed.
     '''
     from pymobility.models.mobility import E
-    a = np.zeros((n,n))
-    a = E(lmbd, a)
-    
-    while True:
-        a -= 1.
-        c = np.where(a <= 0.)
-        yield [(i,j) for i,j in zip(c[0], c[1]) if i < j]
-        a[c] = E(lmbd, c[0])
+    delays = lambda count: E(lmbd, np.empty(count))
+    if engine == 'sparse':
+        for contacts in __calendar_contacts(n, delays, events, output):
+            yield contacts
+    elif engine == 'dense':
+        for contacts in __dense_contacts(n, delays, events, output):
+            yield contacts
+    else:
+        raise Exception("Unknown engine '%s'" % engine)
         
-def broad_continuous_time_edge_markovian(n, alpha):
+def broad_continuous_time_edge_markovian(n, alpha, events=False, output='list', engine='dense'):
     '''
     This model is similar to the continuous-time edge-Markovian dynamic graph as discussed in the following paper:
     
@@ -163,50 +616,475 @@ def broad_continuous_time_edge_markovian(n, alpha):
     The difference is in the generated inter-contact times.    
     We assume that, for any pairs of nodes (u, v), the times of
     contact are separated by random variables from a power-law distribution.
+    
+    If *events* is True, yields only the contacts that start or end in each step,
+    as integer arrays of rows (t, i, j, up) (see contact_events).
+    The *output* format of the contacts is 'list', 'edges', 'coo' or 'csr', and the *engine*
+    is 'dense' or 'sparse', as in continuous_time_edge_markovian.
     '''
     # define a Power Law Distribution
     P = lambda ALPHA, SCALE, SAMPLES: (SAMPLES ** (1./(1.-alpha))) * SCALE
     
-    a = P(alpha, 1., np.random.rand(n,n))
-    
-    while True:
-        a -= 1.
-        c = np.where(a <= 0.)
-        yield [(i,j) for i,j in zip(c[0], c[1]) if i < j]
-        a[c] = P(alpha, 1., np.random.rand(*c[0].shape))
+    delays = lambda count: P(alpha, 1., np.random.rand(count))
+    if engine == 'sparse':
+        for contacts in __calendar_contacts(n, delays, events, output):
+            yield contacts
+    elif engine == 'dense':
+        for contacts in __dense_contacts(n, delays, events, output):
+            yield contacts
+    else:
+        raise Exception("Unknown engine '%s'" % engine)
 
-def mobility_contact(mobility_model, contact_range=1.0):
+def grid_pairs(xy, radius):
+    '''
+    Finds all node pairs closer than *radius* using a uniform grid (cell list).
+
+    The simulation area is divided in cells of side *radius*, so that two nodes in contact
+    are always in the same cell or in adjacent cells. Nodes are sorted by cell, and the
+    candidate pairs are generated in a vectorized way for half of the neighbour cells.
+    At constant node density, the cost is linear in the number of nodes.
+
+    Required arguments:
+
+      *xy*:
+        Array of shape (nr_nodes, ndim), the node positions.
+
+      *radius*:
+        Double, the maximum euclidean distance in which two nodes are paired.
+
+    Returns two integer arrays (i, j), with i < j, sorted by i and then by j.
+    '''
+    from itertools import product
+
+    xy = np.asarray(xy)
+    nr_nodes, ndim = xy.shape
+    if nr_nodes < 2 or radius <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    # cell coordinates, padded by one empty cell on each side
+    cells = np.floor((xy - xy.min(axis=0)) / radius).astype(np.int64) + 1
+    shape = cells.max(axis=0) + 2
+    strides = np.ones(ndim, dtype=np.int64)
+    strides[:-1] = np.cumprod(shape[::-1])[:-1][::-1]
+    keys = cells.dot(strides)
+
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    positions = np.arange(nr_nodes)
+
+    src, dst = [], []
+    for offset in product((-1, 0, 1), repeat=ndim):
+        # only half of the neighbour cells: pairs are symmetric
+        if offset < (0,)*ndim: continue
+        neighbour = keys + np.dot(offset, strides)
+        start = np.searchsorted(keys, neighbour, side='left')
+        end = np.searchsorted(keys, neighbour, side='right')
+        if not any(offset):
+            # same cell: only the nodes after this one
+            start = positions + 1
+        count = np.maximum(end - start, 0)
+        total = count.sum()
+        if total == 0: continue
+        first = np.cumsum(count) - count
+        i = np.repeat(positions, count)
+        j = np.arange(total) - np.repeat(first - start, count)
+        src.append(i)
+        dst.append(j)
+
+    if not src:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+    i = order[np.concatenate(src)]
+    j = order[np.concatenate(dst)]
+
+    d = np.sum(np.square(xy[i] - xy[j]), axis=1)
+    close = d < radius * radius
+    i, j = i[close], j[close]
+
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    idx = np.lexsort((j, i))
+    return i[idx], j[idx]
+
+class VerletList(object):
+
+    def __init__(self, contact_range, skin):
+        '''
+        Verlet neighbour list: the candidate pairs within *contact_range* + *skin*,
+        built with grid_pairs and reused across steps.
+        Since no node can get closer than *contact_range* to a node outside its list
+        before moving more than *skin*/2, the list is only rebuilt when the maximum
+        node displacement since the last build exceeds *skin*/2.
+
+        Required arguments:
+
+          *contact_range*:
+            Double, the maximum euclidean distance in which two nodes are in contact.
+
+          *skin*:
+            Double, the extra distance added to the contact range when building the list.
+        '''
+        self.contact_range = contact_range
+        self.skin = skin
+        self.reference = None
+        self.candidates = None
+        self.skin_used = skin
+        self.rebuilds = 0
+
+    def update(self, *frames):
+        '''
+        Returns the candidate pairs (i, j) that are valid for all the given frames,
+        rebuilding the list if any node moved more than skin/2 from the reference positions.
+        '''
+        if self.reference is not None and self.reference.shape == frames[0].shape:
+            limit = (self.skin_used / 2.) ** 2
+            if all(np.max(np.sum(np.square(xy - self.reference), axis=1)) <= limit for xy in frames):
+                return self.candidates
+
+        self.reference = np.array(frames[0], copy=True)
+        # frames given together must all be covered by the same list
+        skin = self.skin
+        for xy in frames[1:]:
+            displacement = np.sqrt(np.max(np.sum(np.square(xy - self.reference), axis=1)))
+            skin = max(skin, 2. * displacement)
+        self.skin_used = skin
+        self.candidates = grid_pairs(self.reference, self.contact_range + skin)
+        self.rebuilds += 1
+        return self.candidates
+
+    def contacts(self, xy):
+        '''
+        Returns the pairs (i, j), with i < j, with distance lower than the contact range.
+        '''
+        i, j = self.update(xy)
+        d = np.sum(np.square(xy[i] - xy[j]), axis=1)
+        close = d < self.contact_range * self.contact_range
+        return i[close], j[close]
+
+def __mobility_pairs(mobility_model, contact_range, engine, skin):
+    if engine == 'cdist':
+        from scipy.spatial.distance import cdist
+        for xy in mobility_model:
+            d = cdist(xy,xy)
+            yield __upper(*np.where(d<contact_range)) + (len(xy),)
+    elif engine == 'grid':
+        for xy in mobility_model:
+            yield grid_pairs(xy, contact_range) + (len(xy),)
+    elif engine == 'verlet':
+        verlet = VerletList(contact_range, contact_range if skin is None else skin)
+        for xy in mobility_model:
+            yield verlet.contacts(xy) + (len(xy),)
+    else:
+        raise Exception("Unknown contact engine '%s'" % engine)
+
+def mobility_contact(mobility_model, contact_range=1.0, engine='cdist', skin=None, events=False, output='list'):
     '''
     Contact model based on a mobility model.
     At each time step, this model gets the position of the nodes accordingly to the given mobility model
     and calculates the distance of each node pair.
     The list of contacts generated in each time step is the list of node pairs with distance lower than *contact_range*.
+
+    Required arguments:
+
+      *mobility_model*:
+        An iterator that yields the node positions in each step.
+
+    keyword arguments:
+
+      *contact_range*:
+        Double, the maximum euclidean distance in which two nodes are in contact.
+
+      *engine*:
+        String, either 'cdist' or 'grid'. The method used to find the node pairs in contact.
+        If 'cdist', the full distance matrix is calculated in each step (quadratic in the number of nodes).
+        If 'grid', a uniform grid with cells of side *contact_range* is used (see grid_pairs),
+        with cost linear in the number of nodes at constant density.
+        If 'verlet', a list of candidate pairs within *contact_range* + *skin* is kept
+        across steps (see VerletList) and rebuilt only when some node moved more than *skin*/2.
+        Each step is then only a filter over the candidate pairs.
+
+      *skin*:
+        Double, the skin radius used by the 'verlet' engine. It should be a few times
+        the maximum node displacement per step. Default is *contact_range*.
+
+      *events*:
+        Boolean. If True, yields only the contacts that start or end in each step,
+        as integer arrays of rows (t, i, j, up) (see contact_events).
+
+      *output*:
+        String, 'list', 'edges', 'coo' or 'csr', as in dynamic_gnp.
+    '''
+    previous = np.empty(0, dtype=np.int64)
+    # all the engines give the pairs sorted by i and then by j
+    for t, (i, j, n) in enumerate(__mobility_pairs(mobility_model, contact_range, engine, skin)):
+        if events:
+            current = __pair_keys(i, j)
+            yield __key_events(t, previous, current)
+            previous = current
+        else:
+            yield __frame(i, j, n, output)
+
+def frame_segments(mobility_model, dt=1., t=0., dimensions=None):
+    '''
+    Turns the positions yielded by a mobility model into segments:
+    for each pair of consecutive frames, yields (t0, t1, start, end),
+    where each node moves in a straight line from *start* at time t0 to *end* at time t1.
+    The first frame is taken at time *t*, and the frames are *dt* apart.
+
+    With *dimensions* (by default, the dimensions of the model, if it has them), a node
+    that moves more than half the area along an axis between two frames is taken to have
+    wrapped around the border, as with border_policy='wrap' or in the TimeVariantCommunity
+    model: it moves by the shortest displacement on the torus, so that *end* lies outside
+    the area, and the next segment starts from the wrapped position.
+    '''
+    if dimensions is None:
+        dimensions = getattr(mobility_model, 'dimensions', None)
+    frames = iter(mobility_model)
+    start = np.array(next(frames), copy=True)
+    for xy in frames:
+        frame = np.array(xy, copy=True)
+        end = frame
+        if dimensions is not None:
+            size = np.asarray(dimensions, dtype=float)
+            delta = frame - start
+            wrapped = np.abs(delta) > size / 2.
+            if wrapped.any():
+                # the minimum-image displacement
+                end = start + np.where(wrapped, delta - np.copysign(size, delta), delta)
+        yield t, t + dt, start, end
+        # the next segment starts from the frame, inside the area
+        start = frame
+        t += dt
+
+def continuous_contacts(segments, contact_range=1.0, skin=None):
+    '''
+    Exact continuous-time contact detection for piecewise-linear mobility.
+    In each time window (t0, t1) of the segment stream, every node moves in a straight
+    line at constant speed, so the squared distance of a node pair is a quadratic in time
+    and the times at which the pair gets in or out of range are its roots.
+    Only the pairs in a Verlet list (see VerletList) kept valid for both ends of the window
+    are solved. Contacts that span several windows are joined in a single interval.
+    
+    For each window, yields the list of contact intervals (i, j, t_start, t_end),
+    with i < j, that ended in that window, sorted by end time. The contacts that are
+    still open at the end of the last window end with it.
+
+    Contacts across the border of a wrapping area are not detected, as in mobility_contact.
     
     Required arguments:
     
-      *nr_nodes*:
-        Integer, the number of nodes.
-      
+      *segments*:
+        An iterable of (t0, t1, start, end) tuples, as yielded by frame_segments,
+        where *start* and *end* are arrays of shape (nr_nodes, ndim).
+        With frame_segments, the contacts are exact for nodes that move in a straight
+        line between consecutive frames, as in the RandomWaypoint, RandomDirection,
+        RandomWalk and TruncatedLevyWalk models between turns. A node that wraps around
+        the border moves along its minimum-image displacement (see frame_segments).
+    
+    keyword arguments:
+    
       *contact_range*:
         Double, the maximum euclidean distance in which two nodes are in contact.
+      
+      *skin*:
+        Double, the skin radius of the Verlet list. Default is *contact_range*.
     '''
-    from scipy.spatial.distance import cdist
-    for xy in mobility_model:
-        d = cdist(xy,xy)
-        contacts = []
-        for (i,j) in zip(*np.where(d<contact_range)):
-            if j > i: contacts.append((i,j))
-        yield contacts
+    verlet = VerletList(contact_range, contact_range if skin is None else skin)
+    r2 = contact_range * contact_range
+    
+    # contacts open at the end of the previous window, sorted by pair key
+    open_keys = np.empty(0, dtype=np.int64)
+    open_start = np.empty(0)
+    
+    segments = iter(segments)
+    segment = next(segments, None)
+    while segment is not None:
+        t0, t1, start, end = segment
+        segment = next(segments, None)
+        n = start.shape[0]
+        i, j = verlet.update(start, end)
+        
+        # relative position d(s) = dp + s*dv, for s in [0, 1] along the window
+        dp = start[i] - start[j]
+        dv = (end[i] - end[j]) - dp
+        a = np.sum(dv * dv, axis=1)
+        b = 2. * np.sum(dp * dv, axis=1)
+        c = np.sum(dp * dp, axis=1) - r2
+        
+        disc = b * b - 4. * a * c
+        moving = a > 0.
+        inside = np.where(moving, disc > 0., c < 0.)
+        sqrt_disc = np.sqrt(np.maximum(disc, 0.))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s_in = np.where(moving, (-b - sqrt_disc) / (2. * a), 0.)
+            s_out = np.where(moving, (-b + sqrt_disc) / (2. * a), 1.)
+        s_in = np.maximum(s_in, 0.)
+        s_out = np.minimum(s_out, 1.)
+        inside &= s_in < s_out
+        # in range at the start of the window
+        s_in[c < 0.] = 0.
+        
+        i, j, s_in, s_out = i[inside], j[inside], s_in[inside], s_out[inside]
+        keys = i.astype(np.int64) * n + j
+        t_start = t0 + s_in * (t1 - t0)
+        t_end = t0 + s_out * (t1 - t0)
+        
+        # join with the contacts that were open at the start of the window
+        pos = np.searchsorted(open_keys, keys)
+        pos[pos == open_keys.size] = 0
+        continued = (s_in == 0.) & (open_keys.size > 0)
+        if open_keys.size > 0:
+            continued &= open_keys[pos] == keys
+            t_start[continued] = open_start[pos[continued]]
+        
+        # open contacts that did not continue ended at the start of the window
+        ended = np.ones(open_keys.size, dtype=bool)
+        ended[pos[continued]] = False
+        
+        # in the last window, the open contacts end with it
+        closing = (s_out < 1.) | (segment is None)
+        intervals = np.concatenate((
+            np.column_stack((open_keys[ended] // n, open_keys[ended] % n, open_start[ended], np.full(ended.sum(), float(t0)))),
+            np.column_stack((i[closing], j[closing], t_start[closing], t_end[closing]))))
+        intervals = intervals[np.argsort(intervals[:, 3], kind='stable')]
+        
+        order = np.argsort(keys[~closing])
+        open_keys = keys[~closing][order]
+        open_start = t_start[~closing][order]
+        
+        yield [(int(ci), int(cj), ts, te) for ci, cj, ts, te in intervals.tolist()]
 
 ##################################### 
-def __inactive_partner_choice(t_lc,t,inactive_agents,PI,eta): 
+class SumTree(object):
+
+    def __init__(self, weights):
+        '''
+        Binary tree of sums over a sequence of non-negative weights, for weighted sampling:
+        a weight is changed (see __setitem__) and an index is found from a cumulative weight
+        (see find) in time proportional to the logarithm of the number of weights.
+        '''
+        size = 1
+        while size < len(weights): size *= 2
+        self.size = size
+        # the leaves are tree[size:], and each node k is the sum of its children 2k and 2k+1
+        tree = [0.] * (2 * size)
+        tree[size:size+len(weights)] = [float(w) for w in weights]
+        for k in range(size - 1, 0, -1):
+            tree[k] = tree[2*k] + tree[2*k+1]
+        self.tree = tree
+
+    def total(self):
+        '''
+        Returns the sum of the weights.
+        '''
+        return self.tree[1]
+
+    def __getitem__(self, i):
+        return self.tree[self.size + i]
+
+    def __setitem__(self, i, weight):
+        tree = self.tree
+        k = self.size + i
+        tree[k] = float(weight)
+        # the sums are recomputed from the children, so that rounding errors do not accumulate
+        k >>= 1
+        while k:
+            tree[k] = tree[2*k] + tree[2*k+1]
+            k >>= 1
+
+    def find(self, u):
+        '''
+        Returns the first index whose cumulative weight (up to and including it)
+        is greater than *u*, for 0 <= u < total().
+        '''
+        tree = self.tree
+        k = 1
+        while k < self.size:
+            k *= 2
+            if u >= tree[k]:
+                u -= tree[k]
+                k += 1
+        return k - self.size
+
+class InactivePool(object):
+
+    def __init__(self, t_lc, t, PI, eta=None):
+        '''
+        The inactive agents of modelB and model_het with the 'tree' engine, which replaces the list
+        of inactive agents (with the methods append, extend, remove and len) and samples a partner
+        with probability proportional to eta[i]*PI(t,t_lc[i]) in a sum tree (see choice).
+        The weights are updated lazily: the weight of an agent is computed at the time it becomes
+        inactive, or later, and since PI does not increase in t, it bounds the current one;
+        a sampled agent is accepted with the ratio of the current weight to the stored one, and
+        otherwise its weight is updated and the sampling is repeated. After as many rejections
+        as agents, all the weights are updated.
+
+        All the agents start inactive at time *t*; *t_lc* is the list of the times of the last
+        state change of the agents, shared with the model, and *eta* the list of their
+        activities (None for all 1).
+        '''
+        self.t_lc, self.PI, self.eta = t_lc, PI, eta
+        N = len(t_lc)
+        self.inactive = [True] * N
+        self.count = N
+        # the value of PI in the stored weight of each agent
+        self.pi = [PI(t, ti) for ti in t_lc]
+        self.tree = SumTree([self.weight(i) for i in range(N)])
+        self.rejected = 0
+
+    def weight(self, i):
+        return self.pi[i] if self.eta is None else self.eta[i] * self.pi[i]
+
+    def __len__(self):
+        return self.count
+
+    def append(self, i):
+        # the agent becomes inactive at the time of its last state change
+        self.inactive[i] = True
+        self.count += 1
+        self.pi[i] = self.PI(self.t_lc[i], self.t_lc[i])
+        self.tree[i] = self.weight(i)
+
+    def extend(self, agents):
+        for i in agents: self.append(i)
+
+    def remove(self, i):
+        self.inactive[i] = False
+        self.count -= 1
+        self.tree[i] = 0.
+
+    def update(self, t):
+        for i in range(len(self.pi)):
+            if self.inactive[i]: self.pi[i] = self.PI(t, self.t_lc[i])
+        self.tree = SumTree([self.weight(i) if self.inactive[i] else 0. for i in range(len(self.pi))])
+        self.rejected = 0
+
+    def choice(self, t):
+        from random import random
+        while True:
+            if self.tree.total() <= 0.:
+                raise Exception("The inactive agents have no weight")
+            i = self.tree.find(random() * self.tree.total())
+            # by rounding, the index may be that of an agent without weight: sample again
+            if i >= len(self.pi) or not self.inactive[i] or self.weight(i) <= 0.:
+                continue
+            pi = self.PI(t, self.t_lc[i])
+            if random() * self.pi[i] < pi:
+                return i
+            self.pi[i] = pi
+            self.tree[i] = self.weight(i)
+            self.rejected += 1
+            if self.rejected >= len(self.pi): self.update(t)
+
+def inactive_partner_choice(t_lc,t,inactive_agents,PI,eta): 
     from random import random
     """Returns an inactive partner with a probability 
     proportional to 1/(1+t-t[i]) where t[i] is the last state change time"""
+    if isinstance(inactive_agents, InactivePool):
+        return inactive_agents.choice(t)
     L=len(inactive_agents)
     proba,cumulated_prob,Z = [0]*L, [0]*(L+1),0               
     for j in range(0,L): 
-        c = eta[j] if not isinstance(eta,Number) else 1.
+        c = eta[inactive_agents[j]] if not isinstance(eta,Number) else 1.
         proba[j] = c*PI(t,t_lc[inactive_agents[j]]) 
         Z = Z + proba[j] 
     for j in range(1,L+1): 
@@ -219,9 +1097,10 @@ def __inactive_partner_choice(t_lc,t,inactive_agents,PI,eta):
 #####################################
 
 ##################################### 
-def __update_state(i,b1,mu,PI,f,t,t_lc,partner,inactive_agents): 
+def __update_state(i,b1,mu,PI,f,t,t_lc,partner,inactive_agents,changes=None): 
     """Run the change of an active agent : if the state changes,
-    it can whether leave the group, whether introduce an inactive agent."""
+    it can whether leave the group, whether introduce an inactive agent.
+    If *changes* is a list, the contacts that start or end are appended to it as (i, j, up)."""
     from random import random
 
     k1 = random() 
@@ -243,18 +1122,20 @@ def __update_state(i,b1,mu,PI,f,t,t_lc,partner,inactive_agents):
             for key in partner[i]:
                 t_lc[key] = t 
                 del partner[key][i] 
+                if changes is not None: changes.append((i, key, 0))
             if p==1 : inactive_agents.extend(partner[i])
-            inactive_agents.append(i)
             t_lc[i],partner[i] = t,{} 
+            inactive_agents.append(i)
 
         ### The agent i introduces an inactive agent j to the group 
         elif len(inactive_agents)> 1:
-            j = __inactive_partner_choice(t_lc,t,inactive_agents,PI,b1)
+            j = inactive_partner_choice(t_lc,t,inactive_agents,PI,b1)
             inactive_agents.remove(j)
             partner[j] = partner[i].copy() 
             partner[j][i]=t 
             for key in partner[j]: 
                 partner[key][j]=t 
+                if changes is not None: changes.append((j, key, 1))
             t_lc[j] = t 
             for key in partner[j]: 
                 t_lc[key] = t
@@ -265,16 +1146,50 @@ def __contacts_list(partner):
     for i in range(len(partner)): l.extend((i,k) for k in partner[i])
     return l
 
+def __contacts_frame(partner, output):
+    if output == 'list': return __contacts_list(partner)
+    from itertools import chain
+    counts = np.fromiter(map(len, partner), dtype=np.intp, count=len(partner))
+    j = np.fromiter(chain.from_iterable(partner), dtype=np.int64, count=counts.sum())
+    i = np.repeat(np.arange(len(partner)), counts)
+    i, j = __upper(i, j)
+    order = np.lexsort((j, i))
+    return __frame(i[order], j[order], len(partner), output)
+
+def __change_events(t, changes):
+    changes = np.array(changes, dtype=np.int64).reshape(-1, 3)
+    i = np.minimum(changes[:,0], changes[:,1])
+    j = np.maximum(changes[:,0], changes[:,1])
+    order = np.lexsort((j, i, changes[:,2]))
+    return __events(t, i[order], j[order], changes[order,2])
+
+def __inactive_agents(t_lc,PI,eta,engine):
+    if engine == 'linear':
+        return list(range(0,len(t_lc)))
+    elif engine == 'tree':
+        return InactivePool(t_lc,0,PI,eta)
+    raise Exception("Unknown engine '%s'" % engine)
+
 ##################################### 
-def modelB(b0, b1, mu, PI, f, N, seed_value=None):
+def modelB(b0, b1, mu, PI, f, N, seed_value=None, events=False, output='list', engine='linear'):
     from random import seed,randint,random
-    """Realize an execution of the model for a parameter set"""
+    """Realize an execution of the model for a parameter set.
+    If *events* is True, yields only the contacts that start or end in each step,
+    as integer arrays of rows (t, i, j, up) (see contact_events).
+    With *output* 'edges', 'coo' or 'csr' the contacts are given once, as in dynamic_gnp;
+    the 'list' output has both (i, j) and (j, i).
+    With the 'linear' *engine*, each choice of an inactive partner computes PI for all
+    the inactive agents. With the 'tree' engine, the inactive agents are kept in a sum tree
+    (see SumTree) with lazily updated weights, and a choice takes a time proportional to log(N),
+    for a memory kernel PI(t,ti) that does not increase in t, such as 1/(1+t-ti).
+    The two engines draw different random numbers, so they give different executions."""
 
     ### Variables initialization 
     last_change_time = [0]*N    # Time of the last state change of each agent 
     partner = [{} for _ in range(N)]  # List of interacting partners of each agent 
                                 #         with the time of the beginning of the contact 
-    inactive_agents = range(0,N)
+    inactive_agents = __inactive_agents(last_change_time,PI,None,engine)
+    changes = [] if events else None
 
     seed(seed_value)
     t = 0 
@@ -285,33 +1200,43 @@ def modelB(b0, b1, mu, PI, f, N, seed_value=None):
             ti = last_change_time[i]
             if k <= b0*f(t,ti) and len(inactive_agents)!=1 :
                 inactive_agents.remove(i)
-                j = __inactive_partner_choice(last_change_time,t,inactive_agents,PI,b1) 
+                j = inactive_partner_choice(last_change_time,t,inactive_agents,PI,b1) 
                 partner[i]={j:t} 
                 partner[j]={i:t}
                 inactive_agents.remove(j)
                 last_change_time[i] = t 
                 last_change_time[j] = t
+                if events: changes.append((i, j, 1))
                 
         else:                     # i is interacting
             __update_state(i,b1,mu,PI,f,t,last_change_time,
-                         partner,inactive_agents)
-        t += 1
+                         partner,inactive_agents,changes)
         
-        yield __contacts_list(partner)
+        if events:
+            yield __change_events(t, changes)
+            del changes[:]
+        else:
+            yield __contacts_frame(partner, output)
+        t += 1
         
 ##################################### 
-def model_het(f2,mu,PI,f,N,seed_value=None):# PARAM,N,tmax):
+def model_het(f2,mu,PI,f,N,seed_value=None,events=False,output='list',engine='linear'):# PARAM,N,tmax):
     from random import seed,randint,random
-    """Realize an execution of the model for a parameter set"""
+    """Realize an execution of the model for a parameter set.
+    If *events* is True, yields only the contacts that start or end in each step,
+    as integer arrays of rows (t, i, j, up) (see contact_events).
+    The *output* format and the *engine* are as in modelB; with both engines,
+    each inactive agent i is chosen with a weight proportional to f2(i)*PI(t,ti)."""
 
     ### Variables initialization 
     last_change_time = [0]*N    # Time of the last state change of each agent 
     partner = [{} for _ in range(N)]   # List of interacting partners of each agent 
                                 #         with the time of the beginning of the contact 
-    inactive_agents = range(0,N)
+    changes = [] if events else None
     eta = [0]*N
     for i in range(N):
         eta[i] = f2(i)
+    inactive_agents = __inactive_agents(last_change_time,PI,eta,engine)
 
     seed(seed_value)  
     t = 0 
@@ -322,17 +1247,22 @@ def model_het(f2,mu,PI,f,N,seed_value=None):# PARAM,N,tmax):
             ti = last_change_time[i]
             if k <= eta[i]*f(t,ti) and len(inactive_agents)!=1 :
                 inactive_agents.remove(i)
-                j = __inactive_partner_choice(last_change_time,t,inactive_agents,PI,eta) 
+                j = inactive_partner_choice(last_change_time,t,inactive_agents,PI,eta) 
                 partner[i]={j:t} 
                 partner[j]={i:t}
                 inactive_agents.remove(j)
                 last_change_time[i] = t 
                 last_change_time[j] = t
+                if events: changes.append((i, j, 1))
                 
         else:                     # i is interacting
             __update_state(i,eta,mu,PI,f,t,last_change_time,
-                         partner,inactive_agents)
-        t += 1
+                         partner,inactive_agents,changes)
         
-        yield __contacts_list(partner)
+        if events:
+            yield __change_events(t, changes)
+            del changes[:]
+        else:
+            yield __contacts_frame(partner, output)
+        t += 1
         
@@ -16,14 +16,58 @@ Created on Jan 24, 2012
 import numpy as np
 from numpy.random import rand
 
+# The distributions draw uniform variates from RAND, a function with the signature of numpy.random.rand.
+# By default it is the global numpy random state; the models pass their own RandomBuffer.
+
 # define a Uniform Distribution
-U = lambda MIN, MAX, SAMPLES: rand(*SAMPLES.shape) * (MAX - MIN) + MIN
+U = lambda MIN, MAX, SAMPLES, RAND=rand: RAND(*SAMPLES.shape) * (MAX - MIN) + MIN
 
 # define a Truncated Power Law Distribution
-P = lambda ALPHA, MIN, MAX, SAMPLES: ((MAX ** (ALPHA+1.) - 1.) * rand(*SAMPLES.shape) + 1.) ** (1./(ALPHA+1.))
+P = lambda ALPHA, MIN, MAX, SAMPLES, RAND=rand: ((MAX ** (ALPHA+1.) - 1.) * RAND(*SAMPLES.shape) + 1.) ** (1./(ALPHA+1.))
 
 # define an Exponential Distribution
-E = lambda SCALE, SAMPLES: -SCALE*np.log(rand(*SAMPLES.shape))
+# (from 1-u in (0, 1], since a float32 variate u is exactly 0 with probability 2^-24)
+E = lambda SCALE, SAMPLES, RAND=rand: -SCALE*np.log(1. - RAND(*SAMPLES.shape))
+
+class RandomBuffer(object):
+    
+    def __init__(self, generator, size=65536, dtype=np.float64):
+        '''
+        Source of uniform variates in [0, 1) with the signature of numpy.random.rand.
+        The variates are drawn from *generator* in blocks of *size* values, and the calls
+        get slices of the current block. This amortizes the cost of drawing a few values
+        at a time, as when only a handful of nodes arrive in a step.
+        The slices are views of a block that is never overwritten, so they can be kept.
+        
+        Required arguments:
+        
+          *generator*:
+            A numpy.random.Generator.
+        
+        keyword arguments:
+        
+          *size*:
+            Integer, the number of variates drawn in each block.
+          
+          *dtype*:
+            The floating point type of the variates, numpy.float64 or numpy.float32.
+        '''
+        self.generator = generator
+        self.size = size
+        self.dtype = dtype
+        self.block = generator.random(size, dtype=dtype)
+        self.position = 0
+    
+    def __call__(self, *shape):
+        n = int(np.prod(shape))
+        if n > self.size:
+            return self.generator.random(shape, dtype=self.dtype)
+        if self.position + n > self.size:
+            self.block = self.generator.random(self.size, dtype=self.dtype)
+            self.position = 0
+        u = self.block[self.position:self.position+n]
+        self.position += n
+        return u.reshape(shape) if shape else u[0]
 
 # *************** Palm state probability **********************
 def pause_probability_init(pause_low, pause_high, speed_low, speed_high, dimensions):
@@ -32,7 +76,7 @@ def pause_probability_init(pause_low, pause_high, speed_low, speed_high, dimensi
     return alpha1/(alpha1+delta1)
 
 # *************** Palm residual ******************************
-def residual_time(mean, delta, shape=(1,)):
+def residual_time(mean, delta, shape=(1,), rand=rand):
     t1 = mean - delta;
     t2 = mean + delta;
     u = rand(*shape);
@@ -46,14 +90,61 @@ def residual_time(mean, delta, shape=(1,)):
     return residual
 
 # *********** Initial speed ***************************
-def initial_speed(speed_mean, speed_delta, shape=(1,)):
+def initial_speed(speed_mean, speed_delta, shape=(1,), rand=rand):
     v0 = speed_mean - speed_delta
     v1 = speed_mean + speed_delta
     u = rand(*shape)
     return pow(v1, u) / pow(v0, u - 1)
 
+# *********** Length-biased choice and residual ***************************
+def length_biased_choice(durations, rand=rand):
+    '''
+    Stationary state of a renewal process observed at a random step.
+    For each row of *durations*, an array with shape (n, k) holding the durations, in steps,
+    of k candidate states (flights or pauses) drawn for each of n nodes, chooses one candidate
+    with probability proportional to its duration, and a step of it uniformly.
+    As k grows, the chosen states follow the length-biased distribution of the states
+    in progress at a random step.
+
+    Returns the index of the chosen candidates and the number of steps already elapsed in them.
+    '''
+    cumulative = np.cumsum(durations, axis=1)
+    u = rand(len(durations)) * cumulative[:, -1]
+    choice = np.minimum(np.sum(cumulative <= u[:, np.newaxis], axis=1), durations.shape[1] - 1)
+    elapsed = np.floor(rand(len(durations)) * durations[np.arange(len(durations)), choice])
+    return choice, elapsed
+
+def stationary_flights(FL_DISTR, VELOCITY_DISTR, SAMPLES, rand=rand, candidates=32):
+    '''
+    Residual flight lengths and velocities of the flights in progress at a random step,
+    for models where the flights follow each other without pauses.
+    A flight of length fl at a given velocity lasts ceil(fl/velocity) steps.
+    '''
+    CANDIDATES = np.repeat(SAMPLES, candidates)
+    fl = FL_DISTR(CANDIDATES).reshape(len(SAMPLES), candidates)
+    velocity = VELOCITY_DISTR(fl.ravel()).reshape(len(SAMPLES), candidates)
+    choice, elapsed = length_biased_choice(np.ceil(fl / velocity), rand)
+    ROWS = np.arange(len(SAMPLES))
+    return fl[ROWS, choice] - elapsed * velocity[ROWS, choice], velocity[ROWS, choice]
+
+def group_offsets(velocity, aggregation, SAMPLES, rand=rand):
+    '''
+    Stationary offsets of nodes from their group center, for group models where each step the nodes
+    move by *velocity* in a random direction and by *aggregation* towards the center.
+    The offsets are isotropic, with a radial distance Gamma(2, velocity^2/(4*aggregation)),
+    the stationary distribution of a planar diffusion with a constant drift towards the center.
+    '''
+    scale = velocity ** 2 / (4. * aggregation)
+    r = E(scale, SAMPLES, rand) + E(scale, SAMPLES, rand)
+    phi = U(0, 2*np.pi, SAMPLES, rand)
+    return r * np.cos(phi), r * np.sin(phi)
+
+def reflect_into(x, max_x):
+    # folds the coordinates into [0, max_x], as repeated bounces on the margins
+    return max_x - np.abs(max_x - np.mod(x, 2*max_x))
+
 def init_random_waypoint(nr_nodes, dimensions,
-                         speed_low, speed_high, pause_low, pause_high):
+                         speed_low, speed_high, pause_low, pause_high, rand=rand):
 
     ndim = len(dimensions)
     positions = np.empty((nr_nodes, ndim))
@@ -71,26 +162,29 @@ def init_random_waypoint(nr_nodes, dimensions,
     # steady-state pause probability for Random Waypoint
     q0 = pause_probability_init(pause_low, pause_high, speed_low, speed_high, dimensions)
     
-    for i in range(nr_nodes):
-        
-        while True:
+    # rejection sampling, in batches of all the nodes still pending:
+    # each node draws a path (z1, z2), and is either paused (with probability q0)
+    # or accepts the path with probability proportional to its length
+    dimensions_array = np.array(dimensions, dtype=float)
+    diagonal2 = np.sum(dimensions_array ** 2)
+    pending = np.arange(nr_nodes)
+    while pending.size > 0:
+        n = pending.size
 
-            z1 = rand(ndim) * np.array(dimensions)
-            z2 = rand(ndim) * np.array(dimensions)
+        z1 = rand(n, ndim) * dimensions_array
+        z2 = rand(n, ndim) * dimensions_array
 
-            if rand() < q0:
-                moving[i] = 0.
-                break
-            else:
-                #r is a ratio of the length of the randomly chosen path over
-                # the length of a diagonal across the simulation area
-                r = np.sqrt(np.sum((z2 - z1) ** 2) / np.sum(np.array(dimensions) ** 2))
-                if rand() < r:
-                    moving[i] = 1.
-                    break
+        paused = rand(n) < q0
+        #r is a ratio of the length of the randomly chosen path over
+        # the length of a diagonal across the simulation area
+        r = np.sqrt(np.sum((z2 - z1) ** 2, axis=1) / diagonal2)
+        accepted = paused | (rand(n) < r)
 
-        positions[i] = z1
-        waypoints[i] = z2
+        done = pending[accepted]
+        positions[done] = z1[accepted]
+        waypoints[done] = z2[accepted]
+        moving[done] = np.where(paused[accepted], 0., 1.)
+        pending = pending[~accepted]
 
     # steady-state positions
     # initially the node has traveled a proportion u2 of the path from (x1,y1) to (x2,y2)
@@ -100,19 +194,131 @@ def init_random_waypoint(nr_nodes, dimensions,
     # steady-state speed and pause time
     paused_bool = moving==0.
     paused_idx = np.where(paused_bool)[0]
-    pause_time[paused_idx] = residual_time(pause_mean, pause_delta, paused_idx.shape)
+    pause_time[paused_idx] = residual_time(pause_mean, pause_delta, paused_idx.shape, rand)
     speed[paused_idx] = 0.0
 
     moving_bool = np.logical_not(paused_bool)
     moving_idx = np.where(moving_bool)[0]
     pause_time[moving_idx] = 0.0
-    speed[moving_idx] = initial_speed(speed_mean,speed_delta, moving_idx.shape)
+    speed[moving_idx] = initial_speed(speed_mean,speed_delta, moving_idx.shape, rand)
 
     return positions, waypoints, speed, pause_time
 
-class RandomWaypoint(object):
+class MobilityModel(object):
+    '''
+    Base class for the mobility models.
+    Subclasses implement __iter__, yielding the node positions at each step
+    as an array with shape (nr_nodes, ndim).
+    
+    Each model owns its random state: at the start of each iteration, init_random
+    creates a numpy Generator (self.rng) seeded with the *seed* given to the model
+    and a RandomBuffer (self.rand) used by the distributions.
+    If the seed is None, it is drawn from the global numpy random state,
+    so that numpy.random.seed still makes the models reproducible.
+
+    The models step their state in place: the array yielded by __iter__ is the model's
+    own position array, which is overwritten at the next step. A frame is valid until
+    the next one is requested; to keep it, copy it, or iterate with frames, which writes
+    each step into buffers owned by the caller.
+
+    The model state and the positions have the floating point type *dtype*
+    (numpy.float64 by default). With numpy.float32, the state of large runs takes
+    half the memory, and each step moves half the bytes.
+    '''
     
-    def __init__(self, nr_nodes, dimensions, velocity=(0.1, 1.), wt_max=None):
+    seed = None
+    dtype = np.float64
+    
+    def init_random(self):
+        seed = self.seed
+        if seed is None:
+            seed = np.random.randint(2**63-1, dtype=np.int64)
+        self.rng = np.random.default_rng(seed)
+        self.rand = RandomBuffer(self.rng, dtype=self.dtype)
+
+    def run(self, steps, out=None):
+        '''
+        Runs the model for a number of steps and returns the whole trajectory block,
+        an array with shape (steps, nr_nodes, ndim) where out[t] holds the positions at step t.
+        Each call starts a new realization of the model, equal to the first *steps* positions
+        yielded by iterating over the model with the same random state.
+
+        Required arguments:
+
+          *steps*:
+            Integer, the number of steps to run.
+
+        keyword arguments:
+
+          *out*:
+            Array with shape (steps, nr_nodes, ndim), preallocated by the caller,
+            where the positions are written. If None, a new array is allocated.
+
+        If the model ends before *steps* steps (as a replayed trace), only the
+        positions of the steps that were run are returned.
+
+        This is a convenience wrapper over the iteration: the steps are computed one at a time,
+        as by __iter__, and each frame is copied into the block, so the cost per step is that
+        of iterating over the model.
+        '''
+        shape = (self.nr_nodes, len(self.dimensions))
+        if getattr(self, 'replicas', None): shape = (self.replicas,) + shape
+        if out is not None and out.shape != (steps,) + shape:
+            raise Exception("The output array should have shape %s" % (((steps,) + shape),))
+        frames = iter(self)
+        count = 0
+        for t, xy in zip(range(steps), frames):
+            if out is None:
+                out = np.empty((steps,) + xy.shape, dtype=xy.dtype)
+            out[t] = xy
+            count += 1
+        if out is None:
+            out = np.empty((0,) + shape, dtype=self.dtype)
+        elif count < steps:
+            out = out[:count]
+        return out
+
+    def frames(self, out=None, ring=None):
+        '''
+        Iterates over the positions of the model, as __iter__, but copies each step into a buffer
+        owned by the caller, and yields that buffer. Once the buffers are set up, the steps
+        allocate no new arrays.
+
+        keyword arguments:
+
+          *out*:
+            Array with the shape of a frame, where every step is written.
+            Each yielded frame is valid until the next step.
+
+          *ring*:
+            Integer k, or array with shape (k,) + frame shape, a ring of k buffers
+            where the steps are written in turn. Each yielded frame stays valid
+            during the k-1 steps that follow it.
+
+        If neither is given, a single buffer is allocated, as with *out*.
+        '''
+        if out is not None and ring is not None:
+            raise Exception("Only one of the parameters 'out' and 'ring' can be set")
+        buffers = None
+        k = 0
+        for xy in self:
+            if buffers is None:
+                if out is not None:
+                    buffers = [out]
+                elif ring is None or np.isscalar(ring):
+                    buffers = list(np.empty((int(ring or 1),) + xy.shape, dtype=xy.dtype))
+                else:
+                    buffers = list(ring)
+                if buffers[0].shape != xy.shape:
+                    raise Exception("The output buffers should have frame shape %s" % (xy.shape,))
+            frame = buffers[k]
+            np.copyto(frame, xy)
+            k = (k + 1) % len(buffers)
+            yield frame
+
+class RandomWaypoint(MobilityModel):
+    
+    def __init__(self, nr_nodes, dimensions, velocity=(0.1, 1.), wt_max=None, replicas=None, seed=None, dtype=np.float64):
         '''
         Random Waypoint model.
         
@@ -132,75 +338,276 @@ class RandomWaypoint(object):
           *wt_max*:
             Integer, the maximum wait time for node pauses.
             If wt_max is 0 or None, there is no pause time.
+
+          *replicas*:
+            Integer, the number of independent replicas of the model that are simulated together.
+            If set, the state of all replicas is kept in the same arrays and stepped at once,
+            and the positions are yielded as an array with shape (replicas, nr_nodes, ndim).
+            The replicas draw disjoint variates from the single random stream of the model,
+            so they are statistically independent, but they do not have a stream each:
+            the trajectory of a replica depends on the number of replicas and on its position
+            among them. For a stream per replica (from SeedSequence(seed).spawn), reproducible
+            on its own, run separate models, e.g. with pymobility.ensemble.
+            Default is None (a single simulation, positions with shape (nr_nodes, ndim)).
+
+          *seed*:
+            Integer or SeedSequence, the seed of the model's random Generator.
+            Each iteration over the model restarts from this seed.
+            If None, the seed is drawn from the global numpy random state.
+
+          *dtype*:
+            The floating point type of the model state and of the positions,
+            numpy.float64 (default) or numpy.float32.
         '''
         
         self.nr_nodes = nr_nodes
         self.dimensions = dimensions
         self.velocity = velocity
+        # the velocity attribute is replaced by the current node velocities while iterating
+        self.velocity_range = velocity
         self.wt_max = wt_max
+        self.replicas = replicas
+        self.seed = seed
+        self.dtype = dtype
         self.init_stationary = True
     
     def __iter__(self):
         
+        self.init_random()
+        rand = self.rand
         ndim = len(self.dimensions)
-        MIN_V, MAX_V = self.velocity
+        MIN_V, MAX_V = self.velocity_range
+        ZEROS = np.zeros(ndim, dtype=self.dtype)
+        DIMENSIONS = np.array(self.dimensions, dtype=self.dtype)
         
         wt_min = 0.
         
+        # the replicas are simulated as a single set of independent nodes
+        nr_nodes = self.nr_nodes * (self.replicas or 1)
+        shape = (self.replicas, self.nr_nodes, ndim) if self.replicas else (self.nr_nodes, ndim)
+        
         if self.init_stationary:
 
-            positions, waypoints, velocity, wt = \
-                init_random_waypoint(self.nr_nodes, self.dimensions, MIN_V, MAX_V, wt_min, 
-                             (self.wt_max if self.wt_max is not None else 0.))
+            positions, waypoints, velocity, wt = [a.astype(self.dtype, copy=False) for a in
+                init_random_waypoint(nr_nodes, self.dimensions, MIN_V, MAX_V, wt_min, 
+                             (self.wt_max if self.wt_max is not None else 0.), rand)]
         else:
 
-            NODES = np.arange(self.nr_nodes)
-            positions = U(np.zeros(ndim), np.array(self.dimensions), np.dstack((NODES,)*ndim)[0])
-            waypoints = U(np.zeros(ndim), np.array(self.dimensions), np.dstack((NODES,)*ndim)[0])
-            wt = np.zeros(self.nr_nodes)
-            velocity = U(MIN_V, MAX_V, NODES)
+            NODES = np.arange(nr_nodes)
+            positions = U(ZEROS, DIMENSIONS, np.dstack((NODES,)*ndim)[0], rand)
+            waypoints = U(ZEROS, DIMENSIONS, np.dstack((NODES,)*ndim)[0], rand)
+            wt = np.zeros(nr_nodes, dtype=self.dtype)
+            velocity = U(MIN_V, MAX_V, NODES, rand)
 
         # assign nodes' movements (direction * node velocity)
         direction = waypoints - positions
         direction /= np.linalg.norm(direction, axis=1)[:, np.newaxis]
-        
+
+        # scratch buffers, so that the steps are computed in place
+        frame = positions.reshape(shape)
+        step = np.empty_like(positions)
+        d = np.empty(nr_nodes, dtype=self.dtype)
+        mask = np.empty(nr_nodes, dtype=bool)
+        mask2 = np.empty(nr_nodes, dtype=bool)
+
         while True:
             # update node position
-            positions += direction * velocity[:, np.newaxis]
+            np.multiply(direction, velocity[:, np.newaxis], out=step)
+            positions += step
             # calculate distance to waypoint
-            d = np.sqrt(np.sum(np.square(waypoints - positions), axis=1))
+            np.subtract(waypoints, positions, out=step)
+            np.square(step, out=step)
+            np.sum(step, axis=1, out=d)
+            np.sqrt(d, out=d)
             # update info for arrived nodes
-            arrived = np.where(np.logical_and(d<=velocity, wt<=0.))[0]
-            
+            np.less_equal(d, velocity, out=mask)
+            np.less_equal(wt, 0., out=mask2)
+            mask &= mask2
+            arrived = np.flatnonzero(mask)
+
             # step back for nodes that surpassed waypoint
             positions[arrived] = waypoints[arrived]
-            
+
             if self.wt_max:
                 velocity[arrived] = 0.
-                wt[arrived] = U(0, self.wt_max, arrived)
+                wt[arrived] = U(0, self.wt_max, arrived, rand)
                 # update info for paused nodes
-                wt[np.where(velocity==0.)[0]] -= 1.
+                np.equal(velocity, 0., out=mask)
+                np.subtract(wt, 1., out=wt, where=mask)
                 # update info for moving nodes
-                arrived = np.where(np.logical_and(velocity==0., wt<0.))[0]
-            
+                np.less(wt, 0., out=mask2)
+                mask &= mask2
+                arrived = np.flatnonzero(mask)
+
             if arrived.size > 0:
-                waypoints[arrived] = U(np.zeros(ndim), np.array(self.dimensions), np.zeros((arrived.size, ndim)))
-                velocity[arrived] = U(MIN_V, MAX_V, arrived)
+                waypoints[arrived] = U(ZEROS, DIMENSIONS, np.zeros((arrived.size, ndim)), rand)
+                velocity[arrived] = U(MIN_V, MAX_V, arrived, rand)
 
                 new_direction = waypoints[arrived] - positions[arrived]
                 direction[arrived] = new_direction / np.linalg.norm(new_direction, axis=1)[:, np.newaxis]
             
             self.velocity = velocity
             self.wt = wt
-            yield positions
+            yield frame
+
+class EventDrivenRandomWaypoint(MobilityModel):
+    
+    def __init__(self, nr_nodes, dimensions, velocity=(0.1, 1.), wt_max=None, step=1., seed=None):
+        '''
+        Event-driven Random Waypoint model.
+        Each node moves along straight legs at constant speed, so instead of advancing
+        every node at every tick, this model keeps the current leg of each node as a
+        (start, end, t0, t1, t2) segment: the node leaves *start* at time t0, reaches *end*
+        at time t1 and pauses there until t2, when its next leg starts.
+        The leg end times t2 are the event queue: when the positions are requested for a
+        time t, only the legs that ended before t are replaced (in vectorized batches),
+        and the positions are interpolated along the current legs.
+        The initial state is the Palm stationary state of init_random_waypoint.
+        
+        Required arguments:
+        
+          *nr_nodes*:
+            Integer, the number of nodes.
+          
+          *dimensions*:
+            Tuple of Integers, the x and y dimensions of the simulation area.
+          
+        keyword arguments:
+        
+          *velocity*:
+            Tuple of Doubles, the minimum and maximum values for node velocity.
+          
+          *wt_max*:
+            Double, the maximum wait time for node pauses.
+            If wt_max is 0 or None, there is no pause time.
+          
+          *step*:
+            Double, the time between the positions yielded when iterating over the model.
+          
+          *seed*:
+            Integer or SeedSequence, the seed of the model's random Generator.
+            Each iteration over the model, or call to reset, restarts from this seed.
+            If None, the seed is drawn from the global numpy random state.
+        '''
+        self.nr_nodes = nr_nodes
+        self.dimensions = dimensions
+        self.velocity = velocity
+        self.wt_max = wt_max
+        self.step = step
+        self.seed = seed
+        self.time = None
+    
+    def reset(self):
+        '''
+        Starts a new realization of the model at time 0, from the Palm stationary state.
+        '''
+        self.init_random()
+        MIN_V, MAX_V = self.velocity
+        
+        positions, waypoints, velocity, wt = \
+            init_random_waypoint(self.nr_nodes, self.dimensions, MIN_V, MAX_V, 0.,
+                                 (self.wt_max if self.wt_max is not None else 0.), self.rand)
+        
+        moving = velocity > 0.
+        self.start = positions
+        self.end = np.where(moving[:, np.newaxis], waypoints, positions)
+        self.t0 = np.zeros(self.nr_nodes)
+        self.t1 = np.zeros(self.nr_nodes)
+        self.t1[moving] = np.sqrt(np.sum(np.square(waypoints[moving] - positions[moving]), axis=1)) / velocity[moving]
+        self.t2 = self.t1 + self.pause_times(self.nr_nodes)
+        # paused nodes start the next leg after their residual pause time
+        self.t2[~moving] = wt[~moving]
+        self.time = 0.
+        # scratch buffers for advance and positions
+        self.ended = np.empty(self.nr_nodes, dtype=bool)
+        self.moving = np.empty(self.nr_nodes, dtype=bool)
+        self.duration = np.empty(self.nr_nodes)
+        self.fraction = np.empty(self.nr_nodes)
+    
+    def pause_times(self, n):
+        if self.wt_max:
+            return U(0, self.wt_max, np.empty(n), self.rand)
+        return np.zeros(n)
+    
+    def advance(self, t):
+        '''
+        Replaces the legs that ended before time *t*, until every node is in the leg
+        (or pause) that covers time *t*.
+        '''
+        if self.time is None: self.reset()
+        if t < self.time:
+            raise Exception("The model can only be advanced forward in time")
+        
+        MIN_V, MAX_V = self.velocity
+        ndim = len(self.dimensions)
+        while True:
+            np.less_equal(self.t2, t, out=self.ended)
+            arrived = np.flatnonzero(self.ended)
+            if arrived.size == 0: break
+            
+            start = self.end[arrived]
+            end = U(np.zeros(ndim), np.array(self.dimensions), np.empty((arrived.size, ndim)), self.rand)
+            velocity = U(MIN_V, MAX_V, arrived, self.rand)
+            t0 = self.t2[arrived]
+            t1 = t0 + np.sqrt(np.sum(np.square(end - start), axis=1)) / velocity
+            
+            self.start[arrived] = start
+            self.end[arrived] = end
+            self.t0[arrived] = t0
+            self.t1[arrived] = t1
+            self.t2[arrived] = t1 + self.pause_times(arrived.size)
+        self.time = t
+    
+    def positions(self, t, out=None):
+        '''
+        Returns the node positions at time *t*.
+        Times must be requested in non-decreasing order.
+        '''
+        self.advance(t)
+        duration, fraction, moving = self.duration, self.fraction, self.moving
+        np.subtract(self.t1, self.t0, out=duration)
+        np.greater(duration, 0., out=moving)
+        fraction.fill(1.)
+        np.subtract(t, self.t0, out=fraction, where=moving)
+        np.divide(fraction, duration, out=fraction, where=moving)
+        np.clip(fraction, 0., 1., out=fraction)
+        if out is None:
+            out = np.empty_like(self.start)
+        np.subtract(self.end, self.start, out=out)
+        out *= fraction[:, np.newaxis]
+        out += self.start
+        return out
+    
+    def sample(self, times, out=None):
+        '''
+        Returns the node positions at each of the (non-decreasing) *times*,
+        as an array with shape (len(times), nr_nodes, ndim).
+        '''
+        if out is None:
+            out = np.empty((len(times), self.nr_nodes, len(self.dimensions)))
+        for k, t in enumerate(times):
+            self.positions(t, out=out[k])
+        return out
+    
+    def __iter__(self):
+        self.reset()
+        frame = np.empty_like(self.start)
+        t = 0.
+        while True:
+            t += self.step
+            yield self.positions(t, out=frame)
 
-class StochasticWalk(object):
+class StochasticWalk(MobilityModel):
     
-    def __init__(self, nr_nodes, dimensions, FL_DISTR, VELOCITY_DISTR, WT_DISTR=None, border_policy='reflect'):
+    def __init__(self, nr_nodes, dimensions, FL_DISTR, VELOCITY_DISTR, WT_DISTR=None, border_policy='reflect', replicas=None, seed=None, dtype=np.float64):
         '''
         Base implementation for models with direction uniformly chosen from [0,pi]:
         random_direction, random_walk, truncated_levy_walk
         
+        The nodes start from the stationary state of the walk (see stationary_state), so there
+        is no need to ignore warm-up steps. Set the init_stationary attribute to False to start
+        with uniform positions, fresh flights and no pauses.
+        
         Required arguments:
         
           *nr_nodes*:
@@ -234,6 +641,32 @@ class StochasticWalk(object):
             String, either 'reflect' or 'wrap'. The policy that is used when the node arrives to the border.
             If 'reflect', the node reflects off the border.
             If 'wrap', the node reappears at the opposite edge (as in a torus-shaped area).
+
+          *replicas*:
+            Integer, the number of independent replicas of the model that are simulated together.
+            If set, the distributions receive node indices up to replicas*nr_nodes,
+            the state of all replicas is kept in the same arrays and stepped at once,
+            and the positions are yielded as an array with shape (replicas, nr_nodes, ndim).
+            The replicas draw disjoint variates from the single random stream of the model,
+            so they are statistically independent, but they do not have a stream each:
+            the trajectory of a replica depends on the number of replicas and on its position
+            among them. For a stream per replica (from SeedSequence(seed).spawn), reproducible
+            on its own, run separate models, e.g. with pymobility.ensemble.
+            Default is None (a single simulation, positions with shape (nr_nodes, ndim)).
+
+          *seed*:
+            Integer or SeedSequence, the seed of the model's random Generator.
+            Each iteration over the model restarts from this seed.
+            The distributions can draw from the model's source of uniform variates,
+            self.rand, which is created at the start of each iteration.
+            If None, the seed is drawn from the global numpy random state.
+
+          *dtype*:
+            The floating point type of the model state (positions, flight lengths,
+            velocities, wait times and movements) and of the positions yielded,
+            numpy.float64 (default) or numpy.float32.
+            The uniform variates of self.rand have this type, and the values returned
+            by the distributions are converted to it.
         '''
         self.collect_fl_stats = False
         self.collect_wt_stats = False
@@ -243,26 +676,74 @@ class StochasticWalk(object):
         self.FL_DISTR = FL_DISTR
         self.VELOCITY_DISTR = VELOCITY_DISTR
         self.WT_DISTR = WT_DISTR
+        self.replicas = replicas
+        self.seed = seed
+        self.dtype = dtype
+        # start from the stationary state (see stationary_state)
+        self.init_stationary = True
+        self.stationary_candidates = 32
+    
+    def stationary_state(self, NODES):
+        '''
+        Samples the state of the nodes at a random time of a long run, so that the model
+        needs no warm-up steps: each node is in a flight or in a pause with probability
+        proportional to their durations (fl/velocity and wt steps), with the flight or pause
+        chosen by length_biased_choice among self.stationary_candidates draws of the
+        node distributions, and only the part of it that follows a random step left.
+        The positions and directions of a stationary walk are uniform, as at the start.
+        
+        Returns the flight lengths, velocities and wait times of the nodes, and the velocities
+        of their movements (paused nodes keep moving with the velocity of their last flight).
+        '''
+        K = self.stationary_candidates
+        n = len(NODES)
+        fl = np.zeros(n)
+        velocity = np.zeros(n)
+        wt = np.zeros(n)
+        last_velocity = np.empty(n)
+        # the candidates are drawn in chunks of nodes, to bound the memory used
+        chunk = max(1, 2**20 // K)
+        for start in range(0, n, chunk):
+            SAMPLES = NODES[start:start+chunk]
+            m = len(SAMPLES)
+            ROWS = np.arange(m)
+            CANDIDATES = np.repeat(SAMPLES, K)
+            c_fl = np.asarray(self.FL_DISTR(CANDIDATES), dtype=float).reshape(m, K)
+            c_velocity = np.asarray(self.VELOCITY_DISTR(c_fl.ravel()), dtype=float).reshape(m, K)
+            # a flight is seen during ceil(fl/velocity) steps, a pause during floor(wt) steps
+            durations = np.ceil(c_fl / c_velocity)
+            if self.WT_DISTR:
+                c_wt = np.asarray(self.WT_DISTR(CANDIDATES), dtype=float).reshape(m, K)
+                durations = np.hstack((durations, np.floor(c_wt)))
+            choice, elapsed = length_biased_choice(durations, self.rand)
+            
+            moving = choice < K
+            flight = np.minimum(choice, K - 1)
+            fl[start:start+m] = np.where(moving, c_fl[ROWS, flight] - elapsed * c_velocity[ROWS, flight], 0.)
+            velocity[start:start+m] = np.where(moving, c_velocity[ROWS, flight], 0.)
+            last_velocity[start:start+m] = np.where(moving, c_velocity[ROWS, flight], c_velocity[:, 0])
+            if self.WT_DISTR:
+                pause = np.maximum(choice - K, 0)
+                wt[start:start+m] = np.where(moving, 0., c_wt[ROWS, pause] - 1. - elapsed)
+        return fl, velocity, wt, last_velocity
         
     def __iter__(self):
         def reflect(xy):
             # node bounces on the margins
             for dim, max_d in enumerate(self.dimensions):
-                b = np.where(xy[:,dim]<0)[0]
-                if b.size > 0:
-                    xy[b,dim] = - xy[b,dim]
-                    movement[b,dim] = -movement[b,dim]
-                b = np.where(xy[:,dim]>max_d)[0]
-                if b.size > 0:
-                    xy[b,dim] = 2*max_d - xy[b,dim]
-                    movement[b,dim] = -movement[b,dim]
+                b = np.less(xy[:,dim], 0, out=border)
+                np.negative(xy[:,dim], out=xy[:,dim], where=b)
+                np.negative(movement[:,dim], out=movement[:,dim], where=b)
+                b = np.greater(xy[:,dim], max_d, out=border)
+                np.subtract(2*max_d, xy[:,dim], out=xy[:,dim], where=b)
+                np.negative(movement[:,dim], out=movement[:,dim], where=b)
         
         def wrap(xy):
             for dim, max_d in enumerate(self.dimensions):
-                b = np.where(xy[:,dim]<0)[0]
-                if b.size > 0: xy[b,dim] += max_d
-                b = np.where(xy[:,dim]>max_d)[0]
-                if b.size > 0: xy[b,dim] -= max_d
+                b = np.less(xy[:,dim], 0, out=border)
+                np.add(xy[:,dim], max_d, out=xy[:,dim], where=b)
+                b = np.greater(xy[:,dim], max_d, out=border)
+                np.subtract(xy[:,dim], max_d, out=xy[:,dim], where=b)
         
         if self.border_policy == 'reflect':
             borderp = reflect
@@ -271,35 +752,52 @@ class StochasticWalk(object):
         else:
             borderp = self.border_policy
         
+        self.init_random()
+        rand = self.rand
         ndim = len(self.dimensions)
-        NODES = np.arange(self.nr_nodes)
+        # the replicas are simulated as a single set of independent nodes
+        nr_nodes = self.nr_nodes * (self.replicas or 1)
+        shape = (self.replicas, self.nr_nodes, ndim) if self.replicas else (self.nr_nodes, ndim)
+        NODES = np.arange(nr_nodes)
 
         # assign node's positions, flight lengths and velocities
-        xy = U(np.zeros(ndim), np.array(self.dimensions), np.dstack((NODES,)*ndim)[0])
-        fl = self.FL_DISTR(NODES)
-        velocity = self.VELOCITY_DISTR(fl)
+        xy = U(np.zeros(ndim, dtype=self.dtype), np.array(self.dimensions, dtype=self.dtype), np.dstack((NODES,)*ndim)[0], rand)
+        if self.init_stationary:
+            fl, velocity, wt, last_velocity = [a.astype(self.dtype) for a in self.stationary_state(NODES)]
+        else:
+            fl = np.asarray(self.FL_DISTR(NODES), dtype=self.dtype)
+            velocity = np.asarray(self.VELOCITY_DISTR(fl), dtype=self.dtype)
+            last_velocity = velocity
+            # starts with no wating time
+            wt = np.zeros(nr_nodes, dtype=self.dtype)
 
         # assign nodes' movements (direction * node velocity)
-        direction = U(0., 1., np.zeros((self.nr_nodes, ndim))) - 0.5
+        direction = U(0., 1., np.zeros((nr_nodes, ndim)), rand) - 0.5
         direction /= np.linalg.norm(direction, axis=1)[:, np.newaxis]
-        movement = direction * velocity[:, np.newaxis]
-
-        # starts with no wating time
-        wt = np.zeros(self.nr_nodes)
+        movement = direction * last_velocity[:, np.newaxis]
         
         if self.collect_fl_stats: self.fl_stats = list(fl)
         if  self.collect_wt_stats: self.wt_stats = list(wt)
 
+        # scratch buffers, so that the steps are computed in place
+        frame = xy.reshape(shape)
+        border = np.empty(nr_nodes, dtype=bool)
+        mask = np.empty(nr_nodes, dtype=bool)
+        mask2 = np.empty(nr_nodes, dtype=bool)
+
         while True:
     
             xy += movement
             fl -= velocity
             
             # step back for nodes that surpassed fl
-            arrived = np.where(np.logical_and(velocity>0., fl<=0.))[0]
+            np.greater(velocity, 0., out=mask)
+            np.less_equal(fl, 0., out=mask2)
+            mask &= mask2
+            arrived = np.flatnonzero(mask)
             if arrived.size > 0:
                 diff = fl.take(arrived) / velocity.take(arrived)
-                xy[arrived] += np.dstack((diff,)*ndim)[0] * movement[arrived]
+                xy[arrived] += diff[:, np.newaxis] * movement[arrived]
             
             # apply border policy
             borderp(xy)
@@ -309,8 +807,11 @@ class StochasticWalk(object):
                 wt[arrived] = self.WT_DISTR(arrived)
                 if self.collect_wt_stats: self.wt_stats.extend(wt[arrived])
                 # update info for paused nodes
-                wt[np.where(velocity==0.)[0]] -= 1.
-                arrived = np.where(np.logical_and(velocity==0., wt<0.))[0]
+                np.equal(velocity, 0., out=mask)
+                np.subtract(wt, 1., out=wt, where=mask)
+                np.less(wt, 0., out=mask2)
+                mask &= mask2
+                arrived = np.flatnonzero(mask)
             
             # update info for moving nodes
             if arrived.size > 0:
@@ -319,15 +820,15 @@ class StochasticWalk(object):
                 if self.collect_fl_stats: self.fl_stats.extend(fl[arrived])
                 velocity[arrived] = self.VELOCITY_DISTR(fl[arrived])
                 v = velocity[arrived]
-                direction = U(0., 1., np.zeros((arrived.size, ndim))) - 0.5
+                direction = U(0., 1., np.zeros((arrived.size, ndim)), rand) - 0.5
                 direction /= np.linalg.norm(direction, axis=1)[:, np.newaxis]
                 movement[arrived] = v[:, np.newaxis] * direction
     
-            yield xy
+            yield frame
 
 class RandomWalk(StochasticWalk):
     
-    def __init__(self, nr_nodes, dimensions, velocity=1., distance=1., border_policy='reflect'):
+    def __init__(self, nr_nodes, dimensions, velocity=1., distance=1., border_policy='reflect', replicas=None, seed=None, dtype=np.float64):
         '''
         Random Walk mobility model.
         This model is based in the Stochastic Walk, but both the flight length and node velocity distributions are in fact constants,
@@ -353,23 +854,29 @@ class RandomWalk(StochasticWalk):
             String, either 'reflect' or 'wrap'. The policy that is used when the node arrives to the border.
             If 'reflect', the node reflects off the border.
             If 'wrap', the node reappears at the opposite edge (as in a torus-shaped area).
+
+          *replicas*:
+            Integer, the number of independent replicas simulated together (see StochasticWalk).
+
+          *seed*:
+            Integer or SeedSequence, the seed of the model's random Generator (see StochasticWalk).
+
+          *dtype*:
+            The floating point type of the model state (see StochasticWalk).
         '''
         if velocity>distance:
             # In this implementation, each step is 1 second,
             # it is not possible to have a velocity larger than the distance
             raise Exception('Velocity must be <= Distance')
         
-        fl = np.zeros(nr_nodes)+distance
-        vel = np.zeros(nr_nodes)+velocity
-        
-        FL_DISTR = lambda SAMPLES: np.array(fl[:len(SAMPLES)])
-        VELOCITY_DISTR = lambda FD: np.array(vel[:len(FD)])
+        FL_DISTR = lambda SAMPLES: np.zeros(len(SAMPLES), dtype=dtype)+distance
+        VELOCITY_DISTR = lambda FD: np.zeros(len(FD), dtype=dtype)+velocity
         
-        StochasticWalk.__init__(self, nr_nodes, dimensions, FL_DISTR, VELOCITY_DISTR,border_policy=border_policy)
+        StochasticWalk.__init__(self, nr_nodes, dimensions, FL_DISTR, VELOCITY_DISTR,border_policy=border_policy, replicas=replicas, seed=seed, dtype=dtype)
 
 class RandomDirection(StochasticWalk):
     
-    def __init__(self, nr_nodes, dimensions, wt_max=None, velocity=(0.1, 1.), border_policy='reflect'):
+    def __init__(self, nr_nodes, dimensions, wt_max=None, velocity=(0.1, 1.), border_policy='reflect', replicas=None, seed=None, dtype=np.float64):
         '''
         Random Direction mobility model.
         This model is based in the Stochastic Walk. The flight length is chosen from a uniform distribution, 
@@ -401,23 +908,32 @@ class RandomDirection(StochasticWalk):
             String, either 'reflect' or 'wrap'. The policy that is used when the node arrives to the border.
             If 'reflect', the node reflects off the border.
             If 'wrap', the node reappears at the opposite edge (as in a torus-shaped area).
+
+          *replicas*:
+            Integer, the number of independent replicas simulated together (see StochasticWalk).
+
+          *seed*:
+            Integer or SeedSequence, the seed of the model's random Generator (see StochasticWalk).
+
+          *dtype*:
+            The floating point type of the model state (see StochasticWalk).
         '''
         
         MIN_V, MAX_V = velocity
         FL_MAX = max(dimensions)
         
-        FL_DISTR = lambda SAMPLES: U(0, FL_MAX, SAMPLES)
+        FL_DISTR = lambda SAMPLES: U(0, FL_MAX, SAMPLES, self.rand)
         if wt_max:
-            WT_DISTR = lambda SAMPLES: U(0, wt_max, SAMPLES)
+            WT_DISTR = lambda SAMPLES: U(0, wt_max, SAMPLES, self.rand)
         else:
             WT_DISTR = None
-        VELOCITY_DISTR = lambda FD: U(MIN_V, MAX_V, FD)
+        VELOCITY_DISTR = lambda FD: U(MIN_V, MAX_V, FD, self.rand)
         
-        StochasticWalk.__init__(self, nr_nodes, dimensions, FL_DISTR, VELOCITY_DISTR, WT_DISTR=WT_DISTR, border_policy=border_policy)
+        StochasticWalk.__init__(self, nr_nodes, dimensions, FL_DISTR, VELOCITY_DISTR, WT_DISTR=WT_DISTR, border_policy=border_policy, replicas=replicas, seed=seed, dtype=dtype)
 
 class TruncatedLevyWalk(StochasticWalk):
     
-    def __init__(self, nr_nodes, dimensions, FL_EXP=-2.6, FL_MAX=50., WT_EXP=-1.8, WT_MAX=100., border_policy='reflect'):
+    def __init__(self, nr_nodes, dimensions, FL_EXP=-2.6, FL_MAX=50., WT_EXP=-1.8, WT_MAX=100., border_policy='reflect', replicas=None, seed=None, dtype=np.float64):
         '''
         Truncated Levy Walk mobility model, based on the following paper:
         Injong Rhee, Minsu Shin, Seongik Hong, Kyunghan Lee, and Song Chong. On the Levy-Walk Nature of Human Mobility. 
@@ -454,20 +970,29 @@ class TruncatedLevyWalk(StochasticWalk):
             String, either 'reflect' or 'wrap'. The policy that is used when the node arrives to the border.
             If 'reflect', the node reflects off the border.
             If 'wrap', the node reappears at the opposite edge (as in a torus-shaped area).
+
+          *replicas*:
+            Integer, the number of independent replicas simulated together (see StochasticWalk).
+
+          *seed*:
+            Integer or SeedSequence, the seed of the model's random Generator (see StochasticWalk).
+
+          *dtype*:
+            The floating point type of the model state (see StochasticWalk).
         '''
         
-        FL_DISTR = lambda SAMPLES: P(FL_EXP, 1., FL_MAX, SAMPLES)
+        FL_DISTR = lambda SAMPLES: P(FL_EXP, 1., FL_MAX, SAMPLES, self.rand)
         if WT_EXP and WT_MAX:
-            WT_DISTR = lambda SAMPLES: P(WT_EXP, 1., WT_MAX, SAMPLES)
+            WT_DISTR = lambda SAMPLES: P(WT_EXP, 1., WT_MAX, SAMPLES, self.rand)
         else:
             WT_DISTR = None
         VELOCITY_DISTR = lambda FD: np.sqrt(FD)/10.
         
-        StochasticWalk.__init__(self, nr_nodes, dimensions, FL_DISTR, VELOCITY_DISTR, WT_DISTR=WT_DISTR, border_policy=border_policy)
+        StochasticWalk.__init__(self, nr_nodes, dimensions, FL_DISTR, VELOCITY_DISTR, WT_DISTR=WT_DISTR, border_policy=border_policy, replicas=replicas, seed=seed, dtype=dtype)
 
 class HeterogeneousTruncatedLevyWalk(StochasticWalk):
 
-    def __init__(self, nr_nodes, dimensions, WT_EXP=-1.8, WT_MAX=100., FL_EXP=-2.6, FL_MAX=50., border_policy='reflect'):
+    def __init__(self, nr_nodes, dimensions, WT_EXP=-1.8, WT_MAX=100., FL_EXP=-2.6, FL_MAX=50., border_policy='reflect', replicas=None, seed=None, dtype=np.float64):
         '''
         This is a variant of the Truncated Levy Walk mobility model.
         This model is based in the Stochastic Walk.
@@ -502,21 +1027,39 @@ class HeterogeneousTruncatedLevyWalk(StochasticWalk):
             String, either 'reflect' or 'wrap'. The policy that is used when the node arrives to the border.
             If 'reflect', the node reflects off the border.
             If 'wrap', the node reappears at the opposite edge (as in a torus-shaped area).
+
+          *replicas*:
+            Integer, the number of independent replicas simulated together (see StochasticWalk).
+
+          *seed*:
+            Integer or SeedSequence, the seed of the model's random Generator (see StochasticWalk).
+
+          *dtype*:
+            The floating point type of the model state (see StochasticWalk).
         '''
         
-        NODES = np.arange(nr_nodes)
-        FL_MAX = P(-1.8, 10., FL_MAX, NODES)
+        # the node heterogeneity is drawn once, from a stream independent of the iterations
+        if seed is not None:
+            if not isinstance(seed, np.random.SeedSequence): seed = np.random.SeedSequence(seed)
+            init_rand = RandomBuffer(np.random.default_rng(seed.spawn(1)[0]))
+        else:
+            init_rand = rand
+        NODES = np.arange(nr_nodes * (replicas or 1))
+        FL_MAX = P(-1.8, 10., FL_MAX, NODES, init_rand).astype(dtype)
         FL_MIN = FL_MAX/10.
         
-        FL_DISTR = lambda SAMPLES: rand(len(SAMPLES)) * (FL_MAX[SAMPLES] - FL_MIN[SAMPLES]) + FL_MIN[SAMPLES]
-        WT_DISTR = lambda SAMPLES: P(WT_EXP, 1., WT_MAX, SAMPLES)
+        FL_DISTR = lambda SAMPLES: self.rand(len(SAMPLES)) * (FL_MAX[SAMPLES] - FL_MIN[SAMPLES]) + FL_MIN[SAMPLES]
+        WT_DISTR = lambda SAMPLES: P(WT_EXP, 1., WT_MAX, SAMPLES, self.rand)
         VELOCITY_DISTR = lambda FD: np.sqrt(FD)/10.
         
-        StochasticWalk.__init__(self, nr_nodes, dimensions, FL_DISTR, VELOCITY_DISTR, WT_DISTR=WT_DISTR, border_policy=border_policy)
+        StochasticWalk.__init__(self, nr_nodes, dimensions, FL_DISTR, VELOCITY_DISTR, WT_DISTR=WT_DISTR, border_policy=border_policy, replicas=replicas, seed=seed, dtype=dtype)
         
 def random_waypoint(*args, **kwargs):
     return iter(RandomWaypoint(*args, **kwargs))
 
+def event_driven_random_waypoint(*args, **kwargs):
+    return iter(EventDrivenRandomWaypoint(*args, **kwargs))
+
 def stochastic_walk(*args, **kwargs):
     return iter(StochasticWalk(*args, **kwargs))
 
@@ -532,358 +1075,580 @@ def truncated_levy_walk(*args, **kwargs):
 def heterogeneous_truncated_levy_walk(*args, **kwargs):
     return iter(HeterogeneousTruncatedLevyWalk(*args, **kwargs))
 
-def gauss_markov(nr_nodes, dimensions, velocity_mean=1., alpha=1., variance=1.):
-    '''
-    Gauss-Markov Mobility Model, as proposed in 
-    Camp, T., Boleng, J. & Davies, V. A survey of mobility models for ad hoc network research. 
-    Wireless Communications and Mobile Computing 2, 483-502 (2002).
-    
-    Required arguments:
-    
-      *nr_nodes*:
-        Integer, the number of nodes.
-      
-      *dimensions*:
-        Tuple of Integers, the x and y dimensions of the simulation area.
+class GaussMarkov(MobilityModel):
+
+    def __init__(self, nr_nodes, dimensions, velocity_mean=1., alpha=1., variance=1., seed=None, dtype=np.float64):
+        '''
+        Gauss-Markov Mobility Model, as proposed in 
+        Camp, T., Boleng, J. & Davies, V. A survey of mobility models for ad hoc network research. 
+        Wireless Communications and Mobile Computing 2, 483-502 (2002).
         
-    keyword arguments:
-    
-      *velocity_mean*:
-        The mean velocity
+        The nodes start from the stationary state of the velocity and direction processes,
+        normal with means velocity_mean and the node's mean direction, and standard deviation *variance*.
+        Set the init_stationary attribute to False to start every node at the mean values.
         
-      *alpha*:
-        The tuning parameter used to vary the randomness
+        Required arguments:
         
-      *variance*:
-        The randomness variance
-    '''
-    
-    MAX_X, MAX_Y = dimensions
-    NODES = np.arange(nr_nodes)
-    x = U(0, MAX_X, NODES)
-    y = U(0, MAX_Y, NODES)
-    velocity =  np.zeros(nr_nodes)+velocity_mean
-    theta = U(0, 2*np.pi, NODES)
-    angle_mean = theta
-    
-    alpha2 = 1.0 - alpha
-    alpha3 = np.sqrt(1.0 - alpha * alpha) * variance
-    
-    while True:
-
-        x = x + velocity * np.cos(theta)
-        y = y + velocity * np.sin(theta)
-        
-        # node bounces on the margins
-        b = np.where(x<0)[0]
-        x[b] = - x[b]; theta[b] = np.pi-theta[b]; angle_mean[b] = np.pi-angle_mean[b]
-        b = np.where(x>MAX_X)[0]
-        x[b] = 2*MAX_X - x[b]; theta[b] = np.pi-theta[b]; angle_mean[b] = np.pi-angle_mean[b]
-        b = np.where(y<0)[0]
-        y[b] = - y[b]; theta[b] = -theta[b]; angle_mean[b] = -angle_mean[b]
-        b = np.where(y>MAX_Y)[0]
-        y[b] = 2*MAX_Y - y[b]; theta[b] = -theta[b]; angle_mean[b] = -angle_mean[b]
-        
-        # calculate new speed and direction based on the model
-        velocity = (alpha * velocity +
-                    alpha2 * velocity_mean +
-                    alpha3 * np.random.normal(0.0, 1.0, nr_nodes))
-    
-        theta = (alpha * theta +
-                    alpha2 * angle_mean +
-                    alpha3 * np.random.normal(0.0, 1.0, nr_nodes))
+          *nr_nodes*:
+            Integer, the number of nodes.
+          
+          *dimensions*:
+            Tuple of Integers, the x and y dimensions of the simulation area.
+            
+        keyword arguments:
         
-        yield np.dstack((x,y))[0]
+          *velocity_mean*:
+            The mean velocity
+            
+          *alpha*:
+            The tuning parameter used to vary the randomness
+            
+          *variance*:
+            The randomness variance
+
+          *seed*:
+            Integer or SeedSequence, the seed of the model's random Generator.
+            Each iteration over the model restarts from this seed.
+            If None, the seed is drawn from the global numpy random state.
+
+          *dtype*:
+            The floating point type of the model state and of the positions,
+            numpy.float64 (default) or numpy.float32.
+        '''
+        self.nr_nodes = nr_nodes
+        self.dimensions = dimensions
+        self.velocity_mean = velocity_mean
+        self.alpha = alpha
+        self.variance = variance
+        self.seed = seed
+        self.dtype = dtype
+        self.init_stationary = True
+
+    def __iter__(self):
         
-def reference_point_group(nr_nodes, dimensions, velocity=(0.1, 1.), aggregation=0.1):
-    '''
-    Reference Point Group Mobility model, discussed in the following paper:
-    
-        Xiaoyan Hong, Mario Gerla, Guangyu Pei, and Ching-Chuan Chiang. 1999. 
-        A group mobility model for ad hoc wireless networks. In Proceedings of the 
-        2nd ACM international workshop on Modeling, analysis and simulation of 
-        wireless and mobile systems (MSWiM '99). ACM, New York, NY, USA, 53-60.
-    
-    In this implementation, group trajectories follow a random direction model,
-    while nodes follow a random walk around the group center.
-    The parameter 'aggregation' controls how close the nodes are to the group center.
-    
-    Required arguments:
-    
-      *nr_nodes*:
-        list of integers, the number of nodes in each group.
-      
-      *dimensions*:
-        Tuple of Integers, the x and y dimensions of the simulation area.
+        self.init_random()
+        rand = self.rand
+        nr_nodes = self.nr_nodes
+        velocity_mean = self.velocity_mean
+        alpha = self.alpha
         
-    keyword arguments:
-    
-      *velocity*:
-        Tuple of Doubles, the minimum and maximum values for group velocity.
-        
-      *aggregation*:
-        Double, parameter (between 0 and 1) used to aggregate the nodes in the group.
-        Usually between 0 and 1, the more this value approximates to 1,
-        the nodes will be more aggregated and closer to the group center.
-        With a value of 0, the nodes are randomly distributed in the simulation area.
-        With a value of 1, the nodes are close to the group center.
-    '''
-    
-    try:
-        iter(nr_nodes)
-    except TypeError:
-        nr_nodes = [nr_nodes]
-    
-    NODES = np.arange(sum(nr_nodes))
-    
-    groups = []
-    prev = 0
-    for (i,n) in enumerate(nr_nodes):
-        groups.append(np.arange(prev,n+prev))
-        prev += n
-    
-    g_ref = np.empty(sum(nr_nodes), dtype=np.int)
-    for (i,g) in enumerate(groups):
-        for n in g:
-            g_ref[n] = i
-    
-    FL_MAX = max(dimensions)
-    MIN_V,MAX_V = velocity
-    FL_DISTR = lambda SAMPLES: U(0, FL_MAX, SAMPLES)
-    VELOCITY_DISTR = lambda FD: U(MIN_V, MAX_V, FD)
-    
-    MAX_X, MAX_Y = dimensions
-    x = U(0, MAX_X, NODES)
-    y = U(0, MAX_Y, NODES)
-    velocity = 1.
-    theta = U(0, 2*np.pi, NODES)
-    costheta = np.cos(theta)
-    sintheta = np.sin(theta)
+        MAX_X, MAX_Y = self.dimensions
+        NODES = np.arange(nr_nodes)
+        # x and y are views of the position array that is yielded
+        xy = np.empty((nr_nodes, 2), dtype=self.dtype)
+        x, y = xy[:,0], xy[:,1]
+        x[:] = U(0, MAX_X, NODES, rand)
+        y[:] = U(0, MAX_Y, NODES, rand)
+        velocity =  np.zeros(nr_nodes, dtype=self.dtype)+velocity_mean
+        theta = U(0, 2*np.pi, NODES, rand).astype(self.dtype)
+        angle_mean = theta.copy()
+        
+        alpha2 = 1.0 - alpha
+        alpha3 = np.sqrt(1.0 - alpha * alpha) * self.variance
+        
+        # with alpha = 1 the processes keep their initial values, and any state is stationary
+        if self.init_stationary and alpha < 1.:
+            velocity += self.variance * self.rng.standard_normal(nr_nodes, dtype=self.dtype)
+            theta += self.variance * self.rng.standard_normal(nr_nodes, dtype=self.dtype)
+        
+        # scratch buffers, so that the steps are computed in place
+        tmp = np.empty(nr_nodes, dtype=self.dtype)
+        b = np.empty(nr_nodes, dtype=bool)
+        
+        while True:
     
-    GROUPS = np.arange(len(groups))
-    g_x = U(0, MAX_X, GROUPS)
-    g_y = U(0, MAX_X, GROUPS)
-    g_fl = FL_DISTR(GROUPS)
-    g_velocity = VELOCITY_DISTR(g_fl)
-    g_theta = U(0, 2*np.pi, GROUPS)
-    g_costheta = np.cos(g_theta)
-    g_sintheta = np.sin(g_theta)
-        
-    while True:
-
-        x = x + velocity * costheta
-        y = y + velocity * sintheta
-        
-        g_x = g_x + g_velocity * g_costheta
-        g_y = g_y + g_velocity * g_sintheta
-        
-        for (i,g) in enumerate(groups):
-            
-            # step to group direction + step to group center
-            x_g = x[g]
-            y_g = y[g]
-            c_theta = np.arctan2(g_y[i] - y_g, g_x[i] - x_g)
-            
-            x[g] = x_g + g_velocity[i] * g_costheta[i] + aggregation*np.cos(c_theta)
-            y[g] = y_g + g_velocity[i] * g_sintheta[i] + aggregation*np.sin(c_theta)
-            
-        # node and group bounces on the margins
-        b = np.where(x<0)[0]
-        if b.size > 0:
-            x[b] = - x[b]; costheta[b] = -costheta[b]
-            g_idx = np.unique(g_ref[b]); g_costheta[g_idx] = -g_costheta[g_idx]
-        b = np.where(x>MAX_X)[0]
-        if b.size > 0:
-            x[b] = 2*MAX_X - x[b]; costheta[b] = -costheta[b]
-            g_idx = np.unique(g_ref[b]); g_costheta[g_idx] = -g_costheta[g_idx]
-        b = np.where(y<0)[0]
-        if b.size > 0:
-            y[b] = - y[b]; sintheta[b] = -sintheta[b]
-            g_idx = np.unique(g_ref[b]); g_sintheta[g_idx] = -g_sintheta[g_idx]
-        b = np.where(y>MAX_Y)[0]
-        if b.size > 0:
-            y[b] = 2*MAX_Y - y[b]; sintheta[b] = -sintheta[b]
-            g_idx = np.unique(g_ref[b]); g_sintheta[g_idx] = -g_sintheta[g_idx]
-
-        # update info for nodes
-        theta = U(0, 2*np.pi, NODES)
-        costheta = np.cos(theta)
-        sintheta = np.sin(theta)
+            np.cos(theta, out=tmp); tmp *= velocity; x += tmp
+            np.sin(theta, out=tmp); tmp *= velocity; y += tmp
+            
+            # node bounces on the margins
+            np.less(x, 0, out=b)
+            np.negative(x, out=x, where=b)
+            np.subtract(np.pi, theta, out=theta, where=b); np.subtract(np.pi, angle_mean, out=angle_mean, where=b)
+            np.greater(x, MAX_X, out=b)
+            np.subtract(2*MAX_X, x, out=x, where=b)
+            np.subtract(np.pi, theta, out=theta, where=b); np.subtract(np.pi, angle_mean, out=angle_mean, where=b)
+            np.less(y, 0, out=b)
+            np.negative(y, out=y, where=b)
+            np.negative(theta, out=theta, where=b); np.negative(angle_mean, out=angle_mean, where=b)
+            np.greater(y, MAX_Y, out=b)
+            np.subtract(2*MAX_Y, y, out=y, where=b)
+            np.negative(theta, out=theta, where=b); np.negative(angle_mean, out=angle_mean, where=b)
+            
+            # calculate new speed and direction based on the model:
+            # velocity = alpha*velocity + alpha2*velocity_mean + alpha3*N(0,1)
+            velocity *= alpha
+            velocity += alpha2 * velocity_mean
+            self.rng.standard_normal(out=tmp, dtype=tmp.dtype); tmp *= alpha3
+            velocity += tmp
+            
+            # theta = alpha*theta + alpha2*angle_mean + alpha3*N(0,1)
+            theta *= alpha
+            np.multiply(angle_mean, alpha2, out=tmp)
+            theta += tmp
+            self.rng.standard_normal(out=tmp, dtype=tmp.dtype); tmp *= alpha3
+            theta += tmp
+            
+            yield xy
+
+class ReferencePointGroup(MobilityModel):
+
+    def __init__(self, nr_nodes, dimensions, velocity=(0.1, 1.), aggregation=0.1, seed=None, dtype=np.float64):
+        '''
+        Reference Point Group Mobility model, discussed in the following paper:
         
-        # update info for arrived groups
-        g_fl = g_fl - g_velocity
-        g_arrived = np.where(np.logical_and(g_velocity>0., g_fl<=0.))[0]
+            Xiaoyan Hong, Mario Gerla, Guangyu Pei, and Ching-Chuan Chiang. 1999. 
+            A group mobility model for ad hoc wireless networks. In Proceedings of the 
+            2nd ACM international workshop on Modeling, analysis and simulation of 
+            wireless and mobile systems (MSWiM '99). ACM, New York, NY, USA, 53-60.
         
-        if g_arrived.size > 0:
-            g_theta = U(0, 2*np.pi, g_arrived)
-            g_costheta[g_arrived] = np.cos(g_theta)
-            g_sintheta[g_arrived] = np.sin(g_theta)
-            g_fl[g_arrived] = FL_DISTR(g_arrived)
-            g_velocity[g_arrived] = VELOCITY_DISTR(g_fl[g_arrived])
-
-        yield np.dstack((x,y))[0]
+        In this implementation, group trajectories follow a random direction model,
+        while nodes follow a random walk around the group center.
+        The parameter 'aggregation' controls how close the nodes are to the group center.
         
-def tvc(nr_nodes, dimensions, velocity=(0.1, 1.), aggregation=[0.5,0.], epoch=[100,100]):
-    '''
-    Time-variant Community Mobility Model, discussed in the paper
-    
-        Wei-jen Hsu, Thrasyvoulos Spyropoulos, Konstantinos Psounis, and Ahmed Helmy, 
-        "Modeling Time-variant User Mobility in Wireless Mobile Networks," INFOCOM 2007, May 2007.
-    
-    This is a variant of the original definition, in the following way:
-    - Communities don't have a specific area, but a reference point where the 
-       community members aggregate around.
-    - The community reference points are not static, but follow a random direction model.
-    - You can define a list of epoch stages, each value is the duration of the stage.
-       For each stage a different aggregation value is used (from the aggregation parameter).
-    - Aggregation values should be doubles between 0 and 1.
-       For aggregation 0, there's no attraction point and the nodes move in a random walk model.
-       For aggregation near 1, the nodes move closer to the community reference point.
-       
-    Required arguments:
-    
-      *nr_nodes*:
-        list of integers, the number of nodes in each group.
-      
-      *dimensions*:
-        Tuple of Integers, the x and y dimensions of the simulation area.
+        The groups start in the middle of their flights, and the nodes at the stationary distance
+        from their group center (see group_offsets). Set the init_stationary attribute to False
+        to start with uniform node positions and fresh group flights.
         
-    keyword arguments:
-    
-      *velocity*:
-        Tuple of Doubles, the minimum and maximum values for community velocities.
-        
-      *aggregation*:
-        List of Doubles, parameters (between 0 and 1) used to aggregate the nodes around the community center.
-        Usually between 0 and 1, the more this value approximates to 1,
-        the nodes will be more aggregated and closer to the group center.
-        With aggregation 0, the nodes are randomly distributed in the simulation area.
-        With aggregation near 1, the nodes are closer to the group center.
-        
-      *epoch*:
-        List of Integers, the number of steps each epoch stage lasts.
-    '''
-    if len(aggregation) != len(epoch):
-        raise Exception("The parameters 'aggregation' and 'epoch' should be of same size")
-    
-    try:
-        iter(nr_nodes)
-    except TypeError:
-        nr_nodes = [nr_nodes]
-    
-    NODES = np.arange(sum(nr_nodes))
-    
-    epoch_total = sum(epoch)
-    
-    def AGGREGATION(t):
-        acc = 0
-        for i in range(len(epoch)):
-            acc+=epoch[i]
-            if t%epoch_total <= acc: return aggregation[i]
-        raise Exception("Something wrong here")
-    
-    groups = []
-    prev = 0
-    for (i,n) in enumerate(nr_nodes):
-        groups.append(np.arange(prev,n+prev))
-        prev += n
-    
-    g_ref = np.empty(sum(nr_nodes), dtype=np.int)
-    for (i,g) in enumerate(groups):
-        for n in g:
-            g_ref[n] = i
-    
-    FL_MAX = max(dimensions)
-    MIN_V,MAX_V = velocity
-    FL_DISTR = lambda SAMPLES: U(0, FL_MAX, SAMPLES)
-    VELOCITY_DISTR = lambda FD: U(MIN_V, MAX_V, FD)
-    
-    def wrap(x,y):
-        b = np.where(x<0)[0]
-        if b.size > 0:
-            x[b] += MAX_X
-        b = np.where(x>MAX_X)[0]
-        if b.size > 0:
-            x[b] -= MAX_X
-        b = np.where(y<0)[0]
-        if b.size > 0:
-            y[b] += MAX_Y
-        b = np.where(y>MAX_Y)[0]
-        if b.size > 0:
-            y[b] -= MAX_Y
-    
-    MAX_X, MAX_Y = dimensions
-    x = U(0, MAX_X, NODES)
-    y = U(0, MAX_Y, NODES)
-    velocity = 1.
-    theta = U(0, 2*np.pi, NODES)
-    costheta = np.cos(theta)
-    sintheta = np.sin(theta)
-    
-    GROUPS = np.arange(len(groups))
-    g_x = U(0, MAX_X, GROUPS)
-    g_y = U(0, MAX_X, GROUPS)
-    g_fl = FL_DISTR(GROUPS)
-    g_velocity = VELOCITY_DISTR(g_fl)
-    g_theta = U(0, 2*np.pi, GROUPS)
-    g_costheta = np.cos(g_theta)
-    g_sintheta = np.sin(g_theta)
-    
-    t = 0
+        Required arguments:
+        
+          *nr_nodes*:
+            list of integers, the number of nodes in each group.
+          
+          *dimensions*:
+            Tuple of Integers, the x and y dimensions of the simulation area.
+            
+        keyword arguments:
         
-    while True:
+          *velocity*:
+            Tuple of Doubles, the minimum and maximum values for group velocity.
+            
+          *aggregation*:
+            Double, parameter (between 0 and 1) used to aggregate the nodes in the group.
+            Usually between 0 and 1, the more this value approximates to 1,
+            the nodes will be more aggregated and closer to the group center.
+            With a value of 0, the nodes are randomly distributed in the simulation area.
+            With a value of 1, the nodes are close to the group center.
+
+          *seed*:
+            Integer or SeedSequence, the seed of the model's random Generator.
+            Each iteration over the model restarts from this seed.
+            If None, the seed is drawn from the global numpy random state.
+
+          *dtype*:
+            The floating point type of the model state and of the positions,
+            numpy.float64 (default) or numpy.float32.
+        '''
+        try:
+            iter(nr_nodes)
+        except TypeError:
+            nr_nodes = [nr_nodes]
         
-        t += 1
-        # get aggregation value for this step
-        aggr = AGGREGATION(t)
+        self.group_sizes = list(nr_nodes)
+        self.nr_nodes = sum(nr_nodes)
+        self.dimensions = dimensions
+        self.velocity = velocity
+        self.aggregation = aggregation
+        self.seed = seed
+        self.dtype = dtype
+        self.init_stationary = True
 
-        x = x + velocity * costheta
-        y = y + velocity * sintheta
+    def __iter__(self):
+        
+        self.init_random()
+        rand = self.rand
+        dtype = self.dtype
+        aggregation = self.aggregation
+        NODES = np.arange(self.nr_nodes)
+        
+        # group index of each node
+        GROUPS = np.arange(len(self.group_sizes))
+        g_ref = np.repeat(GROUPS, self.group_sizes)
+        
+        FL_MAX = max(self.dimensions)
+        MIN_V,MAX_V = self.velocity
+        FL_DISTR = lambda SAMPLES: U(0, FL_MAX, SAMPLES, rand)
+        VELOCITY_DISTR = lambda FD: U(MIN_V, MAX_V, FD, rand)
+        
+        MAX_X, MAX_Y = self.dimensions
+        # x and y are views of the position array that is yielded
+        xy = np.empty((self.nr_nodes, 2), dtype=dtype)
+        x, y = xy[:,0], xy[:,1]
+        x[:] = U(0, MAX_X, NODES, rand)
+        y[:] = U(0, MAX_Y, NODES, rand)
+        velocity = 1.
+        theta = U(0, 2*np.pi, NODES, rand).astype(dtype)
+        costheta = np.cos(theta)
+        sintheta = np.sin(theta)
         
-        # move reference point only if nodes have to go there
-        if aggr > 0:
+        g_x = U(0, MAX_X, GROUPS, rand).astype(dtype)
+        g_y = U(0, MAX_X, GROUPS, rand).astype(dtype)
+        g_fl = FL_DISTR(GROUPS).astype(dtype)
+        g_velocity = VELOCITY_DISTR(g_fl).astype(dtype)
+        g_theta = U(0, 2*np.pi, GROUPS, rand)
+        g_costheta = np.cos(g_theta).astype(dtype)
+        g_sintheta = np.sin(g_theta).astype(dtype)
         
-            g_x = g_x + g_velocity * g_costheta
-            g_y = g_y + g_velocity * g_sintheta
+        if self.init_stationary:
+            # groups in the middle of their flights, nodes around their group center
+            g_fl, g_velocity = [a.astype(dtype) for a in stationary_flights(FL_DISTR, VELOCITY_DISTR, GROUPS, rand)]
+            if aggregation > 0:
+                offset_x, offset_y = group_offsets(velocity, aggregation, NODES, rand)
+                x[:] = reflect_into(g_x[g_ref] + offset_x, MAX_X)
+                y[:] = reflect_into(g_y[g_ref] + offset_y, MAX_Y)
+        
+        # scratch buffers, so that the steps are computed in place
+        tmp = np.empty(self.nr_nodes, dtype=dtype)
+        dx = np.empty(self.nr_nodes, dtype=dtype)
+        dy = np.empty(self.nr_nodes, dtype=dtype)
+        b = np.empty(self.nr_nodes, dtype=bool)
+        g_dx = np.empty(len(GROUPS), dtype=dtype)
+        g_dy = np.empty(len(GROUPS), dtype=dtype)
+        g_b = np.empty(len(GROUPS), dtype=bool)
+        g_b2 = np.empty(len(GROUPS), dtype=bool)
             
-            # group wrap around when outside the margins (torus shaped area)
-            wrap(g_x, g_y)
+        while True:
+    
+            np.multiply(costheta, velocity, out=tmp); x += tmp
+            np.multiply(sintheta, velocity, out=tmp); y += tmp
+            
+            np.multiply(g_velocity, g_costheta, out=g_dx); g_x += g_dx
+            np.multiply(g_velocity, g_sintheta, out=g_dy); g_y += g_dy
+            
+            # step to group direction + step to group center, for all groups at once
+            # (take writes directly into out only when the indices are not checked, as with mode='clip')
+            np.take(g_y, g_ref, out=dy, mode='clip'); dy -= y
+            np.take(g_x, g_ref, out=dx, mode='clip'); dx -= x
+            c_theta = np.arctan2(dy, dx, out=dx)
+            
+            np.take(g_dx, g_ref, out=tmp, mode='clip'); x += tmp
+            np.cos(c_theta, out=tmp); tmp *= aggregation; x += tmp
+            np.take(g_dy, g_ref, out=tmp, mode='clip'); y += tmp
+            np.sin(c_theta, out=tmp); tmp *= aggregation; y += tmp
+                
+            # node and group bounces on the margins
+            if np.less(x, 0, out=b).any():
+                np.negative(x, out=x, where=b); np.negative(costheta, out=costheta, where=b)
+                g_idx = np.unique(g_ref[b]); g_costheta[g_idx] = -g_costheta[g_idx]
+            if np.greater(x, MAX_X, out=b).any():
+                np.subtract(2*MAX_X, x, out=x, where=b); np.negative(costheta, out=costheta, where=b)
+                g_idx = np.unique(g_ref[b]); g_costheta[g_idx] = -g_costheta[g_idx]
+            if np.less(y, 0, out=b).any():
+                np.negative(y, out=y, where=b); np.negative(sintheta, out=sintheta, where=b)
+                g_idx = np.unique(g_ref[b]); g_sintheta[g_idx] = -g_sintheta[g_idx]
+            if np.greater(y, MAX_Y, out=b).any():
+                np.subtract(2*MAX_Y, y, out=y, where=b); np.negative(sintheta, out=sintheta, where=b)
+                g_idx = np.unique(g_ref[b]); g_sintheta[g_idx] = -g_sintheta[g_idx]
+    
+            # update info for nodes
+            self.rng.random(out=theta, dtype=dtype); theta *= 2*np.pi
+            np.cos(theta, out=costheta)
+            np.sin(theta, out=sintheta)
             
             # update info for arrived groups
-            g_arrived = np.where(np.logical_and(g_velocity>0., g_fl<=0.))[0]
-            g_fl = g_fl - g_velocity
+            g_fl -= g_velocity
+            np.greater(g_velocity, 0., out=g_b)
+            np.less_equal(g_fl, 0., out=g_b2)
+            g_b &= g_b2
+            g_arrived = np.flatnonzero(g_b)
             
             if g_arrived.size > 0:
-                g_theta = U(0, 2*np.pi, g_arrived)
+                g_theta = U(0, 2*np.pi, g_arrived, rand)
                 g_costheta[g_arrived] = np.cos(g_theta)
                 g_sintheta[g_arrived] = np.sin(g_theta)
                 g_fl[g_arrived] = FL_DISTR(g_arrived)
                 g_velocity[g_arrived] = VELOCITY_DISTR(g_fl[g_arrived])
+    
+            yield xy
+
+class TimeVariantCommunity(MobilityModel):
+
+    def __init__(self, nr_nodes, dimensions, velocity=(0.1, 1.), aggregation=[0.5,0.], epoch=[100,100], seed=None, dtype=np.float64):
+        '''
+        Time-variant Community Mobility Model, discussed in the paper
+        
+            Wei-jen Hsu, Thrasyvoulos Spyropoulos, Konstantinos Psounis, and Ahmed Helmy, 
+            "Modeling Time-variant User Mobility in Wireless Mobile Networks," INFOCOM 2007, May 2007.
+        
+        This is a variant of the original definition, in the following way:
+        - Communities don't have a specific area, but a reference point where the 
+           community members aggregate around.
+        - The community reference points are not static, but follow a random direction model.
+        - You can define a list of epoch stages, each value is the duration of the stage.
+           For each stage a different aggregation value is used (from the aggregation parameter).
+        - Aggregation values should be doubles between 0 and 1.
+           For aggregation 0, there's no attraction point and the nodes move in a random walk model.
+           For aggregation near 1, the nodes move closer to the community reference point.
+        - The communities start in the middle of their flights, and the nodes at the stationary
+           distance from their community center for the aggregation of the first stage
+           (see group_offsets). Set the init_stationary attribute to False to start with
+           uniform node positions and fresh community flights.
+           
+        Required arguments:
+        
+          *nr_nodes*:
+            list of integers, the number of nodes in each group.
+          
+          *dimensions*:
+            Tuple of Integers, the x and y dimensions of the simulation area.
+            
+        keyword arguments:
+        
+          *velocity*:
+            Tuple of Doubles, the minimum and maximum values for community velocities.
+            
+          *aggregation*:
+            List of Doubles, parameters (between 0 and 1) used to aggregate the nodes around the community center.
+            Usually between 0 and 1, the more this value approximates to 1,
+            the nodes will be more aggregated and closer to the group center.
+            With aggregation 0, the nodes are randomly distributed in the simulation area.
+            With aggregation near 1, the nodes are closer to the group center.
             
-            # update node position according to group center
-            for (i,g) in enumerate(groups):
+          *epoch*:
+            List of Integers, the number of steps each epoch stage lasts.
+
+          *seed*:
+            Integer or SeedSequence, the seed of the model's random Generator.
+            Each iteration over the model restarts from this seed.
+            If None, the seed is drawn from the global numpy random state.
+
+          *dtype*:
+            The floating point type of the model state and of the positions,
+            numpy.float64 (default) or numpy.float32.
+        '''
+        if len(aggregation) != len(epoch):
+            raise Exception("The parameters 'aggregation' and 'epoch' should be of same size")
+        
+        try:
+            iter(nr_nodes)
+        except TypeError:
+            nr_nodes = [nr_nodes]
+        
+        self.group_sizes = list(nr_nodes)
+        self.nr_nodes = sum(nr_nodes)
+        self.dimensions = dimensions
+        self.velocity = velocity
+        self.aggregation = aggregation
+        self.epoch = epoch
+        self.seed = seed
+        self.dtype = dtype
+        self.init_stationary = True
+
+    def __iter__(self):
+        
+        self.init_random()
+        rand = self.rand
+        dtype = self.dtype
+        aggregation = self.aggregation
+        epoch = self.epoch
+        NODES = np.arange(self.nr_nodes)
+        
+        epoch_total = sum(epoch)
+        
+        # aggregation value for each step of the epoch cycle
+        # (a stage lasts until the step at which its cumulated duration is reached)
+        AGGREGATION = np.asarray(aggregation, dtype=float)[
+            np.searchsorted(np.cumsum(epoch), np.arange(epoch_total))]
+        
+        # group index of each node
+        GROUPS = np.arange(len(self.group_sizes))
+        g_ref = np.repeat(GROUPS, self.group_sizes)
+        
+        FL_MAX = max(self.dimensions)
+        MIN_V,MAX_V = self.velocity
+        FL_DISTR = lambda SAMPLES: U(0, FL_MAX, SAMPLES, rand)
+        VELOCITY_DISTR = lambda FD: U(MIN_V, MAX_V, FD, rand)
+        
+        def wrap(x, y, b):
+            np.less(x, 0, out=b); np.add(x, MAX_X, out=x, where=b)
+            np.greater(x, MAX_X, out=b); np.subtract(x, MAX_X, out=x, where=b)
+            np.less(y, 0, out=b); np.add(y, MAX_Y, out=y, where=b)
+            np.greater(y, MAX_Y, out=b); np.subtract(y, MAX_Y, out=y, where=b)
+        
+        MAX_X, MAX_Y = self.dimensions
+        # x and y are views of the position array that is yielded
+        xy = np.empty((self.nr_nodes, 2), dtype=dtype)
+        x, y = xy[:,0], xy[:,1]
+        x[:] = U(0, MAX_X, NODES, rand)
+        y[:] = U(0, MAX_Y, NODES, rand)
+        velocity = 1.
+        theta = U(0, 2*np.pi, NODES, rand).astype(dtype)
+        costheta = np.cos(theta)
+        sintheta = np.sin(theta)
+        
+        g_x = U(0, MAX_X, GROUPS, rand).astype(dtype)
+        g_y = U(0, MAX_X, GROUPS, rand).astype(dtype)
+        g_fl = FL_DISTR(GROUPS).astype(dtype)
+        g_velocity = VELOCITY_DISTR(g_fl).astype(dtype)
+        g_theta = U(0, 2*np.pi, GROUPS, rand)
+        g_costheta = np.cos(g_theta).astype(dtype)
+        g_sintheta = np.sin(g_theta).astype(dtype)
+        
+        if self.init_stationary:
+            # groups in the middle of their flights, nodes around their group center
+            # as in the stage of the first step
+            g_fl, g_velocity = [a.astype(dtype) for a in stationary_flights(FL_DISTR, VELOCITY_DISTR, GROUPS, rand)]
+            aggr = AGGREGATION[1 % epoch_total]
+            if aggr > 0:
+                offset_x, offset_y = group_offsets(velocity, aggr, NODES, rand)
+                x[:] = np.mod(g_x[g_ref] + offset_x, MAX_X)
+                y[:] = np.mod(g_y[g_ref] + offset_y, MAX_Y)
+        
+        # scratch buffers, so that the steps are computed in place
+        tmp = np.empty(self.nr_nodes, dtype=dtype)
+        dx = np.empty(self.nr_nodes, dtype=dtype)
+        dy = np.empty(self.nr_nodes, dtype=dtype)
+        b = np.empty(self.nr_nodes, dtype=bool)
+        b2 = np.empty(self.nr_nodes, dtype=bool)
+        g_dx = np.empty(len(GROUPS), dtype=dtype)
+        g_dy = np.empty(len(GROUPS), dtype=dtype)
+        g_b = np.empty(len(GROUPS), dtype=bool)
+        g_b2 = np.empty(len(GROUPS), dtype=bool)
+        
+        t = 0
+            
+        while True:
+            
+            t += 1
+            # get aggregation value for this step
+            aggr = AGGREGATION[t % epoch_total]
+    
+            np.multiply(costheta, velocity, out=tmp); x += tmp
+            np.multiply(sintheta, velocity, out=tmp); y += tmp
+            
+            # move reference point only if nodes have to go there
+            if aggr > 0:
+            
+                np.multiply(g_velocity, g_costheta, out=g_dx); g_x += g_dx
+                np.multiply(g_velocity, g_sintheta, out=g_dy); g_y += g_dy
                 
-                # step to group direction + step to reference point
-                x_g = x[g]
-                y_g = y[g]
+                # group wrap around when outside the margins (torus shaped area)
+                wrap(g_x, g_y, g_b)
+                
+                # update info for arrived groups
+                np.greater(g_velocity, 0., out=g_b)
+                np.less_equal(g_fl, 0., out=g_b2)
+                g_b &= g_b2
+                g_arrived = np.flatnonzero(g_b)
+                g_fl -= g_velocity
                 
-                dy = g_y[i] - y_g
-                dx = g_x[i] - x_g
-                c_theta = np.arctan2(dy, dx)
+                if g_arrived.size > 0:
+                    g_theta = U(0, 2*np.pi, g_arrived, rand)
+                    g_costheta[g_arrived] = np.cos(g_theta)
+                    g_sintheta[g_arrived] = np.sin(g_theta)
+                    g_fl[g_arrived] = FL_DISTR(g_arrived)
+                    g_velocity[g_arrived] = VELOCITY_DISTR(g_fl[g_arrived])
+                
+                # update node position according to group center, for all groups at once:
+                # step to group direction + step to reference point
+                # (take writes directly into out only when the indices are not checked, as with mode='clip')
+                np.take(g_y, g_ref, out=dy, mode='clip'); dy -= y
+                np.take(g_x, g_ref, out=dx, mode='clip'); dx -= x
                 
                 # invert angle if wrapping around
-                invert = np.where((np.abs(dy)>MAX_Y/2)!=(np.abs(dx)>MAX_X/2))[0]
-                c_theta[invert] = c_theta[invert] + np.pi
+                np.abs(dy, out=tmp); np.greater(tmp, MAX_Y/2, out=b)
+                np.abs(dx, out=tmp); np.greater(tmp, MAX_X/2, out=b2)
+                np.not_equal(b, b2, out=b)
+                c_theta = np.arctan2(dy, dx, out=dx)
+                np.add(c_theta, np.pi, out=c_theta, where=b)
                 
-                x[g] = x_g + g_velocity[i] * g_costheta[i] + aggr*np.cos(c_theta)
-                y[g] = y_g + g_velocity[i] * g_sintheta[i] + aggr*np.sin(c_theta)
+                np.multiply(g_velocity, g_costheta, out=g_dx)
+                np.multiply(g_velocity, g_sintheta, out=g_dy)
+                np.take(g_dx, g_ref, out=tmp, mode='clip'); x += tmp
+                np.cos(c_theta, out=tmp); tmp *= aggr; x += tmp
+                np.take(g_dy, g_ref, out=tmp, mode='clip'); y += tmp
+                np.sin(c_theta, out=tmp); tmp *= aggr; y += tmp
+                
+            # node wrap around when outside the margins (torus shaped area)
+            wrap(x, y, b)
+            
+            # update info for nodes
+            self.rng.random(out=theta, dtype=dtype); theta *= 2*np.pi
+            np.cos(theta, out=costheta)
+            np.sin(theta, out=sintheta)
             
-        # node wrap around when outside the margins (torus shaped area)
-        wrap(x,y)
+            yield xy
+
+class TraceReplay(MobilityModel):
+
+    def __init__(self, trace, start=0, stop=None, step=1, prefetch=64, dimensions=None):
+        '''
+        Replays a trajectory recorded in a trace file (see pymobility.trace), as a mobility model:
+        iterating over the model yields the node positions at the recorded steps, so that the
+        same movement can be given to mobility_contact or other consumers many times without
+        simulating it again.
+        The positions are read-only views of the memory-mapped file, valid as long as the model.
+        For quantized traces, they are converted into an array that is overwritten at each step.
         
-        # update info for nodes
-        theta = U(0, 2*np.pi, NODES)
-        costheta = np.cos(theta)
-        sintheta = np.sin(theta)
+        Required arguments:
+        
+          *trace*:
+            String, the path of the trace file, or a pymobility.trace.TraceReader.
+          
+        keyword arguments:
         
-        yield np.dstack((x,y))[0]
+          *start*, *stop*, *step*:
+            Integers, the recorded steps that are replayed, as in range(start, stop, step).
+            If stop is None, the replay goes up to the end of the trace.
+          
+          *prefetch*:
+            Integer, the number of replayed frames that are requested from the disk ahead
+            of the current one (see TraceReader.prefetch). If 0, there is no prefetching.
+          
+          *dimensions*:
+            Tuple of Doubles, the dimensions of the simulation area.
+            Default is the dimensions stored in the trace.
+        '''
+        from pymobility.trace import TraceReader
+        # a trace opened from a path is closed with the model (see close)
+        self.owner = not isinstance(trace, TraceReader)
+        if self.owner:
+            trace = TraceReader(trace)
+        self.trace = trace
+        self.nr_nodes = trace.nr_nodes
+        self.replicas = trace.shape[0] if len(trace.shape) == 3 else None
+        self.dimensions = dimensions or trace.dimensions or (None,) * trace.ndim
+        self.dtype = trace.dtype
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.prefetch = prefetch
+    
+    def __iter__(self):
+        trace = self.trace
+        stop = trace.steps if self.stop is None else min(self.stop, trace.steps)
+        step = self.step
+        out = None if trace.quantize is None else np.empty(trace.shape, dtype=trace.dtype)
+        
+        # the frames up to advised were requested from the disk,
+        # the next request is made when the replay reaches next_advice
+        advised = next_advice = self.start
+        for t in range(self.start, stop, step):
+            if self.prefetch and t >= next_advice:
+                end = min(t + self.prefetch * step, stop)
+                if step == 1:
+                    trace.prefetch(advised, end)
+                else:
+                    for k in range(max(advised, t), end, step):
+                        trace.prefetch(k, k + 1)
+                advised = end
+                next_advice = t + max(self.prefetch // 2, 1) * step
+            yield trace.frame(t, out)
+
+    def close(self):
+        '''
+        Closes the trace file, if it was opened by the model from a path.
+        '''
+        if self.owner:
+            self.trace.close()
+
+def gauss_markov(*args, **kwargs):
+    return iter(GaussMarkov(*args, **kwargs))
+
+def reference_point_group(*args, **kwargs):
+    return iter(ReferencePointGroup(*args, **kwargs))
+
+def tvc(*args, **kwargs):
+    return iter(TimeVariantCommunity(*args, **kwargs))
+
+def trace_replay(*args, **kwargs):
+    return iter(TraceReplay(*args, **kwargs))
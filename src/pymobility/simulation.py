@@ -39,7 +39,8 @@ MIN_V, MAX_V = 0.1, 1.
 MAX_WT = 100.
 
 # number of steps to ignore before start plotting
-STEPS_TO_IGNORE = 10000
+# (the models start from their stationary state, so no warm-up steps are needed)
+STEPS_TO_IGNORE = 0
 
 # set this to true if you want to calculate node contacts
 CALCULATE_CONTACTS = False
@@ -7,12 +7,15 @@
 #  This program was written by André Panisson <panisson@gmail.com>
 #
 import unittest
+from pymobility import analysis
 from pymobility.models import contact
 from pymobility.models.contact import modelB, model_het
 import numpy as np
 from pymobility.models.mobility import random_waypoint, random_walk,\
     truncated_levy_walk, random_direction, gauss_markov, reference_point_group,\
-    tvc
+    tvc, RandomWaypoint, TruncatedLevyWalk, GaussMarkov, ReferencePointGroup,\
+    TimeVariantCommunity, EventDrivenRandomWaypoint, init_random_waypoint,\
+    pause_probability_init, TraceReplay, trace_replay, group_offsets
 
 class MobilityModelTestCase(unittest.TestCase):
     
@@ -45,6 +48,38 @@ class RandomWaypointTestCase(MobilityModelTestCase):
             xy = next(model_instance)
             self.check_margins(xy, self.MAX_X, self.MAX_Y)
     
+    def test_init_stationary(self):
+        positions, waypoints, speed, pause_time = init_random_waypoint(
+            100000, (self.MAX_X, self.MAX_Y), 0.1, 1., 0., 10.)
+        self.check_margins(positions, self.MAX_X, self.MAX_Y)
+        self.check_margins(waypoints, self.MAX_X, self.MAX_Y)
+        # moving nodes accept paths with probability proportional to their length, and the
+        # mean distance between two points in a square is 0.5214 times its side
+        q0 = pause_probability_init(0., 10., 0.1, 1., (self.MAX_X, self.MAX_Y))
+        r = 0.5214 / np.sqrt(2)
+        self.assertAlmostEqual(np.mean(speed > 0), (1-q0)*r / (q0 + (1-q0)*r), places=2)
+        self.assertTrue(np.all(pause_time[speed == 0] >= 0.))
+
+class EventDrivenRandomWaypointTestCase(MobilityModelTestCase):
+    
+    def create_model_instance(self):
+        return EventDrivenRandomWaypoint(self.nr_nodes, (self.MAX_X, self.MAX_Y), velocity=(15, 20), wt_max=10., step=3.)
+    
+    def test_margins(self):
+        for xy in self.create_model_instance().run(1000):
+            self.check_margins(xy, self.MAX_X, self.MAX_Y)
+    
+    def test_sample(self):
+        model = self.create_model_instance()
+        model.seed = 42
+        trajectory = model.run(100)
+        model.reset()
+        self.assertTrue(np.allclose(model.sample(np.arange(1, 101) * 3.), trajectory))
+        # speed along a leg never exceeds the maximum velocity
+        step = np.sqrt(np.sum(np.square(np.diff(trajectory, axis=0)), axis=2))
+        self.assertTrue(np.all(step <= 3. * 20 + 1e-9))
+        self.assertRaises(Exception, model.positions, 1.)
+
 class RandomWalkTestCase(MobilityModelTestCase):
     
     def create_model_instance(self):
@@ -111,6 +146,224 @@ class TimevariantCommunityTestCase(MobilityModelTestCase):
             xy = next(model_instance)
             self.check_margins(xy, self.MAX_X, self.MAX_Y)
 
+class RunTestCase(MobilityModelTestCase):
+    
+    def check_run(self, model):
+        steps = 100
+        np.random.seed(0xffffff)
+        frames = [xy.copy() for _, xy in zip(range(steps), model)]
+        np.random.seed(0xffffff)
+        out = np.empty((steps, self.nr_nodes, 2))
+        trajectory = model.run(steps, out=out)
+        self.assertIs(trajectory, out)
+        self.assertTrue(np.array_equal(trajectory, np.array(frames)))
+        # the shape of the output array is checked before running
+        self.assertRaises(Exception, model.run, steps, np.empty((steps - 1, self.nr_nodes, 2)))
+    
+    def test_run(self):
+        self.check_run(RandomWaypoint(self.nr_nodes, (self.MAX_X, self.MAX_Y), velocity=(15, 20), wt_max=10.))
+        self.check_run(TruncatedLevyWalk(self.nr_nodes, (self.MAX_X, self.MAX_Y)))
+        self.check_run(GaussMarkov(self.nr_nodes, (self.MAX_X, self.MAX_Y)))
+        self.check_run(ReferencePointGroup([10]*10, (self.MAX_X, self.MAX_Y)))
+        self.check_run(TimeVariantCommunity([10]*10, (self.MAX_X, self.MAX_Y)))
+
+    def check_frames(self, model):
+        trajectory = model.run(10)
+        out = np.empty((self.nr_nodes, 2))
+        for t, xy in zip(range(10), model.frames(out=out)):
+            self.assertIs(xy, out)
+            self.assertTrue(np.array_equal(xy, trajectory[t]))
+        # with a ring of 3 buffers, the last 3 frames are all valid
+        frames = [xy for _, xy in zip(range(10), model.frames(ring=3))]
+        self.assertIs(frames[0], frames[3])
+        for t in range(7, 10):
+            self.assertTrue(np.array_equal(frames[t], trajectory[t]))
+
+    def test_frames(self):
+        self.check_frames(RandomWaypoint(self.nr_nodes, (self.MAX_X, self.MAX_Y), velocity=(15, 20), wt_max=10., seed=1))
+        self.check_frames(TruncatedLevyWalk(self.nr_nodes, (self.MAX_X, self.MAX_Y), seed=1))
+        self.check_frames(GaussMarkov(self.nr_nodes, (self.MAX_X, self.MAX_Y), seed=1))
+        self.check_frames(ReferencePointGroup([10]*10, (self.MAX_X, self.MAX_Y), seed=1))
+        self.check_frames(TimeVariantCommunity([10]*10, (self.MAX_X, self.MAX_Y), seed=1))
+
+    def test_dtype(self):
+        dimensions = (self.MAX_X, self.MAX_Y)
+        for model in (RandomWaypoint(self.nr_nodes, dimensions, wt_max=10., dtype=np.float32),
+                      TruncatedLevyWalk(self.nr_nodes, dimensions, dtype=np.float32),
+                      GaussMarkov(self.nr_nodes, dimensions, dtype=np.float32),
+                      ReferencePointGroup([10]*10, dimensions, dtype=np.float32),
+                      TimeVariantCommunity([10]*10, dimensions, dtype=np.float32)):
+            trajectory = model.run(200)
+            self.assertEqual(trajectory.dtype, np.float32)
+            self.assertTrue(np.all(trajectory >= 0.))
+            self.assertTrue(np.all(trajectory[:,:,0] <= self.MAX_X))
+            self.assertTrue(np.all(trajectory[:,:,1] <= self.MAX_Y))
+
+class SeedTestCase(MobilityModelTestCase):
+    
+    def test_seed(self):
+        dimensions = (self.MAX_X, self.MAX_Y)
+        for model_class in (RandomWaypoint, TruncatedLevyWalk, GaussMarkov):
+            model = model_class(self.nr_nodes, dimensions, seed=42)
+            first = model.run(100)
+            # the global random state is not used when the seed is set
+            np.random.seed(0)
+            self.assertTrue(np.array_equal(first, model.run(100)))
+            self.assertTrue(np.array_equal(first, model_class(self.nr_nodes, dimensions, seed=42).run(100)))
+            self.assertFalse(np.array_equal(first, model_class(self.nr_nodes, dimensions, seed=43).run(100)))
+
+class StationaryTestCase(MobilityModelTestCase):
+
+    def test_stochastic_walk(self):
+        model = TruncatedLevyWalk(10000, (self.MAX_X, self.MAX_Y), seed=1)
+        model.init_random()
+        fl, velocity, wt, last_velocity = model.stationary_state(np.arange(10000))
+        paused = velocity == 0.
+        # about a quarter of the nodes are paused in the stationary state of the default walk
+        self.assertTrue(0.15 < paused.mean() < 0.4)
+        self.assertTrue(np.all(wt[paused] >= 0.))
+        self.assertTrue(np.all(fl[~paused] > 0.))
+        self.assertTrue(np.all(last_velocity > 0.))
+
+    def test_group_offsets(self):
+        model = ReferencePointGroup([50]*2, (self.MAX_X, self.MAX_Y), aggregation=0.5, seed=1)
+        xy = next(iter(model))
+        self.check_margins(xy, self.MAX_X, self.MAX_Y)
+        # the nodes start around their group center (the mean offset is 1/(2*aggregation))
+        for group in (xy[:50], xy[50:]):
+            self.assertLess(np.mean(np.hypot(*(group - np.median(group, axis=0)).T)), 5.)
+        # a float32 variate that is exactly 0 gives a finite offset
+        zeros = lambda *shape: np.zeros(shape, dtype=np.float32)
+        self.assertTrue(np.all(np.isfinite(group_offsets(1., 0.5, np.arange(10), zeros))))
+
+class ReplicasTestCase(MobilityModelTestCase):
+    
+    replicas = 5
+    
+    def check_replicas(self, model, flat_model):
+        np.random.seed(0xffffff)
+        trajectory = model.run(50)
+        np.random.seed(0xffffff)
+        flat_trajectory = flat_model.run(50)
+        self.assertEqual(trajectory.shape, (50, self.replicas, self.nr_nodes, 2))
+        self.assertTrue(np.array_equal(trajectory.reshape(flat_trajectory.shape), flat_trajectory))
+        self.check_margins(trajectory.reshape(-1, 2), self.MAX_X, self.MAX_Y)
+    
+    def test_replicas(self):
+        dimensions = (self.MAX_X, self.MAX_Y)
+        self.check_replicas(RandomWaypoint(self.nr_nodes, dimensions, velocity=(15, 20), replicas=self.replicas),
+                            RandomWaypoint(self.nr_nodes*self.replicas, dimensions, velocity=(15, 20)))
+        self.check_replicas(TruncatedLevyWalk(self.nr_nodes, dimensions, replicas=self.replicas),
+                            TruncatedLevyWalk(self.nr_nodes*self.replicas, dimensions))
+
+class EnsembleTestCase(unittest.TestCase):
+    
+    def test_worker_count(self):
+        from pymobility.ensemble import run_ensemble
+        kwargs = dict(args=(20, (100, 100)), seed=0xffffff)
+        sequential = list(run_ensemble(random_waypoint, 4, 50, max_workers=0, **kwargs))
+        parallel = list(run_ensemble(random_waypoint, 4, 50, max_workers=2, **kwargs))
+        self.assertEqual(len(parallel), 4)
+        for a, b in zip(sequential, parallel):
+            self.assertTrue(np.array_equal(a, b))
+        self.assertFalse(np.array_equal(sequential[0], sequential[1]))
+
+class FileTestCase(MobilityModelTestCase):
+
+    def setUp(self):
+        import tempfile
+        MobilityModelTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+class TraceTestCase(FileTestCase):
+
+    def test_write_read(self):
+        from pymobility.trace import TraceReader, write_trace
+        import os
+        path = os.path.join(self.directory, 'trace.bin')
+        model = RandomWaypoint(self.nr_nodes, (self.MAX_X, self.MAX_Y), seed=1)
+        trajectory = model.run(150)
+        write_trace(path, model, 150, chunk=64)
+        with TraceReader(path) as reader:
+            self.assertEqual(len(reader), 150)
+            self.assertEqual((reader.nr_nodes, reader.ndim), (self.nr_nodes, 2))
+            self.assertTrue(np.array_equal(reader.frame(100), trajectory[100]))
+            self.assertTrue(np.array_equal(reader.window(10, 100, 3), trajectory[10:100:3]))
+            self.assertTrue(np.array_equal(np.array(list(reader)), trajectory))
+        self.assertTrue(reader.mmap is None)
+
+    def test_quantize(self):
+        from pymobility.trace import TraceReader, write_trace
+        import os
+        path = os.path.join(self.directory, 'trace.bin')
+        model = TruncatedLevyWalk(self.nr_nodes, (self.MAX_X, self.MAX_Y), seed=1)
+        trajectory = model.run(100)
+        write_trace(path, model, 100, dimensions=(self.MAX_X, self.MAX_Y), quantize=np.uint16)
+        with TraceReader(path) as reader:
+            self.assertEqual(reader.frames.dtype, np.uint16)
+            self.assertTrue(np.all(np.abs(reader.window(0, 100) - trajectory) <= self.MAX_X / 131070. + 1e-9))
+
+    def test_replay(self):
+        from pymobility.trace import write_trace
+        import os
+        path = os.path.join(self.directory, 'trace.bin')
+        model = RandomWaypoint(self.nr_nodes, (self.MAX_X, self.MAX_Y), velocity=(15, 20), seed=1)
+        trajectory = model.run(200)
+        write_trace(path, model, 200, dimensions=(self.MAX_X, self.MAX_Y))
+        replay = TraceReplay(path, prefetch=8)
+        self.assertEqual(replay.dimensions, (self.MAX_X, self.MAX_Y))
+        self.assertTrue(np.array_equal(replay.run(200), trajectory))
+        # the replay stops at the end of the trace
+        self.assertEqual(len(replay.run(300)), 200)
+        replay.close()
+        replay = TraceReplay(path, start=10, stop=150, step=7)
+        self.assertTrue(np.array_equal(replay.run(100), trajectory[10:150:7]))
+        replay.close()
+        # contacts computed on the replayed movement are those of the original movement
+        recorded = list(contact.mobility_contact(iter(trajectory), engine='grid', contact_range=10.))
+        replayed = list(contact.mobility_contact(trace_replay(path), engine='grid', contact_range=10.))
+        self.assertEqual(recorded, replayed)
+
+class ExportTestCase(FileTestCase):
+
+    def test_one_movement(self):
+        from pymobility.export import write_one_movement
+        import os
+        path = os.path.join(self.directory, 'movement.txt.gz')
+        model = RandomWaypoint(self.nr_nodes, (self.MAX_X, self.MAX_Y), seed=1)
+        trajectory = model.run(20)
+        write_one_movement(model, path, 20, (self.MAX_X, self.MAX_Y), dt=0.5, block=150)
+        lines = np.loadtxt(path, skiprows=1)
+        self.assertEqual(lines.shape, (20 * self.nr_nodes, 4))
+        self.assertTrue(np.allclose(lines[:,0], np.repeat(np.arange(20) * 0.5, self.nr_nodes)))
+        self.assertTrue(np.allclose(lines[:,2:].reshape(trajectory.shape), trajectory, atol=1e-6))
+
+    def test_ns2_movement(self):
+        from pymobility.export import write_ns2_movement
+        import os
+        path = os.path.join(self.directory, 'movement.tcl')
+        write_ns2_movement(RandomWaypoint(self.nr_nodes, (self.MAX_X, self.MAX_Y), seed=1), path, steps=10)
+        lines = open(path).read().splitlines()
+        self.assertEqual(lines[0].split()[:3], ['$node_(0)', 'set', 'X_'])
+        setdest = [line for line in lines if 'setdest' in line]
+        # one command for each moving node in each step but the last
+        self.assertTrue(0 < len(setdest) <= 9 * self.nr_nodes)
+        self.assertEqual(len(lines), 3 * self.nr_nodes + len(setdest))
+
+    def test_one_connectivity(self):
+        from pymobility.export import write_one_connectivity
+        import os
+        path = os.path.join(self.directory, 'connectivity.txt')
+        steps = [[(0, 1), (2, 3), (4, 4)], [(1, 0)], [], [(0, 1)]]
+        write_one_connectivity(iter(steps), path)
+        self.assertEqual(open(path).read().splitlines(), [
+            '0.000 CONN 0 1 up', '0.000 CONN 2 3 up', '1.000 CONN 2 3 down',
+            '2.000 CONN 0 1 down', '3.000 CONN 0 1 up'])
+
 class ContactModelTestCase(unittest.TestCase):
     
     def test_modelB(self):
@@ -127,7 +380,8 @@ class ContactModelTestCase(unittest.TestCase):
         for contacts in modelB(b0,b1,mu,PI,f,N,seed_value=0xbbbbbb):
             t += 1
             if t==10000:
-                assert contacts == [(0, 91), (3, 16), (5, 98), (8, 84), (16, 3), (21, 54), (24, 47), (27, 78), (36, 72), (47, 24), (52, 94), (54, 21), (55, 61), (58, 59), (59, 58), (61, 55), (72, 36), (78, 27), (84, 8), (91, 0), (94, 52), (98, 5)]
+                # the random stream of Python 3
+                assert contacts == [(15, 47), (16, 78), (22, 66), (27, 75), (33, 73), (40, 72), (47, 15), (48, 77), (53, 82), (66, 22), (72, 40), (73, 33), (74, 88), (75, 27), (77, 48), (78, 16), (82, 53), (88, 74)]
                 break
             
     def test_model_het(self):
@@ -143,7 +397,8 @@ class ContactModelTestCase(unittest.TestCase):
         for contacts in model_het(f2,mu,PI,f,N,seed_value=0xbbbbbb):
             t += 1
             if t==10000:
-                assert contacts == [(0, 36), (1, 21), (2, 4), (3, 92), (4, 2), (5, 70), (5, 87), (6, 46), (7, 53), (8, 80), (8, 52), (9, 15), (10, 27), (11, 23), (12, 90), (13, 81), (14, 34), (15, 9), (18, 35), (19, 75), (20, 98), (21, 1), (22, 78), (23, 11), (24, 58), (25, 26), (26, 25), (27, 10), (28, 31), (29, 95), (30, 50), (31, 28), (32, 79), (33, 68), (34, 14), (35, 18), (36, 0), (37, 44), (38, 47), (39, 55), (40, 74), (41, 63), (42, 73), (43, 93), (44, 37), (45, 67), (46, 6), (47, 38), (48, 97), (49, 96), (50, 30), (51, 66), (52, 8), (52, 80), (53, 7), (54, 61), (55, 39), (57, 82), (58, 24), (60, 83), (61, 54), (62, 91), (63, 41), (65, 89), (66, 51), (67, 45), (68, 33), (70, 5), (70, 87), (73, 42), (74, 40), (75, 19), (76, 99), (77, 94), (78, 22), (79, 32), (80, 8), (80, 52), (81, 13), (82, 57), (83, 60), (87, 5), (87, 70), (89, 65), (90, 12), (91, 62), (92, 3), (93, 43), (94, 77), (95, 29), (96, 49), (97, 48), (98, 20), (99, 76)]
+                # the random stream of Python 3
+                assert contacts == [(0, 2), (1, 67), (2, 0), (3, 11), (4, 16), (5, 91), (6, 26), (7, 65), (8, 41), (9, 19), (10, 76), (11, 3), (12, 95), (13, 58), (14, 75), (15, 62), (16, 4), (17, 73), (18, 72), (19, 9), (20, 96), (21, 56), (21, 86), (21, 69), (22, 77), (23, 39), (24, 61), (25, 55), (26, 6), (27, 68), (28, 34), (29, 45), (29, 44), (30, 47), (31, 59), (32, 94), (33, 52), (34, 28), (35, 98), (36, 70), (37, 40), (38, 85), (39, 23), (40, 37), (41, 8), (44, 45), (44, 29), (45, 44), (45, 29), (47, 30), (48, 50), (49, 53), (50, 48), (52, 33), (53, 49), (54, 93), (55, 25), (56, 21), (56, 86), (56, 69), (57, 99), (58, 13), (59, 31), (60, 71), (61, 24), (62, 15), (64, 79), (65, 7), (66, 80), (67, 1), (68, 27), (69, 56), (69, 86), (69, 21), (70, 36), (71, 60), (72, 18), (73, 17), (75, 14), (76, 10), (77, 22), (79, 64), (80, 66), (81, 83), (83, 81), (85, 38), (86, 21), (86, 56), (86, 69), (91, 5), (93, 54), (94, 32), (95, 12), (96, 20), (98, 35), (99, 57)]
                 break
 
     def test_dynamic_gnp(self):
@@ -155,6 +410,24 @@ class ContactModelTestCase(unittest.TestCase):
             for i,j in contacts:
                 self.assertNotEqual(i,j)
                 
+    def test_dynamic_gnp_sparse(self):
+        np.random.seed(0xffffff)
+        n, p = 100000, 2e-5
+        pairs = n * (n - 1) / 2.
+        edges = next(contact.dynamic_gnp(n, p, output='edges')).astype(np.int64)
+        self.assertTrue(np.all(edges[:,0] < edges[:,1]))
+        self.assertTrue(np.all(edges[:,1] < n))
+        keys = edges[:,0] * n + edges[:,1]
+        self.assertTrue(np.all(np.diff(keys) > 0))
+        self.assertLess(abs(len(edges) - p * pairs), 5 * np.sqrt(p * pairs))
+        # a small graph covers the pairs uniformly
+        counts = np.zeros((5, 5))
+        for _, contacts in zip(range(2000), contact.dynamic_gnp(5, 0.3)):
+            for i, j in contacts:
+                counts[i, j] += 1
+        upper = counts[np.triu_indices(5, 1)] / 2000.
+        self.assertTrue(np.all(np.abs(upper - 0.3) < 0.05))
+
     def test_dynamic_gnm(self):
         n = 10
         m = 5
@@ -165,6 +438,19 @@ class ContactModelTestCase(unittest.TestCase):
             for i,j in contacts:
                 self.assertNotEqual(i,j)
                 
+    def test_dynamic_gnm_distinct(self):
+        n = 10
+        pairs = n * (n - 1) // 2
+        for m in (1, 20, 30, pairs - 1, pairs):
+            for contacts in [next(contact.dynamic_gnm(n, m)) for _ in range(20)]:
+                self.assertEqual(len(set((min(i, j), max(i, j)) for i, j in contacts)), m)
+        self.assertRaises(Exception, next, contact.dynamic_gnm(n, pairs + 1))
+        # each pair is drawn with probability m / pairs
+        counts = np.zeros((n, n))
+        for _, edges in zip(range(2000), contact.dynamic_gnm(n, 9, output='edges')):
+            counts[edges[:,0], edges[:,1]] += 1
+        self.assertTrue(np.all(np.abs(counts[np.triu_indices(n, 1)] / 2000. - 0.2) < 0.05))
+
     def test_edge_markovian_empty(self):
         n = 10
         p = 0.
@@ -192,6 +478,29 @@ class ContactModelTestCase(unittest.TestCase):
             for i,j in contacts:
                 self.assertNotEqual(i,j)
 
+    def test_edge_markovian_sparse(self):
+        n = 10
+        for p, q, g in ((0., 1., 0.), (1., 1., 0.)):
+            em = contact.edge_markovian(n, p, q, g, engine='sparse')
+            for i in range(5):
+                contacts = next(em)
+                self.assertEqual(len(contacts), (n*(n-1))/2 if p and i%2 == 0 else 0)
+        # the stationary edge density is p/(p+q)
+        np.random.seed(0xffffff)
+        n, p, q = 100, 0.002, 0.05
+        em = contact.edge_markovian(n, p, q, engine='sparse', output='edges')
+        counts = [len(edges) for _, edges in zip(range(2000), em)]
+        self.assertAlmostEqual(np.mean(counts[500:]) / (n*(n-1)/2.), p / (p + q), places=3)
+        self.assertRaises(Exception, next, contact.edge_markovian(n, p, q, engine='matrix'))
+
+    def test_edge_markovian_packed(self):
+        # the number of pairs is not a multiple of 8, so the last byte of the state is padded
+        np.random.seed(0xffffff)
+        n, p, q = 100, 0.02, 0.05
+        em = contact.edge_markovian(n, p, q, output='edges')
+        counts = [len(edges) for _, edges in zip(range(2000), em)]
+        self.assertAlmostEqual(np.mean(counts[500:]) / (n*(n-1)/2.), p / (p + q), places=2)
+
     def test_continuous_time_edge_markovian(self):
         n = 10
         lmbd = 50.
@@ -199,6 +508,71 @@ class ContactModelTestCase(unittest.TestCase):
         for i in range(50):
             contacts = next(model)
             
+    def test_calendar_queue(self):
+        for size in (None, 100):
+            calendar = contact.CalendarQueue(horizon=4, size=size)
+            calendar.push(np.arange(10), [3, 0, 9, 3, 50, 2, 1, 1, 7, 3])
+            popped = [calendar.pop(t).tolist() for t in range(5)]
+            self.assertEqual(popped, [[1], [6, 7], [5], [0, 3, 9], []])
+            calendar.push([1, 6], [6, 12])
+            popped = [calendar.pop(t).tolist() for t in range(5, 51)]
+            self.assertEqual([(t, keys) for t, keys in enumerate(popped, 5) if keys],
+                             [(6, [1]), (7, [8]), (9, [2]), (12, [6]), (50, [4])])
+        # keys scheduled in later windows and eras, also while popping
+        np.random.seed(0xffffff)
+        calendar = contact.CalendarQueue(horizon=4, size=1000)
+        steps = np.random.randint(0, 200, 1000)
+        calendar.push(np.arange(500), steps[:500])
+        popped = [calendar.pop(t) for t in range(100)]
+        calendar.push(np.arange(500, 1000), 100 + steps[500:] // 2)
+        popped += [calendar.pop(t) for t in range(100, 200)]
+        steps[500:] = 100 + steps[500:] // 2
+        for t, keys in enumerate(popped):
+            self.assertEqual(keys.tolist(), np.flatnonzero(steps == t).tolist())
+
+    def test_sum_tree(self):
+        tree = contact.SumTree([1., 0., 2., 3., 0.5])
+        self.assertEqual(tree.total(), 6.5)
+        self.assertEqual([tree.find(u) for u in (0., 0.9, 1., 2.9, 3., 5.9, 6., 6.4)], [0, 0, 2, 2, 3, 3, 4, 4])
+        tree[0] = 0.
+        tree[1] = 4.
+        self.assertEqual(tree.total(), 9.5)
+        self.assertEqual([tree.find(u) for u in (0., 3.9, 4.)], [1, 1, 2])
+
+    def test_inactive_pool(self):
+        # the lazily updated weights give the same distribution as the current ones
+        import random
+        random.seed(0xbbbbbb)
+        PI = lambda x,y : 1./(1+1.*(x-y)/10)
+        t_lc = [0, 5, 20, 40, 0, 60]
+        eta = [1., 2., 1., .5, 1., 3.]
+        pool = contact.InactivePool(t_lc, 60, PI, eta)
+        pool.remove(4)
+        weights = np.array([eta[i] * PI(100, t_lc[i]) if i != 4 else 0. for i in range(6)])
+        counts = np.bincount([pool.choice(100) for _ in range(20000)], minlength=6)
+        self.assertTrue(np.allclose(counts / 20000., weights / weights.sum(), atol=0.01))
+        # the 'linear' engine weights each agent by its own eta, as the 'tree' engine
+        choice = contact.inactive_partner_choice
+        linear = np.bincount([choice(t_lc, 100, [0, 1, 2, 3, 5], PI, eta) for _ in range(20000)], minlength=6)
+        self.assertTrue(np.allclose(linear / 20000., counts / 20000., atol=0.015))
+        # an agent with eta 0 is never chosen
+        eta[1] = 0.
+        pool = contact.InactivePool(t_lc, 60, PI, eta)
+        self.assertNotIn(1, [pool.choice(100) for _ in range(2000)])
+        self.assertRaises(Exception, next, modelB(.51, .86, .95, PI, PI, 50, engine='heap'))
+
+    def test_continuous_time_sparse(self):
+        # both engines give the same contacts from the same seed
+        for model, arg in ((contact.continuous_time_edge_markovian, 5.),
+                           (contact.broad_continuous_time_edge_markovian, 1.6)):
+            frames = []
+            for engine in ('dense', 'sparse'):
+                np.random.seed(0xffffff)
+                m = model(40, arg, engine=engine, output='edges')
+                frames.append([edges for _, edges in zip(range(1000), m)])
+            for dense, sparse in zip(*frames):
+                self.assertTrue(np.array_equal(dense, sparse))
+
     def test_broad_continuous_time_edge_markovian(self):
         n = 10
         alpha = 1.6
@@ -206,3 +580,161 @@ class ContactModelTestCase(unittest.TestCase):
         for i in range(50):
             contacts = next(model)
 
+
+    def check_events(self, create_model, steps=50):
+        # replaying the events gives the contacts of the same model with the same seed
+        np.random.seed(0xffffff)
+        lists = [sorted((min(i, j), max(i, j)) for i, j in contacts)
+                 for _, contacts in zip(range(steps), create_model(False))]
+        np.random.seed(0xffffff)
+        current = set()
+        for t, (events, contacts) in enumerate(zip(create_model(True), lists)):
+            self.assertEqual(events.shape[1], 4)
+            self.assertTrue(np.all(events[:,0] == t))
+            self.assertTrue(np.all(events[:,1] < events[:,2]))
+            for _, i, j, up in events.tolist():
+                self.assertEqual((i, j) in current, not up)
+                if up: current.add((i, j))
+                else: current.remove((i, j))
+            self.assertEqual(sorted(current), sorted(set(contacts)))
+
+    def test_events(self):
+        self.check_events(lambda events: contact.dynamic_gnp(20, 0.1, events=events))
+        self.check_events(lambda events: contact.dynamic_gnm(20, 10, events=events))
+        self.check_events(lambda events: contact.edge_markovian(20, 0.1, 0.3, 0.2, events=events))
+        self.check_events(lambda events: contact.edge_markovian(20, 0.1, 0.3, 0.2, events=events, engine='sparse'))
+        self.check_events(lambda events: contact.continuous_time_edge_markovian(20, 5., events=events))
+        self.check_events(lambda events: contact.broad_continuous_time_edge_markovian(20, 1.6, events=events))
+        self.check_events(lambda events: contact.continuous_time_edge_markovian(20, 5., events=events, engine='sparse'))
+        self.check_events(lambda events: contact.broad_continuous_time_edge_markovian(20, 1.6, events=events, engine='sparse'))
+        for engine in ('cdist', 'grid', 'verlet'):
+            self.check_events(lambda events: contact.mobility_contact(
+                random_waypoint(50, (20, 20), velocity=(0.1, 0.5)), 2., engine=engine, events=events))
+        PI = lambda x,y : 1./(1+1.*(x-y)/50)
+        self.check_events(lambda events: modelB(.51, .86, .95, PI, PI, 50, seed_value=1, events=events), 2000)
+        self.check_events(lambda events: model_het(lambda x: .5, .86, PI, PI, 50, seed_value=1, events=events), 2000)
+        self.check_events(lambda events: modelB(.51, .86, .95, PI, PI, 50, seed_value=1, events=events, engine='tree'), 2000)
+        self.check_events(lambda events: model_het(lambda x: .5, .86, PI, PI, 50, seed_value=1, events=events, engine='tree'), 2000)
+
+    def test_output(self):
+        PI = lambda x,y : 1./(1+1.*(x-y)/50)
+        models = [lambda output: contact.dynamic_gnp(20, 0.1, output=output),
+                  lambda output: contact.dynamic_gnm(20, 10, output=output),
+                  lambda output: contact.edge_markovian(20, 0.1, 0.3, 0.2, output=output),
+                  lambda output: contact.edge_markovian(20, 0.1, 0.3, 0.2, output=output, engine='sparse'),
+                  lambda output: contact.continuous_time_edge_markovian(20, 5., output=output),
+                  lambda output: contact.continuous_time_edge_markovian(20, 5., output=output, engine='sparse'),
+                  lambda output: contact.mobility_contact(
+                      random_waypoint(50, (20, 20), velocity=(0.1, 0.5)), 2., engine='grid', output=output),
+                  lambda output: modelB(.51, .86, .95, PI, PI, 50, seed_value=1, output=output)]
+        for create_model in models:
+            frames = {}
+            for output in ('list', 'edges', 'coo', 'csr'):
+                np.random.seed(0xffffff)
+                frames[output] = [contact.contact_pairs(c) for _, c in zip(range(200), create_model(output))]
+            for t, pairs in enumerate(frames['list']):
+                pairs = sorted(set((min(i, j), max(i, j)) for i, j in pairs.tolist()))
+                pairs = [list(pair) for pair in pairs]
+                self.assertEqual(frames['edges'][t].tolist(), pairs)
+                self.assertEqual(sorted(frames['coo'][t].tolist()), pairs)
+                self.assertEqual(frames['csr'][t].tolist(), pairs)
+        edges = next(contact.dynamic_gnp(20, 0.5, output='edges'))
+        self.assertEqual(edges.dtype, np.int32)
+        self.assertTrue(edges.flags.c_contiguous)
+        self.assertRaises(Exception, next, contact.dynamic_gnp(20, 0.5, output='tuples'))
+
+    def test_mobility_contact_grid(self):
+        np.random.seed(0xffffff)
+        xy = np.random.rand(200, 2) * 10
+        cdist_model = contact.mobility_contact(iter([xy]), contact_range=1., engine='cdist')
+        grid_model = contact.mobility_contact(iter([xy]), contact_range=1., engine='grid')
+        self.assertEqual(next(grid_model), next(cdist_model))
+
+    def test_continuous_contacts(self):
+        # node 0 crosses node 1 during the first step, and stays in contact with node 2 for two steps
+        frames = [np.array([[0., 0.], [5., 0.6], [50., 50.], [50.5, 50.]]),
+                  np.array([[10., 0.], [5., 0.6], [50., 50.], [50.5, 50.]]),
+                  np.array([[10., 0.], [5., 0.6], [50., 50.], [55., 50.]])]
+        model = contact.continuous_contacts(contact.frame_segments(iter(frames)), contact_range=1.)
+        intervals = next(model)
+        self.assertEqual(len(intervals), 1)
+        i, j, t_start, t_end = intervals[0]
+        self.assertEqual((i, j), (0, 1))
+        self.assertAlmostEqual(t_start, 0.42)
+        self.assertAlmostEqual(t_end, 0.58)
+        intervals = next(model)
+        self.assertEqual(len(intervals), 1)
+        i, j, t_start, t_end = intervals[0]
+        self.assertEqual((i, j, t_start), (2, 3, 0.))
+        self.assertAlmostEqual(t_end, 1. + 1/9.)
+
+    def test_continuous_contacts_open(self):
+        # a pair in contact for the whole run ends with the last window
+        frames = [np.array([[0., 0.], [0.5, 0.], [10., 10.]])] * 3
+        model = contact.continuous_contacts(contact.frame_segments(iter(frames)), contact_range=1.)
+        self.assertEqual(list(model), [[], [(0, 1, 0., 2.)]])
+
+    def test_continuous_contacts_wrap(self):
+        # node 0 wraps around the border from x=99.9 to x=0.1, without crossing the other nodes
+        start = np.array([[99.9, 50.]] + [[10. * k, 50.] for k in range(1, 10)])
+        end = start.copy()
+        end[0, 0] = 0.1
+        segments = list(contact.frame_segments(iter([start, end]), dimensions=(100., 100.)))
+        self.assertTrue(np.allclose(segments[0][3][0], [100.1, 50.]))
+        model = contact.continuous_contacts(iter(segments), contact_range=1.)
+        self.assertEqual(list(model), [[]])
+
+    def test_continuous_contacts_wrap_windows(self):
+        # node 0 moves 1 per step to the right and wraps onto node 1, at x=2.5
+        frames = [np.array([[x, 50.], [2.5, 50.]]) for x in (98.5, 99.5, 0.5, 1.5, 2.5, 3.5)]
+        segments = list(contact.frame_segments(iter(frames), dimensions=(100., 100.)))
+        self.assertTrue(np.allclose([segment[2][0, 0] for segment in segments], [98.5, 99.5, 0.5, 1.5, 2.5]))
+        self.assertTrue(np.allclose([segment[3][0, 0] for segment in segments], [99.5, 100.5, 1.5, 2.5, 3.5]))
+        intervals = sum(contact.continuous_contacts(iter(segments), contact_range=1.), [])
+        self.assertEqual(len(intervals), 1)
+        i, j, t_start, t_end = intervals[0]
+        self.assertEqual((i, j), (0, 1))
+        self.assertAlmostEqual(t_start, 3.)
+        self.assertAlmostEqual(t_end, 5.)
+
+    def test_mobility_contact_verlet(self):
+        from pymobility.models.mobility import random_waypoint
+        np.random.seed(0xffffff)
+        steps = 200
+        frames = [xy.copy() for _, xy in zip(range(steps), random_waypoint(200, (20, 20), velocity=(0.1, 0.5)))]
+        cdist_model = contact.mobility_contact(iter(frames), contact_range=1., engine='cdist')
+        verlet_model = contact.mobility_contact(iter(frames), contact_range=1., engine='verlet', skin=2.)
+        for _ in range(steps):
+            self.assertEqual(next(verlet_model), next(cdist_model))
+
+class AnalysisTestCase(unittest.TestCase):
+
+    def test_intervals(self):
+        # pair (0, 1) in contact at steps 0-1 and 4, pair (1, 2) at step 2, listed in both orders
+        frames = [[(0, 1)], [(1, 0)], [(2, 1), (1, 2)], [], [(0, 1)]]
+        intervals = analysis.frame_intervals(frames)
+        self.assertEqual(intervals.tolist(), [[0, 1, 0, 2], [0, 1, 4, 5], [1, 2, 2, 3]])
+        events = contact.contact_events(frames)
+        self.assertEqual(analysis.event_intervals(events).tolist(), intervals.tolist())
+        self.assertEqual(analysis.contact_durations(intervals).tolist(), [2, 1, 1])
+        self.assertEqual(analysis.inter_contact_times(intervals[::-1]).tolist(), [2])
+        self.assertEqual([c.tolist() for c in analysis.contacts_per_link(intervals)], [[0, 1], [1, 2], [2, 1]])
+        # records with times in seconds, 20 seconds apart
+        t, i, j = analysis.contact_records(frames)
+        self.assertEqual(analysis.contact_intervals(t * 20 + 100, i, j, dt=20).tolist(),
+                         [[0, 1, 100, 140], [0, 1, 180, 200], [1, 2, 140, 160]])
+
+    def test_model_intervals(self):
+        np.random.seed(0xffffff)
+        n, p, q, steps = 20, 0.05, 0.5, 2000
+        intervals = analysis.frame_intervals(
+            contacts for _, contacts in zip(range(steps), contact.edge_markovian(n, p, q)))
+        np.random.seed(0xffffff)
+        events = [e for _, e in zip(range(steps), contact.edge_markovian(n, p, q, events=True))]
+        self.assertEqual(analysis.event_intervals(events, end=steps).tolist(), intervals.tolist())
+        # the contact durations are geometric with parameter q, apart from those cut at the end
+        durations = analysis.contact_durations(intervals[intervals[:,3] < steps])
+        self.assertAlmostEqual(np.mean(durations), 1. / q, places=1)
+        histogram, edges = analysis.log_histogram(durations, bins=10, integer=True)
+        self.assertEqual(edges[0], 1)
+        self.assertAlmostEqual(np.sum(histogram * np.diff(edges)), 1.)
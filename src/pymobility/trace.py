@@ -0,0 +1,259 @@
+# coding: utf-8
+#
+#  Copyright (C) 2012 Istituto per l'Interscambio Scientifico I.S.I.
+#  You can contact us by email (isi@isi.it) or write to:
+#  ISI Foundation, Via Alassio 11/c, 10126 Torino, Italy.
+#
+#  This program was written by André Panisson <panisson@gmail.com>
+#
+'''
+Trajectory files: stores the frames yielded by the mobility models in a binary file,
+written in chunks of frames as the simulation runs, and memory-mapped for reading.
+
+The file starts with a header block (the MAGIC string, the length of a JSON
+description of the frames, and the description itself), padded to a multiple of
+ALIGNMENT bytes. The frames follow, each one stored as a C-ordered array of
+shape (nr_nodes, ndim), so that frame t starts at a fixed offset. The number of
+frames is given by the file size, so a file is always readable up to its last
+complete frame, even while it is being written.
+'''
+import json
+import mmap
+import struct
+import numpy as np
+
+MAGIC = b'PYMTRACE'
+VERSION = 1
+ALIGNMENT = 4096
+
+class TraceWriter(object):
+
+    def __init__(self, path, dimensions=None, dtype=None, quantize=None, chunk=64):
+        '''
+        Writes a sequence of frames (arrays of node positions, with shape (nr_nodes, ndim))
+        to the trajectory file *path*. The frames are copied into a buffer and written
+        in chunks of *chunk* frames; close (or the end of a with block) writes the rest.
+
+        Required arguments:
+
+          *path*:
+            String, the path of the file, which is created or overwritten.
+
+        keyword arguments:
+
+          *dimensions*:
+            Tuple of Doubles, the dimensions of the simulation area,
+            stored in the file and required for quantization.
+
+          *dtype*:
+            The floating point type of the stored positions.
+            If None, the type of the first frame is used.
+
+          *quantize*:
+            An unsigned integer type, e.g. numpy.uint16. If set, each coordinate is stored
+            as an integer between 0 and the largest value of the type, spanning the
+            dimension of the area: with numpy.uint16 the positions take 2 bytes, and the
+            error is at most dimension/131070.
+
+          *chunk*:
+            Integer, the number of frames written at once.
+        '''
+        if quantize is not None:
+            if dimensions is None:
+                raise Exception("The parameter 'dimensions' is required for quantization")
+            if np.dtype(quantize).kind != 'u':
+                raise Exception("Quantization requires an unsigned integer type")
+        self.path = path
+        self.dimensions = dimensions
+        self.dtype = dtype
+        self.quantize = quantize
+        self.chunk = chunk
+        self.file = open(path, 'wb')
+        self.buffer = None
+        self.position = 0
+        self.steps = 0
+
+    def write_header(self, xy):
+        shape = xy.shape
+        if self.dtype is None:
+            self.dtype = xy.dtype
+        header = {
+            'version': VERSION,
+            'shape': list(shape),
+            'dtype': np.dtype(self.dtype).str,
+            'quantize': None if self.quantize is None else np.dtype(self.quantize).str,
+            'dimensions': None if self.dimensions is None else [float(d) for d in self.dimensions],
+        }
+        text = json.dumps(header).encode('ascii')
+        size = len(MAGIC) + 4 + len(text)
+        text += b' ' * (-size % ALIGNMENT)
+        self.file.write(MAGIC + struct.pack('<I', len(text)) + text)
+
+        storage = self.dtype if self.quantize is None else self.quantize
+        self.buffer = np.empty((self.chunk,) + shape, dtype=storage)
+        if self.quantize is not None:
+            # positions per quantization level, in each dimension
+            self.scale = np.array(self.dimensions, dtype=float) / np.iinfo(self.quantize).max
+            self.scratch = np.empty(shape)
+
+    def write(self, xy):
+        '''
+        Appends the frame *xy*.
+        '''
+        if self.buffer is None:
+            self.write_header(xy)
+        elif xy.shape != self.buffer.shape[1:]:
+            raise Exception("The frames should have shape %s" % (self.buffer.shape[1:],))
+
+        if self.quantize is None:
+            self.buffer[self.position] = xy
+        else:
+            np.divide(xy, self.scale, out=self.scratch)
+            np.rint(self.scratch, out=self.scratch)
+            np.clip(self.scratch, 0, np.iinfo(self.quantize).max, out=self.scratch)
+            self.buffer[self.position] = self.scratch
+        self.position += 1
+        self.steps += 1
+        if self.position == self.chunk:
+            self.flush()
+
+    def extend(self, frames, steps=None):
+        '''
+        Appends the frames yielded by *frames* (e.g. a mobility model),
+        or only the first *steps* of them if *steps* is not None.
+        '''
+        if steps is not None:
+            frames = (xy for _, xy in zip(range(steps), frames))
+        for xy in frames:
+            self.write(xy)
+
+    def flush(self):
+        '''
+        Writes the buffered frames to the file.
+        '''
+        if self.position > 0:
+            self.buffer[:self.position].tofile(self.file)
+            self.position = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class TraceReader(object):
+
+    def __init__(self, path):
+        '''
+        Reads the trajectory file *path*, written by TraceWriter.
+        The frames are memory-mapped: getting frame t, or a window of frames,
+        takes constant time, and returns a view of the file, without copying,
+        unless the positions were quantized (then the positions are converted
+        to floating point values, in a new array).
+
+        The attributes nr_nodes, ndim, dimensions and steps (the number of frames)
+        describe the trajectory, and frames is the memory-mapped array of all the
+        stored frames, with shape (steps, nr_nodes, ndim).
+        '''
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise Exception("%s is not a trajectory file" % path)
+            length, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(length).decode('ascii'))
+            f.seek(0, 2)
+            size = f.tell()
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offset = len(MAGIC) + 4 + length
+        self.shape = tuple(header['shape'])
+        self.nr_nodes, self.ndim = self.shape[-2:]
+        self.dtype = np.dtype(header['dtype'])
+        self.quantize = header['quantize'] and np.dtype(header['quantize'])
+        self.dimensions = header['dimensions'] and tuple(header['dimensions'])
+
+        storage = self.dtype if self.quantize is None else self.quantize
+        self.frame_bytes = storage.itemsize * int(np.prod(self.shape))
+        # the last frame may be incomplete if the file is being written
+        self.steps = (size - self.offset) // self.frame_bytes
+        self.frames = np.frombuffer(self.mmap, dtype=storage, count=self.steps * int(np.prod(self.shape)),
+                                    offset=self.offset).reshape((self.steps,) + self.shape)
+        if self.quantize is not None:
+            self.scale = (np.array(self.dimensions) / np.iinfo(self.quantize).max).astype(self.dtype)
+
+    def __len__(self):
+        return self.steps
+
+    def decode(self, frames, out=None):
+        if self.quantize is None:
+            return frames
+        return np.multiply(frames, self.scale, out=out)
+
+    def frame(self, t, out=None):
+        '''
+        Returns the positions at step *t*.
+        For quantized traces, the positions are written in *out*, if given.
+        '''
+        return self.decode(self.frames[t], out)
+
+    def prefetch(self, start, stop):
+        '''
+        Advises the operating system that the frames from step *start* to step *stop* (excluded)
+        will be read soon, so that they are read from disk in the background.
+        Does nothing where madvise is not available.
+        '''
+        if not hasattr(self.mmap, 'madvise') or not hasattr(mmap, 'MADV_WILLNEED'):
+            return
+        start, stop = max(start, 0), min(stop, self.steps)
+        if start >= stop: return
+        begin = self.offset + start * self.frame_bytes
+        # madvise needs a page-aligned start
+        aligned = begin - begin % mmap.PAGESIZE
+        self.mmap.madvise(mmap.MADV_WILLNEED, aligned, self.offset + stop * self.frame_bytes - aligned)
+
+    def window(self, start, stop, step=1):
+        '''
+        Returns the positions from step *start* to step *stop* (excluded), every *step* steps,
+        as an array with shape (steps, nr_nodes, ndim).
+        '''
+        return self.decode(self.frames[start:stop:step])
+
+    def __getitem__(self, index):
+        return self.decode(self.frames[index])
+
+    def __iter__(self):
+        for t in range(self.steps):
+            yield self.frame(t)
+
+    def close(self):
+        '''
+        Releases the memory map of the file. The frames returned before must not be used after
+        closing; while some of them are still referenced, the map is released with the last one.
+        '''
+        if self.mmap is None: return
+        self.frames = None
+        try:
+            self.mmap.close()
+        except BufferError:
+            # numpy views of the map are still alive
+            pass
+        self.mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_trace(path, model, steps, **kwargs):
+    '''
+    Records the first *steps* frames yielded by *model* (e.g. a mobility model)
+    in the trajectory file *path*. The keyword arguments are passed to TraceWriter.
+    '''
+    with TraceWriter(path, **kwargs) as writer:
+        writer.extend(model, steps)